@@ -0,0 +1,308 @@
+"""
+OpenAI API 呼び出しの共通処理。
+- プロセスで1つの OpenAI クライアント（HTTP の接続をキープアライブで使い回す）（get_client）
+- エンドポイントごとの1分あたりのリクエスト数制限（RateLimiter, トークンバケット）
+- 429 / 5xx / 接続エラーの指数バックオフ付きリトライ（call_with_retry）
+- プロセス全体での同時API呼び出し数の上限（set_api_budget / api_slot）
+- 呼び出しごとの時間・バイト数・トークン数の記録（call_api → work/api_metrics.jsonl）
+
+    python api_client.py        # 記録の集計を表示
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+from openai import APIConnectionError, APIStatusError, DefaultHttpxClient, OpenAI
+
+import tracing
+
+load_dotenv()
+
+# リトライ対象のHTTPステータス
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# エンドポイントごとの1分あたりリクエスト上限（アカウントのTierに合わせて調整）
+ENDPOINT_RPM = {
+    "transcription": 50,
+    "responses": 500,
+    "images": 5,
+}
+
+# 1回の呼び出しの上限時間（秒）。画像生成は1分を超えることがある
+TIMEOUT = 300.0
+
+METRICS_PATH = Path("work/api_metrics.jsonl")
+
+
+class RateLimiter:
+    """
+    1分あたり rpm 回までに呼び出しを間引く（トークンバケット）。
+    バケットには最大 burst 個のトークンがあり、60/rpm 秒ごとに1個ずつ補充される。
+    burst=1 なら呼び出し開始時刻が 60/rpm 秒ずつ空く。複数スレッドから acquire() してよい。
+    rpm が 0 以下なら制限しない。
+    """
+
+    def __init__(self, rpm: float, burst: int = 1):
+        self.interval = 60.0 / rpm if rpm and rpm > 0 else 0.0
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def acquire(self) -> None:
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) / self.interval)
+            self._updated = now
+            # 足りない分は前借りして、補充されるまで待つ（待っている順に通る）
+            self._tokens -= 1
+            wait = -self._tokens * self.interval if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+_budget: threading.BoundedSemaphore | None = None
+
+
+def shared_limiter(name: str, rpm: float | None = None, burst: int = 1) -> RateLimiter:
+    """
+    エンドポイントごとに1つの RateLimiter を共有する。
+    複数の本を同時に処理しても、1分あたりの上限はプロセス全体で守られる。
+    rpm を省略すると ENDPOINT_RPM の値を使う。
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = RateLimiter(ENDPOINT_RPM.get(name, 0) if rpm is None else rpm, burst)
+        return limiter
+
+
+def set_api_budget(max_in_flight: int | None) -> None:
+    """プロセス全体で同時に投げるAPI呼び出しの数を制限する（None で無制限）。"""
+    global _budget
+    _budget = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+
+
+@contextmanager
+def api_slot():
+    """API 呼び出し1回分の枠を確保する。"""
+    budget = _budget
+    if budget is None:
+        yield
+        return
+    with budget:
+        yield
+
+
+def _retry_after(err: Exception):
+    """Retry-After ヘッダがあれば秒数で返す。"""
+    response = getattr(err, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_retryable(err: Exception) -> bool:
+    if isinstance(err, APIStatusError):
+        return err.status_code in RETRY_STATUS
+    return isinstance(err, APIConnectionError)  # APITimeoutError も含む
+
+
+def call_with_retry(fn, *, limiter: RateLimiter | None = None, retries: int = 5,
+                    base_delay: float = 1.0, max_delay: float = 60.0, label: str = ""):
+    """
+    fn() を呼び、リトライ可能なエラーなら指数バックオフ（ジッター付き）で再試行する。
+    Retry-After が返ってきた場合はそちらを優先する。
+    """
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            with api_slot():
+                return fn()
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = min(max_delay, base_delay * (2 ** attempt))
+                delay = delay * (0.5 + random.random() / 2)
+            attempt += 1
+            status = getattr(e, "status_code", type(e).__name__)
+            print(f"   ⚠️ {label} retry {attempt}/{retries} after {delay:.1f}s ({status})")
+            time.sleep(delay)
+
+
+# --- 共有クライアント ---------------------------------------------------------
+
+_clients: dict[str | None, OpenAI] = {}
+_clients_lock = threading.Lock()
+_io = threading.local()   # 実行中の call_api が送受信したバイト数（HTTP のフックから足す）
+
+
+def _on_request(request) -> None:
+    if getattr(_io, "active", False):
+        _io.sent += int(request.headers.get("content-length") or 0)
+
+
+def _on_response(response) -> None:
+    # 本文はこの後で読まれるので、レスポンスを覚えておいて呼び出しの後に数える
+    if getattr(_io, "active", False):
+        _io.responses.append(response)
+
+
+def get_client(base_url: str | None = None) -> OpenAI:
+    """
+    プロセスで共有する OpenAI クライアント（base_url ごとに1つ）。
+    HTTP の接続は使い回される（キープアライブ）。リトライは call_api 側で行うので SDK では行わない。
+    base_url を省略すると環境変数 OPENAI_BASE_URL（無ければ本物の API）。ローカルのスタブにも向けられる。
+    """
+    base_url = base_url or os.getenv("OPENAI_BASE_URL") or None
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                if base_url is None:
+                    raise RuntimeError("OPENAI_API_KEY が見つかりません。.env を確認してください。")
+                api_key = "local-stub"
+            http_client = DefaultHttpxClient(
+                timeout=TIMEOUT,
+                event_hooks={"request": [_on_request], "response": [_on_response]},
+            )
+            client = _clients[base_url] = OpenAI(api_key=api_key, base_url=base_url,
+                                                 http_client=http_client, max_retries=0)
+        return client
+
+
+def set_client(client, base_url: str | None = None) -> None:
+    """get_client(base_url) が返すクライアントを差し替える（偽の API で全体を動かすベンチマーク用）。"""
+    with _clients_lock:
+        _clients[base_url] = client
+
+
+# --- 記録 ---------------------------------------------------------------------
+
+_metrics_path: Path | None = METRICS_PATH
+_metrics_lock = threading.Lock()
+
+
+def set_metrics_path(path: Path | None) -> None:
+    """記録先を変える（None で記録しない）。"""
+    global _metrics_path
+    _metrics_path = path
+
+
+def record_call(endpoint: str, **fields) -> None:
+    """1回分の記録を JSON Lines で追記する。"""
+    path = _metrics_path
+    if path is None:
+        return
+    line = json.dumps({"ts": datetime.now().isoformat(timespec="milliseconds"), "endpoint": endpoint, **fields},
+                      ensure_ascii=False)
+    with _metrics_lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def usage_tokens(result) -> dict:
+    """応答の usage からトークン数を取り出す（無ければ空）。"""
+    usage = getattr(result, "usage", None)
+    if usage is None:
+        return {}
+    out = {}
+    for name in ("input_tokens", "output_tokens", "total_tokens"):
+        value = getattr(usage, name, None)
+        if isinstance(value, int):
+            out[name] = value
+    return out
+
+
+def call_api(endpoint: str, fn, *, limiter: RateLimiter | None = None, label: str = "", **retry_opts):
+    """
+    endpoint（"transcription" / "responses" / "images"）の呼び出し fn() を、
+    そのエンドポイントのレート制限とリトライ付きで行い、結果を記録する。
+    """
+    limiter = limiter or shared_limiter(endpoint)
+    attempts = 0
+
+    def attempt():
+        nonlocal attempts
+        attempts += 1
+        tracing.count(f"api.{endpoint}")
+        return fn()
+
+    _io.active, _io.sent, _io.responses = True, 0, []
+    t0 = time.perf_counter()
+    status, result = "ok", None
+    try:
+        result = call_with_retry(attempt, limiter=limiter, label=label, **retry_opts)
+        return result
+    except Exception as e:
+        status = getattr(e, "status_code", None) or type(e).__name__
+        raise
+    finally:
+        received = sum(getattr(r, "num_bytes_downloaded", 0) for r in _io.responses)
+        _io.active, _io.responses = False, []
+        record_call(endpoint, label=label, status=status, attempts=attempts,
+                    seconds=round(time.perf_counter() - t0, 3), bytes_sent=_io.sent, bytes_received=received,
+                    **usage_tokens(result))
+
+
+def summarize(path: Path = METRICS_PATH) -> dict:
+    """記録をエンドポイントごとに集計する。"""
+    stats: dict[str, dict] = {}
+    if not path.exists():
+        return stats
+    for line in path.read_text(encoding="utf-8").splitlines():
+        m = json.loads(line)
+        s = stats.setdefault(m["endpoint"], {"calls": 0, "errors": 0, "retries": 0, "seconds": [],
+                                             "bytes_sent": 0, "bytes_received": 0,
+                                             "input_tokens": 0, "output_tokens": 0})
+        s["calls"] += 1
+        s["errors"] += m.get("status") != "ok"
+        s["retries"] += max(0, m.get("attempts", 1) - 1)
+        s["seconds"].append(m.get("seconds", 0.0))
+        for k in ("bytes_sent", "bytes_received", "input_tokens", "output_tokens"):
+            s[k] += m.get(k, 0) or 0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize API call metrics")
+    parser.add_argument("--metrics", type=Path, default=METRICS_PATH)
+    args = parser.parse_args()
+
+    stats = summarize(args.metrics)
+    if not stats:
+        print(f"(no metrics in {args.metrics})")
+        return
+    print(f"{'endpoint':<14}{'calls':>6}{'err':>5}{'retry':>6}{'p50 s':>8}{'max s':>8}"
+          f"{'sent MB':>9}{'recv MB':>9}{'in tok':>9}{'out tok':>9}")
+    for endpoint, s in sorted(stats.items()):
+        secs = sorted(s["seconds"])
+        print(f"{endpoint:<14}{s['calls']:>6}{s['errors']:>5}{s['retries']:>6}{secs[len(secs) // 2]:>8.2f}"
+              f"{secs[-1]:>8.2f}{s['bytes_sent'] / 1e6:>9.2f}{s['bytes_received'] / 1e6:>9.2f}"
+              f"{s['input_tokens']:>9}{s['output_tokens']:>9}")
+
+
+if __name__ == "__main__":
+    main()
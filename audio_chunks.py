@@ -0,0 +1,163 @@
+"""
+長い音声を分割して並列に文字起こしし、つなぎ目の重複を取り除いて1本のテキストにする。
+
+- 区間の決定: 一定幅（fixed）か、目標位置付近の無音（silence）で切る。前後に少し重ねる
+- 切り出し: ffmpeg（外部コマンド）
+- 結合: 重ねた部分の文字起こしが前後で重複するので、最長一致で重複を削る
+文字起こし自体は transcribe_fn(path) -> str を渡す形なので、ローカルのスタブでも試せる。
+"""
+import difflib
+import re
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from fileutil import atomic_write_bytes, sha256_file
+from tracing import bind, span
+
+DEFAULT_WINDOW = 300.0   # 1区間の長さ（秒）
+DEFAULT_OVERLAP = 4.0    # 前後の重なり（秒）
+SILENCE_SEARCH = 30.0    # 目標位置から前後何秒以内の無音を探すか
+
+
+def probe_duration(path: Path) -> float:
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(path)],
+        capture_output=True, text=True, check=True,
+    )
+    return float(out.stdout.strip())
+
+
+def detect_silences(path: Path, noise_db: int = -35, min_silence: float = 0.4) -> list[float]:
+    """無音区間の中央の時刻（秒）を返す。"""
+    p = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-nostats", "-i", str(path),
+         "-af", f"silencedetect=noise={noise_db}dB:d={min_silence}", "-f", "null", "-"],
+        capture_output=True, text=True,
+    )
+    starts = [float(x) for x in re.findall(r"silence_start: ([\d.]+)", p.stderr)]
+    ends = [float(x) for x in re.findall(r"silence_end: ([\d.]+)", p.stderr)]
+    return [(s + e) / 2 for s, e in zip(starts, ends)]
+
+
+def plan_windows(duration: float, window: float = DEFAULT_WINDOW, overlap: float = DEFAULT_OVERLAP,
+                 silences: list[float] | None = None) -> list[tuple[float, float]]:
+    """
+    [0, duration] を区間に分ける。silences が与えられたら、各切れ目を
+    目標位置に一番近い無音（±SILENCE_SEARCH 秒以内）に寄せる。
+    各区間は前後に overlap 秒ずつ重ねる。
+    """
+    if duration <= window:
+        return [(0.0, duration)]
+
+    cuts = []
+    pos = 0.0
+    while duration - pos > window:
+        target = pos + window
+        if silences:
+            near = [s for s in silences if pos + window / 2 < s < duration and abs(s - target) <= SILENCE_SEARCH]
+            if near:
+                target = min(near, key=lambda s: abs(s - target))
+        cuts.append(target)
+        pos = target
+
+    bounds = [0.0] + cuts + [duration]
+    return [
+        (max(0.0, a - overlap if i else a), min(duration, b + overlap if i < len(bounds) - 2 else b))
+        for i, (a, b) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+
+def cut_chunk(src: Path, start: float, end: float, dst: Path) -> Path:
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}",
+         "-i", str(src), "-vn", "-c", "copy", str(dst)],
+        check=True,
+    )
+    return dst
+
+
+def merge_pair(a: str, b: str, search: int = 200, min_match: int = 6) -> str:
+    """
+    a の末尾と b の先頭の重なり（同じ音声を2回文字起こしした部分）を1回分にする。
+    文字起こしは毎回少しずつ違うので、完全一致ではなく最長の共通部分で合わせる。
+    """
+    if not a:
+        return b
+    if not b:
+        return a
+    tail = a[-search:]
+    head = b[:search]
+    m = difflib.SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(0, len(tail), 0, len(head))
+    if m.size < min_match:
+        # 重なりが見つからない（区間の境目で話が途切れた）ときは、くっつけずに改行で区切る
+        return a + b if a[-1].isspace() or b[0].isspace() else f"{a}\n{b}"
+    cut_a = len(a) - len(tail) + m.a + m.size
+    return a[:cut_a] + b[m.b + m.size:]
+
+
+def merge_texts(texts: list[str], **kwargs) -> str:
+    merged = ""
+    for t in texts:
+        merged = merge_pair(merged, t.strip(), **kwargs)
+    return merged
+
+
+def _traced(transcribe_fn, path: Path, i: int) -> str:
+    with span(f"chunk {i + 1:03d}", cat="chunk", bytes=path.stat().st_size if path.exists() else 0):
+        return transcribe_fn(path)
+
+
+def transcribe_chunks(chunks: list[Path], transcribe_fn, out_path: Path | None = None, workers: int = 4,
+                      journal=None, keys: list[str] | None = None, force: bool = False) -> str:
+    """
+    chunks を並列に文字起こしして結合する。
+    out_path を渡すと、先頭から連続して終わった分を都度書き出す（途中経過が見える）。
+    journal と keys（区間ごとの識別子）を渡すと、終わった区間を記録し、記録済みの区間はそのテキストを使う。
+    force=True なら記録済みの区間も文字起こしし直す（記録はする）。
+    """
+    texts: list[str | None] = [None] * len(chunks)
+    if journal is not None and keys and not force:
+        for i, key in enumerate(keys):
+            entry = journal.last("chunk_done", key=key)
+            if entry is not None:
+                texts[i] = entry["text"]
+                print(f"   chunk {i + 1}/{len(chunks)} from run journal ({len(texts[i])} chars)")
+    written = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(bind(_traced), transcribe_fn, path, i): i
+                   for i, path in enumerate(chunks) if texts[i] is None}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            texts[i] = fut.result()
+            if journal is not None and keys:
+                journal.record("chunk_done", key=keys[i], text=texts[i])
+            print(f"   chunk {i + 1}/{len(chunks)} done ({len(texts[i])} chars)")
+            ready = 0
+            while ready < len(texts) and texts[ready] is not None:
+                ready += 1
+            if out_path is not None and ready > written:
+                atomic_write_bytes(out_path, merge_texts(texts[:ready]).encode("utf-8"))
+                written = ready
+    return merge_texts(texts)
+
+
+def transcribe_long(src: Path, transcribe_fn, out_path: Path | None = None, *, window: float = DEFAULT_WINDOW,
+                    overlap: float = DEFAULT_OVERLAP, split: str = "silence", workers: int = 4,
+                    journal=None, force: bool = False) -> str:
+    """src を区間に切って transcribe_chunks する（区間の識別子は音声の sha256 ＋ 区間の秒数）。"""
+    duration = probe_duration(src)
+    silences = detect_silences(src) if split == "silence" else None
+    windows = plan_windows(duration, window, overlap, silences)
+    print(f"🎧 {src.name}: {duration:.0f}s → {len(windows)} chunks ({split}, overlap {overlap}s)")
+
+    digest = sha256_file(src) if journal is not None else ""
+    keys = [f"{digest}:{a:.3f}-{b:.3f}" for a, b in windows]
+
+    with tempfile.TemporaryDirectory(prefix="chunks_") as tmp:
+        chunks = [
+            cut_chunk(src, a, b, Path(tmp) / f"{i:03d}{src.suffix}")
+            for i, (a, b) in enumerate(windows)
+        ]
+        return transcribe_chunks(chunks, transcribe_fn, out_path, workers, journal, keys, force=force)
@@ -0,0 +1,109 @@
+"""
+文字起こしに送る前の音声の下ごしらえ（ffmpeg）。
+
+- モノラル・16kHz（話し声には十分）にする
+- 先頭と末尾の無音を切る（途中の無音は残す。区間分割の切れ目に使うため）
+- Opus（.ogg, 24kbps, 音声向け設定）にする。ステレオの高ビットレート mp3 の 1/5〜1/10 くらいになる
+
+結果は入力の sha256 と設定から決まる名前で work/audio_cache/ に置くので、同じ音声なら2回目以降は
+変換しない。ffmpeg が無い環境では元のファイルをそのまま使う。
+
+    python audio_prep.py input/test01.mp3
+"""
+import argparse
+import hashlib
+import re
+import shutil
+import subprocess
+import time
+from pathlib import Path
+
+from audio_chunks import probe_duration
+from fileutil import sha256_file
+
+CACHE_DIR = Path("work/audio_cache")
+SAMPLE_RATE = 16000
+BITRATE = "24k"
+SILENCE_DB = -45       # これより小さい音を無音とみなす
+MIN_SILENCE = 0.5      # 先頭・末尾でこれより短い無音は切らない（秒）
+KEEP = 0.2             # 切るときに話し声の前後に残す（秒）
+SUFFIX = ".ogg"
+
+
+def edge_silence(path: Path, duration: float, noise_db: int = SILENCE_DB,
+                 min_silence: float = MIN_SILENCE) -> tuple[float, float]:
+    """先頭の無音の終わりと末尾の無音の始まり（秒）。無音が無ければ 0 と duration。"""
+    p = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-nostats", "-i", str(path), "-vn", "-ac", "1",
+         "-af", f"silencedetect=noise={noise_db}dB:d={min_silence}", "-f", "null", "-"],
+        capture_output=True, text=True,
+    )
+    starts = [float(x) for x in re.findall(r"silence_start: (-?[\d.]+)", p.stderr)]
+    ends = [float(x) for x in re.findall(r"silence_end: ([\d.]+)", p.stderr)]
+    head, tail = 0.0, duration
+    if starts and starts[0] <= 0.01 and ends:
+        head = max(0.0, ends[0] - KEEP)
+    # ファイルの終わりまで続く無音（ffmpeg の版によって silence_end が無いか、終わりの時刻になる）
+    if starts and (len(starts) > len(ends) or ends[-1] >= duration - 0.05):
+        tail = min(duration, starts[-1] + KEEP)
+    if tail <= head:
+        # 全部無音なら切らない（文字起こし側で空になる）
+        return 0.0, duration
+    return head, tail
+
+
+def cache_path(src: Path, cache_dir: Path = CACHE_DIR) -> Path:
+    settings = f"{SAMPLE_RATE}:{BITRATE}:{SILENCE_DB}:{MIN_SILENCE}:{KEEP}"
+    key = hashlib.sha256(f"{sha256_file(src)}:{settings}".encode()).hexdigest()[:24]
+    return cache_dir / f"{key}{SUFFIX}"
+
+
+def prepare_audio(src: Path, cache_dir: Path = CACHE_DIR) -> Path:
+    """src を下ごしらえしたファイルのパスを返す（キャッシュがあればそれ。ffmpeg が無ければ src）。"""
+    if shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None:
+        print("ℹ️ ffmpeg が無いので音声はそのまま送ります")
+        return src
+
+    dst = cache_path(src, cache_dir)
+    if dst.exists():
+        print(f"🎧 audio prep: cached → {dst.as_posix()} ({src.stat().st_size / 1e6:.2f} MB → "
+              f"{dst.stat().st_size / 1e6:.2f} MB)")
+        return dst
+
+    t0 = time.perf_counter()
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".tmp" + SUFFIX)
+    try:
+        duration = probe_duration(src)
+        head, tail = edge_silence(src, duration)
+        subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-ss", f"{head:.3f}", "-to", f"{tail:.3f}",
+             "-i", str(src), "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE),
+             "-c:a", "libopus", "-b:a", BITRATE, "-application", "voip", str(tmp)],
+            check=True,
+        )
+    except (subprocess.CalledProcessError, ValueError) as e:
+        # 読めない形式・libopus の無い ffmpeg など。文字起こしは元のファイルで続ける
+        tmp.unlink(missing_ok=True)
+        print(f"⚠️ audio prep failed, sending the original file ({e})")
+        return src
+    tmp.replace(dst)
+
+    before, after = src.stat().st_size, dst.stat().st_size
+    print(f"🎧 audio prep: {src.name} {before / 1e6:.2f} MB, {duration:.1f}s → {after / 1e6:.2f} MB, "
+          f"{probe_duration(dst):.1f}s (trimmed {head:.1f}s + {duration - tail:.1f}s, "
+          f"{100 * (1 - after / max(before, 1)):.0f}% smaller) in {time.perf_counter() - t0:.1f}s")
+    return dst
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Downmix, resample, trim and re-encode a recording for upload")
+    parser.add_argument("input", type=Path)
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR)
+    args = parser.parse_args()
+
+    print(prepare_audio(args.input, args.cache_dir).as_posix())
+
+
+if __name__ == "__main__":
+    main()
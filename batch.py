@@ -0,0 +1,120 @@
+"""
+input/ にある音声ファイルをまとめて絵本にする。
+
+1冊ごとに work/batch/<音声ファイル名>/ 以下に専用の work/ と output/ を作るので、
+同時に動かしても book_plan.json や pages が混ざらない。
+API の同時呼び出し数はプロセス全体で api_client の枠を共有する。
+本棚（docs/index.html）の再生成と git commit は最後に1回だけ行う。
+"""
+import argparse
+import shutil
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from api_client import set_api_budget
+from journal import RunJournal
+from pipeline import BookPaths, Pipeline, build_stages, git_commit_and_push
+
+INPUT_DIR = Path("input")
+BATCH_DIR = Path("work/batch")
+SHARED_PROMPT = Path("work/prompt.txt")
+DOCS_DIR = Path("docs")
+
+AUDIO_EXTS = {".mp3", ".mp4", ".m4a", ".mpeg", ".mpga", ".wav", ".webm", ".ogg", ".flac"}
+
+
+def find_audio(input_dir: Path = INPUT_DIR) -> list[Path]:
+    return sorted(p for p in input_dir.iterdir() if p.is_file() and p.suffix.lower() in AUDIO_EXTS)
+
+
+def book_paths(audio: Path, batch_dir: Path = BATCH_DIR, docs: Path = DOCS_DIR) -> BookPaths:
+    # 拡張子まで含めた名前で分ける（a.mp3 と a.wav が同じディレクトリを使わないように）
+    root = batch_dir / audio.name
+    paths = BookPaths(audio=audio, work=root / "work", output=root / "output", docs=docs)
+    paths.work.mkdir(parents=True, exist_ok=True)
+    # 本ごとにプロンプトを変えたい場合は work/batch/<名前>/work/prompt.txt を置く
+    if not paths.prompt.exists() and SHARED_PROMPT.exists():
+        shutil.copy2(SHARED_PROMPT, paths.prompt)
+    return paths
+
+
+def book_pipeline(paths: BookPaths, *, force_images: bool = False, concurrency: int = 1,
+                  resume: bool = False) -> Pipeline:
+    """本棚の再生成以外の工程（transcribe → … → publish_pdf）。"""
+    ctx = {}
+    journal = RunJournal(paths.journal)
+    stages = [s for s in build_stages(paths, ctx, force_images=force_images, concurrency=concurrency,
+                                      journal=journal)
+              if s.name != "shelf"]
+    return Pipeline(stages, paths.state, ctx, journal=journal, resume=resume)
+
+
+def run_book(audio: Path, **kwargs) -> list[str]:
+    paths = book_paths(audio)
+    print(f"\n📗 BOOK: {audio.name} → {paths.work.parent.as_posix()}")
+    return book_pipeline(paths, **kwargs).execute(set())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build one book per audio file in input/")
+    parser.add_argument("--input-dir", type=Path, default=INPUT_DIR)
+    parser.add_argument("--books", type=int, default=2, help="Number of books processed at the same time")
+    parser.add_argument("--api-concurrency", type=int, default=4,
+                        help="Max API calls in flight across all books (0 = unlimited)")
+    parser.add_argument("--image-concurrency", type=int, default=2, help="Parallel image calls per book")
+    parser.add_argument("--force-images", action="store_true", help="Overwrite existing page PNGs")
+    parser.add_argument("--dry-run", action="store_true", help="Only show which stages would run per book")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue interrupted books from their run journals without repeating paid calls")
+    parser.add_argument("--no-git", action="store_true", help="Do not git add/commit/push")
+    parser.add_argument("--no-push", action="store_true", help="Do not git push (commit only)")
+    parser.add_argument("--message", type=str, default="", help="Commit message override")
+    args = parser.parse_args()
+
+    audios = find_audio(args.input_dir)
+    if not audios:
+        raise SystemExit(f"❌ No audio files in {args.input_dir}")
+    print(f"🟦 BATCH: {len(audios)} books | parallel books: {args.books} | api budget: {args.api_concurrency}")
+
+    opts = {"force_images": args.force_images, "concurrency": args.image_concurrency, "resume": args.resume}
+
+    if args.dry_run:
+        for audio in audios:
+            print(f"\n📗 {audio.name}")
+            book_pipeline(book_paths(audio), **opts).dry_run(set())
+        return
+
+    set_api_budget(args.api_concurrency)
+
+    failed, published = [], 0
+    with ThreadPoolExecutor(max_workers=max(1, args.books)) as pool:
+        futures = {pool.submit(run_book, audio, **opts): audio for audio in audios}
+        for fut in as_completed(futures):
+            audio = futures[fut]
+            try:
+                ran = fut.result()
+            # Pipeline は失敗を SystemExit で返すので、他の本を止めないよう SystemExit も受ける（Ctrl+C は通す）
+            except (Exception, SystemExit) as e:
+                failed.append(audio.name)
+                print(f"❌ {audio.name}: {e}")
+                traceback.print_exception(e)
+                continue
+            if "publish" in ran or "publish_pdf" in ran:
+                published += 1
+            print(f"✅ {audio.name}: {', '.join(ran) if ran else 'up to date'}")
+
+    # 本棚は全部終わってから1回だけ
+    from build_shelf import build_shelf
+    build_shelf(DOCS_DIR / "books", DOCS_DIR / "index.html")
+
+    if published and not args.no_git:
+        git_commit_and_push(args.message or f"Add {published} new books", push=not args.no_push)
+
+    print(f"\n✅ Batch complete: {len(audios) - len(failed)} ok, {len(failed)} failed")
+    if failed:
+        raise SystemExit(f"❌ Failed books: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+夜間のまとめ処理用。input/ の全部の本の plan と画像のリクエストを JSONL にして OpenAI の Batch API に
+まとめて投げ、終わるのを待って結果を各本の work/book_plan.json と output/pages/NN.png に配る。
+
+    python batch_api.py                 # 文字起こし → plan（まとめて）→ 画像（まとめて）
+    python batch.py                     # 残りの工程（PDF・公開・本棚）は今まで通り
+
+- 本ごとのディレクトリは batch.py と同じ（work/batch/<音声ファイル名>/）
+- 文字起こしは Batch API に無いので、今まで通りその場で行う
+- 結果を配った工程はパイプラインの state / run journal に「済み」と記録するので、batch.py では走らない
+- 投げたジョブの ID は work/batch_api/state.json に残す。待っている途中で止めても、
+  もう一度実行すれば同じジョブの完了を待つところから続く（二重に投げない）
+- 失敗した行の本はそのまま残り、batch.py の通常の（同期の）呼び出しで作られる
+"""
+import argparse
+import base64
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+
+from api_client import call_api, get_client
+from batch import INPUT_DIR, book_paths, book_pipeline, find_audio
+from fileutil import atomic_write_bytes
+
+STATE_PATH = Path("work/batch_api/state.json")
+POLL_SECONDS = 30.0
+COMPLETION_WINDOW = "24h"
+DONE_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _load_state(path: Path) -> dict:
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+
+
+def _save_state(path: Path, state: dict) -> None:
+    atomic_write_bytes(path, json.dumps(state, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+def output_text(body: dict) -> str:
+    """Responses API の応答（JSON）から出力テキストをつなげる（SDK の output_text と同じ）。"""
+    return "".join(c.get("text", "") for item in body.get("output", []) if item.get("type") == "message"
+                   for c in item.get("content", []) if c.get("type") == "output_text")
+
+
+def write_jobs(requests: list[tuple[str, dict]], url: str, path: Path) -> Path:
+    """[(custom_id, body)] を Batch API の入力（1行1リクエストの JSONL）にする。"""
+    lines = [json.dumps({"custom_id": cid, "method": "POST", "url": url, "body": body}, ensure_ascii=False)
+             for cid, body in requests]
+    atomic_write_bytes(path, ("\n".join(lines) + "\n").encode("utf-8"))
+    return path
+
+
+def _upload(client, jobs_path: Path):
+    # リトライのたびにファイルを開き直す（読み終えたハンドルを渡すと空のファイルが上がる）
+    with jobs_path.open("rb") as f:
+        return client.files.create(file=f, purpose="batch")
+
+
+def submit(client, jobs_path: Path, url: str) -> str:
+    uploaded = call_api("files", lambda: _upload(client, jobs_path), label=jobs_path.name)
+    batch = call_api("batches", lambda: client.batches.create(input_file_id=uploaded.id, endpoint=url,
+                                                               completion_window=COMPLETION_WINDOW),
+                     label=jobs_path.name)
+    print(f"📤 submitted {jobs_path.name} → {batch.id}")
+    return batch.id
+
+
+def wait_batch(client, batch_id: str, poll: float = POLL_SECONDS):
+    t0 = time.perf_counter()
+    while True:
+        batch = call_api("batches", lambda: client.batches.retrieve(batch_id), label=batch_id)
+        counts = batch.request_counts
+        print(f"   {batch_id}: {batch.status} ({counts.completed}/{counts.total} done, {counts.failed} failed, "
+              f"{time.perf_counter() - t0:.0f}s)")
+        if batch.status in DONE_STATUSES:
+            return batch
+        time.sleep(poll)
+
+
+def fetch_results(client, batch) -> dict[str, tuple[dict | None, str]]:
+    """{custom_id: (応答の body, エラー)}。成功した行はエラーが空。"""
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        content = call_api("files", lambda: client.files.content(file_id), label=file_id)
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            response = row.get("response") or {}
+            if row.get("error") or response.get("status_code") != 200:
+                error = row.get("error") or response.get("body", {}).get("error") or response.get("status_code")
+                results[row["custom_id"]] = (None, json.dumps(error, ensure_ascii=False))
+            else:
+                results[row["custom_id"]] = (response["body"], "")
+    return results
+
+
+def run_phase(client, name: str, url: str, requests: list[tuple[str, dict]], work_dir: Path,
+              state_path: Path, poll: float) -> dict[str, tuple[dict | None, str]]:
+    """
+    1回分（plans / images）を投げて結果を返す。state に前回投げたジョブが残っていればそれを待つ。
+    """
+    state = _load_state(state_path)
+    pending = state.get(name)
+    if pending:
+        print(f"🟦 {name}: waiting for the batch submitted at {pending['submitted']} ({pending['batch_id']})")
+    else:
+        if not requests:
+            return {}
+        jobs = write_jobs(requests, url, work_dir / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{name}.jsonl")
+        pending = state[name] = {"batch_id": submit(client, jobs, url), "jobs": jobs.as_posix(),
+                                 "submitted": datetime.now().isoformat(timespec="seconds")}
+        _save_state(state_path, state)
+
+    batch = wait_batch(client, pending["batch_id"], poll)
+    results = fetch_results(client, batch) if batch.status == "completed" else {}
+    if batch.status != "completed":
+        print(f"❌ {name}: batch {batch.status}; the books fall back to normal calls in batch.py")
+
+    state = _load_state(state_path)
+    state.pop(name, None)
+    _save_state(state_path, state)
+    return results
+
+
+def run(input_dir: Path = INPUT_DIR, *, client=None, state_path: Path = STATE_PATH,
+        poll: float = POLL_SECONDS, page_count: int | None = None) -> dict:
+    """
+    全部の本の plan と画像をまとめて作る。{"plans": 作った数, "pages": 作った数, "failed": [...]} を返す。
+    page_count は1冊のページ数（既定は book_plan.PAGE_COUNT）。
+    """
+    from book_plan import plan_request, save_plan
+    from repaire_details import repair_plan
+    from generate_images import IMAGE_SIZE, MODEL, ImageQueue
+
+    client = client or get_client()
+    work_dir = state_path.parent
+    books = {audio.name: book_paths(audio) for audio in find_audio(input_dir)}
+    pipes = {name: book_pipeline(paths) for name, paths in books.items()}
+    failed = []
+
+    # 1) 文字起こし（その場で）
+    for name, pipe in list(pipes.items()):
+        try:
+            pipe.execute(set(), only={"transcribe"})
+        # Pipeline は失敗を SystemExit で返すので、他の本を止めないよう SystemExit も受ける（Ctrl+C は通す）
+        except (Exception, SystemExit) as e:
+            failed.append(f"transcribe:{name}")
+            print(f"❌ transcribe {name}: {e}")
+            del pipes[name]
+
+    # 2) plan（まとめて）
+    requests = []
+    for name, pipe in pipes.items():
+        if pipe.reason(pipe.stages["plan"], set()) is not None:
+            requests.append((f"plan:{name}", plan_request(books[name].transcript, books[name].prompt, page_count)))
+    print(f"\n📘 plans: {len(requests)} books")
+    made_plans = 0
+    for cid, (body, error) in run_phase(client, "plans", "/v1/responses", requests, work_dir,
+                                        state_path, poll).items():
+        name = cid.split(":", 1)[1]
+        if name not in pipes:
+            continue
+        try:
+            if error:
+                raise RuntimeError(error)
+            # 問題のあるページだけ（その場の同期の呼び出しで）聞き直す
+            request = plan_request(books[name].transcript, books[name].prompt, page_count)
+            save_plan(repair_plan(json.loads(output_text(body)), request, client=client, page_count=page_count),
+                      books[name].plan)
+        except (RuntimeError, json.JSONDecodeError) as e:
+            failed.append(f"plan:{name}")
+            print(f"❌ plan {name}: {e}")
+            continue
+        pipes[name].mark_done("plan", via="batch_api")
+        made_plans += 1
+
+    # 3) 画像（まとめて）。キャッシュにあるページは投げない
+    queues, jobs, requests = {}, {}, []
+    for name, pipe in pipes.items():
+        paths = books[name]
+        if not paths.plan.exists() or pipe.reason(pipe.stages["plan"], set()) is not None:
+            continue
+        plan = json.loads(paths.plan.read_text(encoding="utf-8"))
+        queue = queues[name] = ImageQueue(paths.pages, style_bible=plan.get("style_bible", ""), client=client,
+                                          journal=pipe.journal)
+        for p in plan.get("pages", []):
+            job = queue.job(p)
+            if job is None or queue.from_cache(job):
+                continue
+            cid = f"image:{name}:{job[0]:02d}"
+            jobs[cid] = (name, job)
+            requests.append((cid, {"model": MODEL, "prompt": job[1], "size": IMAGE_SIZE}))
+    print(f"\n🖼  images: {len(requests)} pages from {len(queues)} books")
+    made_pages = 0
+    results = run_phase(client, "images", "/v1/images/generations", requests, work_dir, state_path, poll)
+    for cid, (body, error) in results.items():
+        if cid not in jobs:
+            continue
+        name, job = jobs[cid]
+        if error:
+            failed.append(cid)
+            print(f"❌ {cid}: {error}")
+            continue
+        queues[name].store(job, base64.b64decode(body["data"][0]["b64_json"]))
+        made_pages += 1
+
+    for name, queue in queues.items():
+        queue.close()
+        missing = [cid for cid, (n, _) in jobs.items() if n == name and cid not in results]
+        if not missing and not any(f.startswith(f"image:{name}:") for f in failed):
+            pipes[name].mark_done("images", via="batch_api")
+
+    print(f"\n✅ batch api: {made_plans} plans, {made_pages} pages"
+          f"{f', {len(failed)} failed (batch.py will retry them)' if failed else ''}")
+    return {"plans": made_plans, "pages": made_pages, "failed": failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create plans and page images for all books via the Batch API")
+    parser.add_argument("--input-dir", type=Path, default=INPUT_DIR)
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="Seconds between status checks")
+    parser.add_argument("--state", type=Path, default=STATE_PATH, help="Where submitted batch ids are kept")
+    args = parser.parse_args()
+
+    run(args.input_dir, state_path=args.state, poll=args.poll)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,939 @@
+"""
+性能計測用のスクリプト（API は呼ばない）。
+
+    python bench.py wrap      # make_pdf.wrap_text_by_width の旧実装との比較
+    python bench.py pdf       # make_pdf.build_pdf の並列レンダリング（workers 1/2/4/8）
+    python bench.py shelf     # build_shelf の全件再生成 vs 差分再生成（合成 10k 冊）
+    python bench.py search    # 検索インデックスのサイズと検索時間（合成 10k 冊）
+    python bench.py stream    # plan → 画像 を順番に vs plan のストリーミングと重ねる（偽 API）
+    python bench.py suite     # パイプライン全工程を偽 API で（本の冊数・ページ数を変えて）
+    python bench.py publish   # 1冊ごとの commit / push vs まとめて（ローカルの bare リポジトリに）
+    python bench.py batch-api # plan と画像を Batch API でまとめて（偽 API で最初から最後まで）
+    python bench.py preview   # 公開までの秒数: final の画像で vs draft で先に公開して後から仕上げ（偽 API）
+    python bench.py pages     # 1ページの描き直し: 全部作り直し vs --pages（偽 API）
+    python bench.py plan-check # plan の検査の速さと、壊れたページだけの聞き直し（偽 API）
+    python bench.py chunks    # 長い音声の区間分け・つなぎ目の重複取り・journal の再利用（スタブの文字起こし）
+
+    python bench.py --json work/bench/abcd123.json suite   # 結果を JSON で保存
+    python bench.py compare work/bench/old.json work/bench/new.json   # 遅くなった項目に ⚠️
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+BOOKS_DIR = Path("docs/books")
+
+
+def _timeit(fn, repeat: int) -> float:
+    """repeat 回の中で一番速かった1回の秒数。"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def sample_texts(books_dir: Path = BOOKS_DIR) -> list[str]:
+    texts = []
+    for plan_path in sorted(books_dir.glob("*/book_plan.json")):
+        plan = json.loads(plan_path.read_text(encoding="utf-8"))
+        texts.extend(p.get("text", "") for p in plan.get("pages", []))
+    return texts
+
+
+def wrap_text_reference(text, font_name, font_size, max_width):
+    """改修前の wrap_text_by_width（1文字足すたびに行全体の幅を測り直す）。"""
+    from reportlab.pdfbase import pdfmetrics
+
+    text = (text or "").strip()
+    if not text:
+        return []
+
+    lines = []
+    current = ""
+    for ch in text:
+        if ch == "\n":
+            if current:
+                lines.append(current)
+                current = ""
+            continue
+
+        trial = current + ch
+        w = pdfmetrics.stringWidth(trial, font_name, font_size)
+        if w <= max_width:
+            current = trial
+        else:
+            if current:
+                lines.append(current)
+                current = ch
+            else:
+                lines.append(ch)
+                current = ""
+    if current:
+        lines.append(current)
+    return lines
+
+
+def bench_wrap(args) -> dict:
+    import make_pdf
+
+    make_pdf.register_fonts()
+    texts = sample_texts()
+    if not texts:
+        raise SystemExit(f"❌ No texts under {BOOKS_DIR}")
+
+    font, size = make_pdf.FONT_NAME, make_pdf.FONT_SIZE
+    widths = {
+        "pdf": make_pdf.COL_W - 2 * make_pdf.INNER_MARGIN,  # 実際の本文幅
+        "wide": 4000.0,  # 1行がとても長い場合（旧実装は行長の2乗で遅くなる）
+    }
+
+    results = {}
+    for label, width in widths.items():
+        old = [wrap_text_reference(t, font, size, width) for t in texts]
+        new = [make_pdf.wrap_text_by_width(t, font, size, width) for t in texts]
+        mismatches = sum(a != b for a, b in zip(old, new))
+
+        t_old = _timeit(lambda: [wrap_text_reference(t, font, size, width) for t in texts], args.repeat)
+        t_new = _timeit(lambda: [make_pdf.wrap_text_by_width(t, font, size, width) for t in texts], args.repeat)
+        results[label] = {
+            "texts": len(texts),
+            "old_ms": t_old * 1000,
+            "new_ms": t_new * 1000,
+            "speedup": t_old / max(t_new, 1e-9),
+            "mismatches": mismatches,
+        }
+        print(f"wrap[{label}] texts={len(texts)} old={t_old * 1000:.2f}ms new={t_new * 1000:.2f}ms "
+              f"x{t_old / max(t_new, 1e-9):.1f} mismatches={mismatches}")
+        if mismatches:
+            raise SystemExit("❌ 改行位置が旧実装と一致しません")
+    return results
+
+
+def sample_images(books_dir: Path = BOOKS_DIR) -> list[Path]:
+    return sorted(books_dir.glob("*/pages/*.png"))
+
+
+def make_synthetic_book(root: Path, n_pages: int, books_dir: Path = BOOKS_DIR) -> tuple[Path, Path]:
+    """既存の本のテキストと画像を使い回して n_pages ページの本を root に作る。"""
+    texts = sample_texts(books_dir)
+    images = sample_images(books_dir)
+    if not texts or not images:
+        raise SystemExit(f"❌ No sample books under {books_dir}")
+
+    pages_dir = root / "pages"
+    pages_dir.mkdir(parents=True, exist_ok=True)
+    pages = []
+    for i in range(n_pages):
+        page = i + 1
+        shutil.copyfile(images[i % len(images)], pages_dir / f"{page:02d}.png")
+        pages.append({"page": page, "text": texts[i % len(texts)]})
+    plan_path = root / "book_plan.json"
+    plan_path.write_text(json.dumps({"title": f"bench {n_pages}p", "pages": pages}, ensure_ascii=False),
+                         encoding="utf-8")
+    return plan_path, pages_dir
+
+
+def bench_pdf(args) -> dict:
+    import make_pdf
+
+    results = {}
+    for n_pages in args.pages:
+        with tempfile.TemporaryDirectory(prefix="bench_pdf_") as tmp:
+            plan_path, pages_dir = make_synthetic_book(Path(tmp), n_pages)
+            for workers in args.workers:
+                out = Path(tmp) / f"book_{workers}.pdf"
+                t = _timeit(lambda: make_pdf.build_pdf(plan_path, pages_dir, out, workers=workers), args.repeat)
+                results[f"{n_pages}p/{workers}w"] = {"pages": n_pages, "workers": workers, "seconds": t,
+                                                     "bytes": out.stat().st_size}
+                print(f"pdf pages={n_pages} workers={workers} {t:.2f}s ({out.stat().st_size / 1e6:.1f} MB)")
+    return results
+
+
+def make_synthetic_shelf(books_dir: Path, n_books: int, start: int = 0) -> list[Path]:
+    """viewer.html と book_plan.json だけを持つ本を n_books 冊作る（画像なし）。"""
+    texts = sample_texts() or ["むかしむかし"]
+    made = []
+    for i in range(start, start + n_books):
+        book_dir = books_dir / f"2026{(i // 86400) % 12 + 1:02d}01_{i % 86400 // 3600:02d}{i % 3600 // 60:02d}{i % 60:02d}"
+        if book_dir.exists():
+            book_dir = books_dir / f"{book_dir.name}_{i}"
+        book_dir.mkdir(parents=True)
+        plan = {
+            "title": f"合成の本 {i}",
+            "target_age": "12-15",
+            "pages": [{"page": p + 1, "text": texts[(i + p) % len(texts)]} for p in range(10)],
+        }
+        (book_dir / "book_plan.json").write_text(json.dumps(plan, ensure_ascii=False), encoding="utf-8")
+        (book_dir / "viewer.html").write_text("<!doctype html>", encoding="utf-8")
+        (book_dir / "details.html").write_text("<!doctype html>", encoding="utf-8")
+        made.append(book_dir)
+    return made
+
+
+def bench_shelf(args) -> dict:
+    import build_shelf
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench_shelf_") as tmp:
+        docs = Path(tmp) / "docs"
+        books_dir, index = docs / "books", docs / "index.html"
+        t0 = time.perf_counter()
+        make_synthetic_shelf(books_dir, args.books)
+        print(f"shelf: created {args.books} synthetic books in {time.perf_counter() - t0:.1f}s")
+
+        cases = [
+            ("full", lambda: build_shelf.build_shelf(books_dir, index, full=True)),
+            ("incremental_nochange", lambda: build_shelf.build_shelf(books_dir, index)),
+        ]
+        for label, fn in cases:
+            t = _timeit(fn, args.repeat)
+            results[label] = {"books": args.books, "seconds": t}
+            print(f"shelf[{label}] books={args.books} {t * 1000:.0f}ms")
+
+        # 1冊追加した直後の差分再生成
+        counter = [args.books]
+
+        def add_one_and_build():
+            make_synthetic_shelf(books_dir, 1, start=counter[0])
+            counter[0] += 1
+            build_shelf.build_shelf(books_dir, index)
+
+        t = _timeit(add_one_and_build, args.repeat)
+        results["incremental_add1"] = {"books": args.books, "seconds": t}
+        print(f"shelf[incremental_add1] books={args.books} {t * 1000:.0f}ms")
+        catalog = docs / build_shelf.CATALOG_NAME
+        results["index_bytes"] = index.stat().st_size
+        results["catalog_pages"] = len(list(catalog.glob("page-*.json")))
+        results["first_load_bytes"] = (index.stat().st_size + (catalog / "index.json").stat().st_size
+                                       + max(p.stat().st_size for p in catalog.glob("page-*.json")))
+        print(f"shelf: index.html {results['index_bytes']} bytes, {results['catalog_pages']} catalog pages, "
+              f"first load ~{results['first_load_bytes'] / 1e3:.0f} KB")
+    return results
+
+
+def bench_search(args) -> dict:
+    import build_shelf
+    import search_index
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench_search_") as tmp:
+        docs = Path(tmp) / "docs"
+        books_dir, index = docs / "books", docs / "index.html"
+        make_synthetic_shelf(books_dir, args.books)
+
+        t0 = time.perf_counter()
+        build_shelf.build_shelf(books_dir, index, full=True)
+        results["build_full_seconds"] = time.perf_counter() - t0
+
+        make_synthetic_shelf(books_dir, 1, start=args.books)
+        t0 = time.perf_counter()
+        build_shelf.build_shelf(books_dir, index)
+        results["build_add1_seconds"] = time.perf_counter() - t0
+
+        search_dir = docs / search_index.SEARCH_NAME
+        shards = list(search_dir.glob("s-*.json"))
+        sizes = [p.stat().st_size for p in shards]
+        results.update({"books": args.books + 1, "shards": len(shards), "index_bytes": sum(sizes),
+                        "max_shard_bytes": max(sizes), "meta_bytes": (search_dir / "meta.json").stat().st_size})
+        print(f"search: build full {results['build_full_seconds']:.1f}s, add 1 book "
+              f"{results['build_add1_seconds'] * 1000:.0f}ms")
+        print(f"search: {len(shards)} shards, {sum(sizes) / 1e6:.1f} MB total, "
+              f"largest {max(sizes) / 1e3:.0f} KB, meta {results['meta_bytes'] / 1e3:.1f} KB")
+
+        # 1回ごとにファイルを読み直す（ブラウザで初めて引いたときと同じ条件）
+        queries = args.queries or ["の", "合成の本", f"本 {args.books // 2}", "石けん", "ゆうた", "存在しない語"]
+        results["queries"] = {}
+        for q in queries:
+            hits = search_index.search(search_dir, q)
+            t = _timeit(lambda: search_index.search(search_dir, q), args.repeat)
+            loaded = {search_index.shard_of(term) for term in search_index.query_terms(q)}
+            read = sum((search_dir / f"s-{n}.json").stat().st_size
+                       for n in loaded if (search_dir / f"s-{n}.json").exists())
+            results["queries"][q] = {"ms": t * 1000, "hits": len(hits), "bytes_read": read}
+            print(f"search[{q}] {t * 1000:.1f}ms hits={len(hits)} read={read / 1e3:.0f} KB")
+    return results
+
+
+def bench_stream(args) -> dict:
+    import api_client
+    import book_plan
+    from fake_openai import FakeOpenAI
+    from generate_images import ImageQueue
+
+    plans = sorted(BOOKS_DIR.glob("*/book_plan.json"))
+    if not plans:
+        raise SystemExit(f"❌ No sample books under {BOOKS_DIR}")
+    plan = json.loads(plans[0].read_text(encoding="utf-8"))
+    # 偽の API は同じ plan しか返さないので、頼むページ数をその plan に合わせる
+    opts = {"page_count": len(plan["pages"])}
+    latency = {"image": args.image_latency, "plan_per_char": args.plan_per_char}
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench_stream_") as tmp:
+        root = Path(tmp)
+        api_client.set_metrics_path(root / "api_metrics.jsonl")
+        transcript = root / "transcript.txt"
+        transcript.write_text("".join(p.get("text", "") for p in plan["pages"]) * 3, encoding="utf-8")
+        image_opts = {"concurrency": args.concurrency, "rpm": 0, "no_cache": True}
+
+        def sequential():
+            client = FakeOpenAI(plan, latency=latency)
+            data = book_plan.make_plan(transcript, root / "seq_plan.json", root / "none.txt", client=client,
+                                   **opts)
+            queue = ImageQueue(root / "seq_pages", style_bible=data.get("style_bible", ""), force=True,
+                               client=client, **image_opts)
+            for p in data["pages"]:
+                queue.submit(p)
+            queue.close()
+
+        def streaming():
+            client = FakeOpenAI(plan, latency=latency)
+            book_plan.make_plan_with_images(transcript, root / "stream_plan.json", root / "none.txt",
+                                            client=client, out_dir=root / "stream_pages", force=True,
+                                            **opts, **image_opts)
+
+        for label, fn in [("sequential", sequential), ("streaming", streaming)]:
+            t = _timeit(fn, args.repeat)
+            results[label] = {"pages": len(plan["pages"]), "seconds": t}
+        saved = results["sequential"]["seconds"] - results["streaming"]["seconds"]
+        results["saved_seconds"] = saved
+        same = (json.loads((root / "seq_plan.json").read_text(encoding="utf-8"))
+                == json.loads((root / "stream_plan.json").read_text(encoding="utf-8")))
+    for label in ("sequential", "streaming"):
+        print(f"stream[{label}] pages={len(plan['pages'])} {results[label]['seconds']:.2f}s")
+    print(f"stream: saved {saved:.2f}s, same plan: {same}")
+    if not same:
+        raise SystemExit("❌ ストリーミングで作った plan が一致しません")
+    return results
+
+
+def synthetic_plan(plan: dict, n_pages: int) -> dict:
+    """plan のページを繰り返して n_pages ページにする（style_bible などはそのまま）。"""
+    pages = plan.get("pages") or [{"text": "むかしむかし"}]
+    return {**plan, "pages": [{**pages[i % len(pages)], "page": i + 1} for i in range(n_pages)]}
+
+
+def run_fake_book(root: Path, plan: dict, png: bytes, latency: dict, *, concurrency: int,
+                  shelf_books: int = 0) -> dict:
+    """
+    root を作業ディレクトリにして、偽の API でパイプラインを最初から最後まで1冊分動かす。
+    shelf_books > 0 なら、先に合成の本をその冊数だけ本棚に置いておく（publish / shelf の冊数依存を見る）。
+    工程ごとの秒数（tracing のスパン）を返す。
+    """
+    import api_client
+    import tracing
+    from fake_openai import FakeOpenAI
+    from pipeline import BookPaths, Pipeline, build_stages
+
+    if shelf_books:
+        make_synthetic_shelf(root / "docs" / "books", shelf_books)
+    cwd = os.getcwd()
+    root.mkdir(parents=True, exist_ok=True)
+    # 公開先（docs/assets など）も各スクリプトの既定の相対パスのまま root の下に作る
+    os.chdir(root)
+    try:
+        paths = BookPaths(audio=Path("input/bench.mp3"))
+        paths.audio.parent.mkdir(parents=True, exist_ok=True)
+        paths.audio.write_bytes(b"ID3" + bytes(1024))
+
+        api_client.set_client(FakeOpenAI(plan, latency=latency, png=png))
+        tracing.drain()
+        ctx = {}
+        t0 = time.perf_counter()
+        Pipeline(build_stages(paths, ctx, concurrency=concurrency, page_count=len(plan["pages"])), paths.state,
+                 ctx).execute(set())
+        total = time.perf_counter() - t0
+        stages = {e["name"]: e["args"]["wall_s"] for e in tracing.drain() if e["cat"] == "stage"}
+        return {"stages": stages, "total_seconds": total,
+                "pdf_bytes": paths.pdf.stat().st_size, "books": len(list(paths.books.glob("*/viewer.html")))}
+    finally:
+        os.chdir(cwd)
+
+
+def bench_suite(args) -> dict:
+    """
+    全工程（文字起こし・plan・画像・派生画像・PDF・公開・本棚）を偽の API で計測する。
+    - ページ数の系列: 空の本棚に --pages の各ページ数の本を1冊
+    - 冊数の系列: --books の各冊数の本棚（合成の本）に、--pages の最小ページ数の本を1冊足す
+    API の遅延は既定で 0（このリポジトリのコードにかかる時間だけを見る）。
+    """
+    import api_client
+
+    plans = sorted(BOOKS_DIR.glob("*/book_plan.json"))
+    images = sample_images()
+    if not plans or not images:
+        raise SystemExit(f"❌ No sample books under {BOOKS_DIR}")
+    plan = json.loads(plans[0].read_text(encoding="utf-8"))
+    png = images[0].read_bytes() if args.png == "sample" else None
+    latency = {"transcribe": args.latency, "plan_first_token": args.latency, "plan_per_char": 0.0,
+               "image": args.image_latency}
+    # 偽の API なので1分あたりの上限は外す（最初に作った設定が使われる）
+    for endpoint in api_client.ENDPOINT_RPM:
+        api_client.shared_limiter(endpoint, rpm=0)
+
+    cases = [(1, n) for n in args.pages] + [(n, min(args.pages)) for n in args.books if n > 1]
+    results = {"cases": {}}
+    with tempfile.TemporaryDirectory(prefix="bench_suite_") as tmp:
+        for i, (n_books, n_pages) in enumerate(cases):
+            r = run_fake_book(Path(tmp) / f"case{i}", synthetic_plan(plan, n_pages), png, latency,
+                              concurrency=args.concurrency, shelf_books=n_books - 1)
+            results["cases"][f"{n_books}b/{n_pages}p"] = {"books": n_books, "pages": n_pages, **r}
+            stages = " ".join(f"{k}={v:.2f}" for k, v in r["stages"].items())
+            print(f"suite books={n_books} pages={n_pages} total={r['total_seconds']:.2f}s | {stages}")
+    return results
+
+
+def _git(args: list[str], cwd: Path) -> str:
+    p = subprocess.run(["git", *args], cwd=cwd, text=True, capture_output=True)
+    if p.returncode != 0:
+        raise SystemExit(f"❌ git {' '.join(args)}: {p.stderr}")
+    return p.stdout
+
+
+def _clone(remote: Path, dst: Path) -> Path:
+    _git(["clone", "-q", str(remote), str(dst)], remote.parent)
+    _git(["config", "user.email", "bench@example.com"], dst)
+    _git(["config", "user.name", "bench"], dst)
+    return dst
+
+
+def _write_book(repo: Path, i: int, kb: int) -> str:
+    book_id = f"20260101_{i:06d}"
+    book = repo / "docs" / "books" / book_id
+    book.mkdir(parents=True, exist_ok=True)
+    (book / "book_plan.json").write_text(json.dumps({"title": f"bench {i}"}), encoding="utf-8")
+    (book / "01.png").write_bytes(os.urandom(kb * 1024))
+    (repo / "docs" / "index.html").write_text(f"<!doctype html><!-- {i} -->", encoding="utf-8")
+    return book_id
+
+
+def bench_publish(args) -> dict:
+    """
+    ローカルの bare リポジトリを remote にして、N 冊を1冊ずつ commit / push する場合と
+    git_publish でまとめる場合を比べる。まとめる側では途中で
+    - 別の clone から先に push しておく（non-fast-forward → pull --rebase してやり直す）
+    - index.lock を少しの間持っておく（他の git が動いている状態 → 待ってやり直す）
+    を起こし、最後に remote に全部の本が入っているか確かめる。
+    """
+    import threading
+
+    import git_publish
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench_publish_") as tmp:
+        root = Path(tmp)
+        remote = root / "remote.git"
+        _git(["init", "-q", "--bare", str(remote)], root)
+        seed = _clone(remote, root / "seed")
+        (seed / "README.md").write_text("bench\n", encoding="utf-8")
+        _git(["add", "README.md"], seed)
+        _git(["commit", "-q", "-m", "init"], seed)
+        _git(["push", "-q", "origin", "HEAD"], seed)
+
+        repo = _clone(remote, root / "work")
+        other = _clone(remote, root / "other")
+
+        t0 = time.perf_counter()
+        for i in range(args.books):
+            book_id = _write_book(repo, i, args.kb)
+            git_publish.commit_and_push(f"Add new book {book_id}", repo=repo)
+        per_book = time.perf_counter() - t0
+
+        spool, lock = root / "publish_queue.jsonl", root / "publish.lock"
+        t0 = time.perf_counter()
+        for i in range(args.books, 2 * args.books):
+            book_id = _write_book(repo, i, args.kb)
+            git_publish.enqueue(book_id, spool)
+            if i == args.books + args.books // 2:
+                # 他のマシンからの push と、同じリポジトリで動いている別の git
+                _git(["pull", "-q"], other)
+                (other / "NOTE.md").write_text("from another clone\n", encoding="utf-8")
+                _git(["add", "NOTE.md"], other)
+                _git(["commit", "-q", "-m", "other"], other)
+                _git(["push", "-q"], other)
+                index_lock = repo / ".git" / "index.lock"
+                index_lock.touch()
+                threading.Timer(0.5, index_lock.unlink).start()
+            git_publish.flush(window=float("inf"), max_books=args.max_books, repo=repo, spool=spool, lock=lock)
+        git_publish.flush(force=True, repo=repo, spool=spool, lock=lock)
+        batched = time.perf_counter() - t0
+
+        files = set(_git(["ls-tree", "-r", "--name-only", "HEAD"], remote).split())
+        missing = [i for i in range(2 * args.books) if f"docs/books/20260101_{i:06d}/01.png" not in files]
+        commits = int(_git(["rev-list", "--count", "HEAD"], remote))
+        results = {"books": args.books, "kb_per_book": args.kb, "max_books": args.max_books,
+                   "per_book_seconds": per_book, "batched_seconds": batched, "remote_commits": commits,
+                   "missing": len(missing), "other_clone_kept": "NOTE.md" in files}
+    print(f"publish: {args.books} books one by one {per_book:.2f}s | batched (max {args.max_books}) "
+          f"{batched:.2f}s (incl. a rejected push and a held index.lock) | remote commits {commits} | missing {len(missing)}")
+    if missing or not results["other_clone_kept"]:
+        raise SystemExit("❌ remote に入っていない本（または他の clone の commit）があります")
+    return results
+
+
+def bench_batch_api(args) -> dict:
+    """
+    input/ に N 冊分の音声を置き、batch_api.run で plan と画像をまとめて作る（偽の Batch API）。
+    その後 batch.py と同じパイプラインで plan / images がスキップされることまで確かめる。
+    """
+    import api_client
+    import batch_api
+    from batch import book_paths, book_pipeline, find_audio
+    from fake_openai import FakeOpenAI
+
+    plans = sorted(BOOKS_DIR.glob("*/book_plan.json"))
+    if not plans:
+        raise SystemExit(f"❌ No sample books under {BOOKS_DIR}")
+    plan = synthetic_plan(json.loads(plans[0].read_text(encoding="utf-8")), args.pages)
+    for endpoint in api_client.ENDPOINT_RPM:
+        api_client.shared_limiter(endpoint, rpm=0)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench_batch_api_") as tmp:
+        os.chdir(tmp)
+        try:
+            Path("input").mkdir()
+            for i in range(args.books):
+                # 2冊ずつ同じ名前で拡張子だけ違う（a.mp3 と a.wav が別の本になることも見る）
+                Path(f"input/rec{i // 2:03d}.{'wav' if i % 2 else 'mp3'}").write_bytes(b"ID3" + os.urandom(1024))
+            client = FakeOpenAI(plan, latency={"transcribe": 0.0, "batch": args.batch_latency})
+            api_client.set_client(client)
+
+            t0 = time.perf_counter()
+            made = batch_api.run(client=client, poll=args.poll, page_count=args.pages)
+            seconds = time.perf_counter() - t0
+            again = batch_api.run(client=client, poll=args.poll, page_count=args.pages)
+
+            rerun = {}
+            for audio in find_audio(Path("input")):
+                ran = book_pipeline(book_paths(audio)).execute(set(), only={"transcribe", "plan", "images"})
+                rerun[audio.name] = ran
+            pages = sum(len(list(book_paths(a).pages.glob("*.png"))) for a in find_audio(Path("input")))
+        finally:
+            os.chdir(cwd)
+
+    results = {"books": args.books, "pages_per_book": args.pages, "seconds": seconds, "made": made,
+               "second_run": again, "pages_on_disk": pages, "api_calls": dict(client.calls),
+               "rerun_stages": sorted({s for ran in rerun.values() for s in ran})}
+    print(f"batch-api: {args.books} books x {args.pages} pages in {seconds:.2f}s | made {made['plans']} plans, "
+          f"{made['pages']} pages | calls {client.calls} | re-run stages: {results['rerun_stages'] or 'none'}")
+    if pages != args.books * args.pages or results["rerun_stages"] or again["plans"] or again["pages"]:
+        raise SystemExit("❌ まとめて作った結果が本に配られていないか、パイプラインがやり直そうとしています")
+    return results
+
+
+def bench_preview(args) -> dict:
+    """
+    1冊を偽の API で最初から公開まで動かし、公開（viewer が見られる）までの秒数を比べる。
+    - final: 従来通り最初から仕上げの画像で
+    - draft: プレビュー用の画像で先に公開し、仕上げの画像を作って変わったページだけ差し替える
+    draft の方は差し替えが終わるまでの秒数も測り、同じ本がその場で更新されたことを確かめる。
+    """
+    import api_client
+    from fake_openai import FakeOpenAI, tiny_png
+    from generate_images import generate_images, load_tiers
+    from pipeline import BookPaths, Pipeline, build_stages, refresh_pages, upgrade_drafts
+
+    plans = sorted(BOOKS_DIR.glob("*/book_plan.json"))
+    images = sample_images()
+    if not plans or not images:
+        raise SystemExit(f"❌ No sample books under {BOOKS_DIR}")
+    plan = synthetic_plan(json.loads(plans[0].read_text(encoding="utf-8")), args.pages)
+    png = images[0].read_bytes() if args.png == "sample" else None
+    latency = {"transcribe": 0.0, "plan_first_token": 0.0, "plan_per_char": 0.0,
+               "image": args.image_latency, "image_low": args.draft_latency}
+    for endpoint in api_client.ENDPOINT_RPM:
+        api_client.shared_limiter(endpoint, rpm=0)
+
+    results = {}
+    cwd = os.getcwd()
+    # interrupted: --draft の仕上げが途中で止まった本を、通常の実行（tier=final）で仕上げる
+    for case_name in ("final", "draft", "interrupted"):
+        tier = "final" if case_name == "final" else "draft"
+        with tempfile.TemporaryDirectory(prefix=f"bench_preview_{case_name}_") as tmp:
+            os.chdir(tmp)
+            try:
+                paths = BookPaths(audio=Path("input/bench.mp3"))
+                paths.audio.parent.mkdir(parents=True, exist_ok=True)
+                paths.audio.write_bytes(b"ID3" + bytes(1024))
+                client = FakeOpenAI(plan, latency=latency, png=png)
+                api_client.set_client(client)
+
+                ctx = {}
+                t0 = time.perf_counter()
+                pipeline = Pipeline(build_stages(paths, ctx, concurrency=args.concurrency, tier=tier,
+                                                 page_count=args.pages),
+                                    paths.state, ctx)
+                pipeline.execute(set())
+                case = {"preview_seconds": time.perf_counter() - t0}
+                if case_name == "interrupted":
+                    # 仕上げの画像が1ページだけ書かれたところで止まった（記録はまだ draft のまま）
+                    (paths.pages / "01.png").write_bytes(tiny_png((200, 10, 10), 64))
+                    book_id = ctx["book_id"]
+                    ctx = {}
+                    pipeline = Pipeline(build_stages(paths, ctx, concurrency=args.concurrency,
+                                                     page_count=args.pages), paths.state, ctx)
+                    case["upgraded_pages"] = len(upgrade_drafts(pipeline, paths, ctx, set(),
+                                                                concurrency=args.concurrency))
+                    case["rerun_stages"] = pipeline.execute(set())
+                    case["same_book"] = ctx["book_id"] == book_id
+                    case["tiers"] = sorted(set(load_tiers(paths.pages).values()))
+                elif tier == "draft":
+                    upgraded = generate_images(paths.plan, paths.pages, concurrency=args.concurrency)
+                    refresh_pages(pipeline, paths, ctx, upgraded)
+                    case["final_seconds"] = time.perf_counter() - t0
+                    case["upgraded_pages"] = len(upgraded)
+                    case["rerun_stages"] = pipeline.execute(set())
+                    case["tiers"] = sorted(set(load_tiers(paths.pages).values()))
+                case["books"] = len(list(paths.books.glob("*/viewer.html")))
+                case["api_calls"] = dict(client.calls)
+                results[case_name] = case
+            finally:
+                os.chdir(cwd)
+
+    draft = results["draft"]
+    results["preview_speedup"] = results["final"]["preview_seconds"] / max(draft["preview_seconds"], 1e-9)
+    print(f"preview: {args.pages} pages | final first: {results['final']['preview_seconds']:.2f}s | "
+          f"draft first: {draft['preview_seconds']:.2f}s (x{results['preview_speedup']:.2f}), "
+          f"all final after {draft['final_seconds']:.2f}s ({draft['upgraded_pages']} pages upgraded in place)")
+    resumed = results["interrupted"]
+    print(f"preview: interrupted draft run → normal run upgraded {resumed['upgraded_pages']} pages in place, "
+          f"re-run stages: {', '.join(resumed['rerun_stages']) or 'none'}")
+    if any(c["books"] != 1 or c["tiers"] != ["final"] or c["rerun_stages"] or c["upgraded_pages"] != args.pages
+           for c in (draft, resumed)) or not resumed["same_book"]:
+        raise SystemExit("❌ 仕上げの画像がその場で差し替わっていないか、パイプラインがやり直そうとしています")
+    return results
+
+
+def bench_pages(args) -> dict:
+    """
+    偽の API で1冊作ったあと、--pages の1ページだけ描き直す場合と、全部作り直す場合（従来通り
+    全ページの画像を作り直して新しい本として公開する）を比べる。描き直しでは、そのページ以外の画像・PDF のページ・公開先のファイルが
+    変わっていないこと、同じ本がその場で更新されたことも確かめる。
+    """
+    import api_client
+    from fake_openai import FakeOpenAI, tiny_png
+    from image_cache import DEFAULT_CACHE_DIR
+    from pipeline import BookPaths, Pipeline, build_stages, rebuild_pages
+    from pypdf import PdfReader
+
+    plans = sorted(BOOKS_DIR.glob("*/book_plan.json"))
+    images = sample_images()
+    if not plans or not images:
+        raise SystemExit(f"❌ No sample books under {BOOKS_DIR}")
+    plan = synthetic_plan(json.loads(plans[0].read_text(encoding="utf-8")), args.pages)
+    png = images[0].read_bytes()
+    # 描き直しでは同じ大きさの別の画像を返すようにして、そのページだけが変わることを見る
+    redo_png = images[-1].read_bytes() if len(images) > 1 else tiny_png((10, 20, 30), 512)
+    latency = {"transcribe": 0.0, "plan_first_token": 0.0, "plan_per_char": 0.0, "image": args.image_latency}
+    for endpoint in api_client.ENDPOINT_RPM:
+        api_client.shared_limiter(endpoint, rpm=0)
+
+    def snapshot(paths: BookPaths, ctx: dict) -> dict:
+        book = paths.books / ctx["book_id"]
+        manifest = json.loads((book / "manifest.json").read_text(encoding="utf-8"))
+        return {"pngs": {f.name: f.read_bytes() for f in paths.pages.glob("*.png")},
+                "pdf": [page.get_contents().get_data() for page in PdfReader(str(paths.pdf)).pages],
+                "files": manifest["files"]}
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench_pages_") as tmp:
+        os.chdir(tmp)
+        try:
+            paths = BookPaths(audio=Path("input/bench.mp3"))
+            paths.audio.parent.mkdir(parents=True, exist_ok=True)
+            paths.audio.write_bytes(b"ID3" + bytes(1024))
+            client = FakeOpenAI(plan, latency=latency, png=png)
+            api_client.set_client(client)
+            ctx = {}
+            pipeline = Pipeline(build_stages(paths, ctx, concurrency=args.concurrency, page_count=args.pages),
+                                paths.state, ctx)
+            pipeline.execute(set())
+            before = snapshot(paths, ctx)
+
+            client.png = redo_png
+            target = args.redo
+            calls = client.calls.get("images", 0)
+            t0 = time.perf_counter()
+            rebuild_pages(pipeline, paths, ctx, [target], concurrency=args.concurrency)
+            one_page = time.perf_counter() - t0
+            after = snapshot(paths, ctx)
+            one_page_calls = client.calls["images"] - calls
+            rerun = pipeline.execute(set())
+
+            # 従来のやり方: 全ページの画像を作り直し（キャッシュの同じ絵では直らないので捨てる）、
+            # PDF を全部描き直して新しい本として公開する
+            shutil.rmtree(DEFAULT_CACHE_DIR, ignore_errors=True)
+            client.png = png
+            t0 = time.perf_counter()
+            Pipeline(build_stages(paths, ctx, force_images=True, concurrency=args.concurrency,
+                                  page_count=args.pages), paths.state, ctx).execute({"images"})
+            full = time.perf_counter() - t0
+        finally:
+            os.chdir(cwd)
+
+    name = f"{target:02d}"
+    changed = {
+        "pngs": sorted(k for k in before["pngs"] if before["pngs"][k] != after["pngs"][k]),
+        "pdf_pages": [i + 1 for i, (a, b) in enumerate(zip(before["pdf"], after["pdf"])) if a != b],
+        "published": sorted(k for k in after["files"] if before["files"].get(k) != after["files"][k]),
+    }
+    results = {"pages": args.pages, "redo": target, "one_page_seconds": one_page, "full_seconds": full,
+               "image_calls": one_page_calls, "changed": changed, "rerun_stages": rerun}
+    print(f"pages: redo page {target} of {args.pages} in {one_page:.2f}s ({one_page_calls} image call) vs full "
+          f"rebuild {full:.2f}s (x{full / max(one_page, 1e-9):.1f}) | changed pngs {changed['pngs']}, "
+          f"pdf pages {changed['pdf_pages']}, published {changed['published']}")
+    expected_files = {f"web/{name}.webp", f"thumbs/{name}.webp", "book.pdf"}
+    if (changed["pngs"] != [f"{name}.png"] or changed["pdf_pages"] != [target] or one_page_calls != 1
+            or not set(changed["published"]) <= expected_files or rerun):
+        raise SystemExit("❌ 指定したページ以外も作り直されたか、パイプラインがやり直そうとしています")
+    return results
+
+
+def bench_plan_check(args) -> dict:
+    """
+    validate_plan の速さ（docs/books の plan）と、壊れた plan を repair_plan で直すときの API 呼び出し。
+    --pages ページの plan から、1ページの image_prompt_api を消し、1ページの文を枠に入らない長さにし、
+    1ページを抜いてから直す（偽の API は元の plan を返すので、頼んだページが元に戻れば全ページ元通り）。
+    """
+    import api_client
+    import book_plan
+    from fake_openai import FakeOpenAI
+    from repaire_details import repair_plan
+
+    plans = [json.loads(p.read_text(encoding="utf-8")) for p in sorted(BOOKS_DIR.glob("*/book_plan.json"))]
+    if not plans:
+        raise SystemExit(f"❌ No sample books under {BOOKS_DIR}")
+    book_plan.validate_plan(plans[0], len(plans[0]["pages"]))   # フォント登録・文字幅のキャッシュを温める
+    per_plan = _timeit(lambda: [book_plan.validate_plan(p, len(p["pages"])) for p in plans], args.repeat) / len(plans)
+
+    plan = synthetic_plan(plans[0], args.pages)
+    broken = json.loads(json.dumps(plan))
+    broken["pages"][2]["image_prompt_api"] = ""
+    broken["pages"][5]["text"] = broken["pages"][5]["text"] * 20
+    del broken["pages"][8]
+    problems = book_plan.validate_plan(broken, args.pages)
+
+    client = FakeOpenAI(plan, latency={"plan_first_token": 0.0, "plan_per_char": 0.0})
+    request = {"model": "gpt-4.1-mini", "input": "（元のプロンプト）", "text": {"format": {"type": "json_object"}}}
+    with tempfile.TemporaryDirectory(prefix="bench_plan_check_") as tmp:
+        api_client.set_metrics_path(Path(tmp) / "api_metrics.jsonl")
+        t0 = time.perf_counter()
+        fixed = repair_plan(broken, request, client=client, page_count=args.pages)
+        seconds = time.perf_counter() - t0
+
+    results = {"validate_ms_per_plan": per_plan * 1000, "plans": len(plans), "pages": args.pages,
+               "problems": len(problems), "repair_seconds": seconds, "api_calls": dict(client.calls),
+               "repaired_equals_original": fixed["pages"] == plan["pages"]}
+    print(f"plan-check: validate {per_plan * 1000:.2f} ms/plan | repair of {len(problems)} problems "
+          f"({args.pages} pages): {client.calls.get('responses', 0)} call(s) in {seconds:.2f}s, "
+          f"same pages as original: {results['repaired_equals_original']}")
+    if not results["repaired_equals_original"] or client.calls.get("responses") != 1:
+        raise SystemExit("❌ 壊れたページだけを1回の呼び出しで直せていません")
+    return results
+
+
+def bench_chunks(args) -> dict:
+    """
+    audio_chunks の区間分け（plan_windows）・結合（merge_texts）・transcribe_chunks を、音声も API も使わずに確かめる。
+    docs/books の文をつなげた文章を、--overlap 文字ずつ重ねて --chunks 個に切ったものを「区間の文字起こし」とする。
+    - 重ねた部分が1回分になって元の文章に戻るか（結合の秒数も計る）
+    - 重なりが無いときは改行で区切られるか
+    - journal に記録した区間は2回目に文字起こしし直さず、force=True なら全部やり直すか
+    """
+    from audio_chunks import merge_texts, plan_windows, transcribe_chunks
+    from journal import RunJournal
+
+    plans = [json.loads(p.read_text(encoding="utf-8")) for p in sorted(BOOKS_DIR.glob("*/book_plan.json"))]
+    text = "".join(pg.get("text", "") for plan in plans for pg in plan.get("pages", []))
+    if not text:
+        raise SystemExit(f"❌ No sample books under {BOOKS_DIR}")
+    text = (text * (1 + args.chunks * 300 // len(text)))[:args.chunks * 300]
+    step = len(text) // args.chunks
+    pieces = [text[max(0, i * step - args.overlap):(i + 1) * step if i < args.chunks - 1 else len(text)]
+              for i in range(args.chunks)]
+
+    problems = []
+    windows = plan_windows(900.0, 300.0, 4.0, silences=[290.0, 610.0])
+    if [round(a, 1) for a, _ in windows] != [0.0, 286.0, 606.0] or windows[-1][1] != 900.0:
+        problems.append(f"plan_windows: {windows}")
+
+    merge_s = _timeit(lambda: merge_texts(pieces), args.repeat)
+    if merge_texts(pieces) != text:
+        problems.append("merge_texts: 重ねた部分が1回分になっていません")
+    if merge_texts(["むかしむかし", "おじいさんが"]) != "むかしむかし\nおじいさんが":
+        problems.append("merge_texts: 重なりが無いときに区切られていません")
+
+    calls = []
+
+    def fake_transcribe(path: Path) -> str:
+        calls.append(path.name)
+        return pieces[int(path.stem)]
+
+    with tempfile.TemporaryDirectory(prefix="bench_chunks_") as tmp:
+        chunks = [Path(tmp) / f"{i:03d}.mp3" for i in range(args.chunks)]
+        keys = [f"bench:{i}" for i in range(args.chunks)]
+        journal = RunJournal(Path(tmp) / "run_journal.jsonl")
+        runs = []
+        for force in (False, False, True):
+            before = len(calls)
+            merged = transcribe_chunks(chunks, fake_transcribe, Path(tmp) / "transcript.txt", workers=4,
+                                       journal=journal, keys=keys, force=force)
+            runs.append({"force": force, "calls": len(calls) - before, "same_text": merged == text})
+    if [r["calls"] for r in runs] != [args.chunks, 0, args.chunks] or not all(r["same_text"] for r in runs):
+        problems.append(f"transcribe_chunks: {runs}")
+
+    results = {"chunks": args.chunks, "chars": len(text), "merge_ms": merge_s * 1000, "runs": runs}
+    print(f"chunks: {args.chunks} chunks / {len(text)} chars merged in {merge_s * 1000:.2f} ms | "
+          f"API calls per run (journal, journal, force): {', '.join(str(r['calls']) for r in runs)}")
+    if problems:
+        raise SystemExit("❌ " + "\n❌ ".join(problems))
+    return results
+
+
+def git_commit() -> str:
+    p = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+    return p.stdout.strip() if p.returncode == 0 else ""
+
+
+def _flatten(results, prefix: str = "") -> dict[str, float]:
+    """{"cases": {"1b/10p": {"stages": {"pdf": 1.2}}}} → {"cases.1b/10p.stages.pdf": 1.2}"""
+    out = {}
+    for k, v in results.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(args) -> dict:
+    """2つの結果 JSON の、時間（seconds / _s / ms）の項目を並べる。"""
+    old, new = (_flatten(json.loads(p.read_text(encoding="utf-8"))["results"]) for p in (args.old, args.new))
+    rows = {}
+    for key in sorted(old.keys() & new.keys()):
+        if not (key.endswith(("seconds", "_s", "_ms", ".ms")) or ".stages." in key):
+            continue
+        a, b = old[key], new[key]
+        rows[key] = {"old": a, "new": b, "ratio": b / a if a else None}
+        mark = "  ⚠️" if a and b / a > 1 + args.threshold else ""
+        print(f"{key:<52}{a:>10.3f}{b:>10.3f}{(f'x{b / a:.2f}' if a else '-'):>8}{mark}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StoryBook benchmarks (offline)")
+    parser.add_argument("--json", type=Path, default=None,
+                        help="Save the results (with commit and environment) to this JSON file")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("wrap", help="text wrapping: old vs new on docs/books/*/book_plan.json")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(fn=bench_wrap)
+
+    p = sub.add_parser("pdf", help="PDF rendering at several worker counts")
+    p.add_argument("--pages", type=int, nargs="+", default=[40, 120])
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--repeat", type=int, default=1)
+    p.set_defaults(fn=bench_pdf)
+
+    p = sub.add_parser("shelf", help="shelf rebuild: full vs incremental on a synthetic shelf")
+    p.add_argument("--books", type=int, default=10000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_shelf)
+
+    p = sub.add_parser("search", help="search index size and query latency on a synthetic shelf")
+    p.add_argument("--books", type=int, default=10000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--queries", nargs="*", default=None)
+    p.set_defaults(fn=bench_search)
+
+    p = sub.add_parser("stream", help="plan then images vs streamed plan feeding the image queue (fake API)")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--image-latency", type=float, default=1.0)
+    p.add_argument("--plan-per-char", type=float, default=0.002)
+    p.add_argument("--repeat", type=int, default=1)
+    p.set_defaults(fn=bench_stream)
+
+    p = sub.add_parser("suite", help="every pipeline stage with a fake API, scaling books and pages")
+    p.add_argument("--books", type=int, nargs="+", default=[1, 10, 100, 1000])
+    p.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200])
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--latency", type=float, default=0.0, help="Fake transcription / plan latency (seconds)")
+    p.add_argument("--image-latency", type=float, default=0.0, help="Fake latency per image (seconds)")
+    p.add_argument("--png", choices=["sample", "tiny"], default="sample",
+                   help="Fake images: a real page from docs/books or an 8x8 PNG")
+    p.set_defaults(fn=bench_suite)
+
+    p = sub.add_parser("publish", help="per-book commit/push vs batched publish queue (local bare remote)")
+    p.add_argument("--books", type=int, default=20)
+    p.add_argument("--kb", type=int, default=512, help="Size of the fake page image per book (KB)")
+    p.add_argument("--max-books", type=int, default=5)
+    p.set_defaults(fn=bench_publish)
+
+    p = sub.add_parser("batch-api", help="plans and images through the Batch API for many books (fake API)")
+    p.add_argument("--books", type=int, default=20)
+    p.add_argument("--pages", type=int, default=10)
+    p.add_argument("--batch-latency", type=float, default=2.0, help="Seconds until a fake batch completes")
+    p.add_argument("--poll", type=float, default=0.5)
+    p.set_defaults(fn=bench_batch_api)
+
+    p = sub.add_parser("preview", help="time to first published preview: final images vs draft first (fake API)")
+    p.add_argument("--pages", type=int, default=10)
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--image-latency", type=float, default=2.0, help="Fake latency per final image (seconds)")
+    p.add_argument("--draft-latency", type=float, default=0.5, help="Fake latency per draft image (seconds)")
+    p.add_argument("--png", choices=["sample", "tiny"], default="sample",
+                   help="Fake images: a real page from docs/books or an 8x8 PNG")
+    p.set_defaults(fn=bench_preview)
+
+    p = sub.add_parser("pages", help="redo one page with --pages vs rebuilding every page (fake API)")
+    p.add_argument("--pages", type=int, default=20)
+    p.add_argument("--redo", type=int, default=3, help="Page to redo")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--image-latency", type=float, default=1.0, help="Fake latency per image (seconds)")
+    p.set_defaults(fn=bench_pages)
+
+    p = sub.add_parser("plan-check", help="plan validation speed and page-level repair (fake API)")
+    p.add_argument("--pages", type=int, default=10)
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(fn=bench_plan_check)
+
+    p = sub.add_parser("chunks", help="chunk windows, overlap merging and journal reuse (stub transcription)")
+    p.add_argument("--chunks", type=int, default=8)
+    p.add_argument("--overlap", type=int, default=40, help="Characters shared by neighbouring chunks")
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(fn=bench_chunks)
+
+    p = sub.add_parser("compare", help="compare two --json result files")
+    p.add_argument("old", type=Path)
+    p.add_argument("new", type=Path)
+    p.add_argument("--threshold", type=float, default=0.10, help="Flag timings slower by more than this ratio")
+    p.set_defaults(fn=compare)
+
+    args = parser.parse_args()
+    results = args.fn(args)
+    if args.json and args.cmd != "compare":
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps({
+            "bench": args.cmd, "commit": git_commit(), "date": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0], "platform": platform.platform(), "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("fn", "json")},
+            "results": results,
+        }, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+        print("✅ results saved:", args.json.as_posix())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
+import argparse
 import json
-import os
+import time
 from pathlib import Path
 
-from dotenv import load_dotenv
-from openai import OpenAI
+from api_client import call_api, get_client, record_call, usage_tokens
+from plan_stream import PlanStreamParser
 
 PROMPT_PATH = Path("work/prompt.txt")
 DEFAULT_PROMPT = """あなたは絵本編集者です。
@@ -12,8 +13,6 @@ DEFAULT_PROMPT = """あなたは絵本編集者です。
 \"\"\"{transcript}\"\"\"
 """
 
-load_dotenv()
-
 TRANSCRIPT_PATH = Path("work/transcript.txt")
 OUT_PATH = Path("work/book_plan.json")
 
@@ -26,60 +25,216 @@ STYLE_BIBLE = (
     "クリーンな輪郭線、安心感のある光、子ども向け、過度に写実的にしない。"
 )
 
-def load_prompt_template() -> str:
-    if PROMPT_PATH.exists():
-        return PROMPT_PATH.read_text(encoding="utf-8")
+# 各ページに必ず要る項目（空でない文字列）
+REQUIRED_PAGE_FIELDS = ("text", "image_prompt_api")
+
+def page_problems(p, check_text: bool = True) -> list[str]:
+    """1ページ分の問題（必須項目・text が PDF の枠に収まるか）。"""
+    if not isinstance(p, dict):
+        return ["ページが JSON のオブジェクトではありません"]
+    problems = []
+    for field in REQUIRED_PAGE_FIELDS:
+        value = p.get(field)
+        if not isinstance(value, str) or not value.strip():
+            problems.append(f"{field} がありません")
+    if check_text and isinstance(p.get("text"), str):
+        from make_pdf import MAX_TEXT_LINES, text_lines
+        lines = len(text_lines(p["text"]))
+        if lines > MAX_TEXT_LINES:
+            problems.append(f"text が {lines} 行で、PDF の枠（{MAX_TEXT_LINES} 行）に入りません")
+    return problems
+
+def validate_plan(data, page_count: int | None = None, check_text: bool = True) -> list[tuple[int | None, str]]:
+    """
+    plan を検査し、問題の (ページ番号, 内容) を返す（空なら OK）。plan 全体の問題はページ番号が None。
+    - pages が page_count（既定は PAGE_COUNT）ページあり、page が 1 から順に並んでいる
+    - 各ページに REQUIRED_PAGE_FIELDS がある
+    - text が make_pdf の折り返しで右のテキスト枠に収まる（check_text=True のとき）
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("pages"), list) or not data["pages"]:
+        return [(None, "pages がありません")]
+    page_count = page_count or PAGE_COUNT
+    pages = data["pages"]
+    nums = [p.get("page") if isinstance(p, dict) else None for p in pages]
+    problems = []
+    if len(pages) != page_count:
+        problems.append((None, f"ページ数が {len(pages)} です（{page_count} ページのはず）"))
+    if nums != list(range(1, len(pages) + 1)):
+        problems.append((None, "page が 1 から順に並んでいません"))
+    problems += [(n, "ページがありません") for n in range(1, page_count + 1) if n not in nums]
+    for n, p in zip(nums, pages):
+        if isinstance(n, int):
+            problems += [(n, problem) for problem in page_problems(p, check_text)]
+    return problems
+
+def load_prompt_template(prompt_path: Path = PROMPT_PATH) -> str:
+    if prompt_path.exists():
+        return prompt_path.read_text(encoding="utf-8")
     return DEFAULT_PROMPT
 
-def main():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY が見つかりません。.env を確認してください。")
-
-    if not TRANSCRIPT_PATH.exists():
-        raise FileNotFoundError(f"{TRANSCRIPT_PATH} が見つかりません。")
+def plan_request(transcript_path: Path = TRANSCRIPT_PATH, prompt_path: Path = PROMPT_PATH,
+                 page_count: int | None = None) -> dict:
+    """
+    transcript とプロンプトのテンプレートから Responses API へのリクエスト（model, input, text）を作る。
+    page_count はプロンプトで頼むページ数（既定は PAGE_COUNT）。
+    """
+    if not transcript_path.exists():
+        raise FileNotFoundError(f"{transcript_path} が見つかりません。")
 
-    transcript = TRANSCRIPT_PATH.read_text(encoding="utf-8").strip()
+    transcript = transcript_path.read_text(encoding="utf-8").strip()
     if len(transcript) < 50:
         raise RuntimeError("transcriptが短すぎます。")
 
-    client = OpenAI(api_key=api_key)
-
-    template = load_prompt_template()
+    template = load_prompt_template(prompt_path)
 
     # prompt.txt 内の JSON の波括弧は {{ }} にしてある前提（あなたのテンプレはOK）
     prompt = template.format(
         TARGET_AGE=TARGET_AGE,
-        PAGE_COUNT=PAGE_COUNT,
+        PAGE_COUNT=page_count or PAGE_COUNT,
         STYLE_BIBLE=STYLE_BIBLE,
         LANGUAGE=LANGUAGE,
         transcript=transcript,
     )
-    print("PROMPT_PATH:", PROMPT_PATH.resolve(), "exists:", PROMPT_PATH.exists())
+    print("PROMPT_PATH:", prompt_path.resolve(), "exists:", prompt_path.exists())
     print("prompt length:", len(prompt))
     print("contains 'json'?:", "json" in prompt.lower())
     print("prompt head:", repr(prompt[:200]))
 
-    resp = client.responses.create(
+    return dict(
         model="gpt-4.1-mini",
         input=prompt,
         # ★JSONを安定させたいなら（推奨）
         text={"format": {"type": "json_object"}},
     )
 
-    text_out = resp.output_text
-    print("---- output_text ----")
-    print(repr(text_out))
-    print("---- raw resp ----")
-    print(resp)
+def save_plan(data: dict, out_path: Path = OUT_PATH) -> dict:
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
 
-
-    data = json.loads(text_out)
-    OUT_PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-
-    print("✅ book_plan saved:", OUT_PATH)
+    print("✅ book_plan saved:", out_path)
     print("title:", data.get("title"))
     print("pages:", len(data.get("pages", [])))
+    return data
+
+def make_plan(transcript_path: Path = TRANSCRIPT_PATH, out_path: Path = OUT_PATH,
+              prompt_path: Path = PROMPT_PATH, *, stream: bool = False, on_page=None, client=None,
+              page_count: int | None = None) -> dict:
+    """
+    transcript から絵本の構成（book_plan.json）を作って保存し、その dict を返す。
+    stream=True なら応答をストリーミングで受け取り、pages の各ページが届いた時点で
+    on_page(page, fields) を呼ぶ（fields はその時点で届いているトップレベルの値）。
+    client を渡すとそれを使う（テスト・ベンチマーク用の偽クライアントなど）。
+    保存する前に validate_plan で検査し、問題のあるページだけ聞き直して直す（repaire_details.py）。
+    page_count は頼む・検査するページ数（既定は PAGE_COUNT）。
+    """
+    from repaire_details import repair_plan
+
+    request = plan_request(transcript_path, prompt_path, page_count)
+    client = client or get_client()
+
+    if stream:
+        data = _stream_plan(client, request, on_page)
+    else:
+        resp = call_api("responses", lambda: client.responses.create(**request), label="book_plan")
+
+        text_out = resp.output_text
+        print("---- output_text ----")
+        print(repr(text_out))
+        print("---- raw resp ----")
+        print(resp)
+
+        data = json.loads(text_out)
+    return save_plan(repair_plan(data, request, client=client, page_count=page_count), out_path)
+
+def _stream_plan(client, request: dict, on_page=None) -> dict:
+    """応答をストリーミングで読み、ページが閉じるたびに on_page に渡す。plan 全体を返す。"""
+    parser = PlanStreamParser()
+    t0 = time.perf_counter()
+    # リトライするのは接続まで（途中で切れたら plan 全体をやり直す）
+    events = call_api("responses", lambda: client.responses.create(**request, stream=True),
+                      label="book_plan (stream)")
+    usage, chars = {}, 0
+    for event in events:
+        if event.type == "response.completed":
+            usage = usage_tokens(getattr(event, "response", None))
+        if event.type != "response.output_text.delta":
+            continue
+        chars += len(event.delta)
+        for page in parser.feed(event.delta):
+            print(f"   plan page {page.get('page')} received ({time.perf_counter() - t0:.1f}s)")
+            if on_page is not None:
+                on_page(page, parser.fields)
+    elapsed = time.perf_counter() - t0
+    record_call("responses", label="book_plan (stream body)", status="ok", seconds=round(elapsed, 3),
+                chars=chars, **usage)
+    print(f"   plan complete ({elapsed:.1f}s, {len(parser.pages)} pages)")
+    return parser.result()
+
+def make_plan_with_images(transcript_path: Path = TRANSCRIPT_PATH, out_path: Path = OUT_PATH,
+                          prompt_path: Path = PROMPT_PATH, client=None, page_count: int | None = None,
+                          **image_opts) -> dict:
+    """
+    plan をストリーミングで作りながら、届いたページから順に画像生成を始める。
+    image_opts は generate_images.ImageQueue の引数（out_dir, concurrency, rpm など）。
+    画像のプロンプトには style_bible を足すので、style_bible が届くまではページを溜めておく。
+    問題のあるページ（page_problems）は画像を作らず、plan を直し終えてから作る。
+    """
+    from generate_images import ImageQueue
+
+    page_count = page_count or PAGE_COUNT
+    state = {"queue": None, "pending": []}
+    submitted = {}   # page → 画像を頼んだときの image_prompt_api
+
+    def submit(page: dict):
+        if page.get("page") in submitted:
+            # 前のプロンプトの画像が後から書き込まれないよう、終わるのを待ってから頼み直す
+            state["queue"].wait_page(page["page"])
+        submitted[page.get("page")] = page.get("image_prompt_api")
+        state["queue"].submit(page)
+
+    def start_queue(style_bible: str):
+        state["queue"] = ImageQueue(style_bible=style_bible, client=client, **image_opts)
+        for page in state["pending"]:
+            submit(page)
+        state["pending"] = []
+
+    def on_page(page: dict, fields: dict):
+        if page_problems(page) or not isinstance(page.get("page"), int) or not 1 <= page["page"] <= page_count:
+            print(f"   plan page {page.get('page')}: 問題があるので画像は plan を直してから作ります")
+            return
+        if state["queue"] is None and "style_bible" not in fields:
+            state["pending"].append(page)
+            return
+        if state["queue"] is None:
+            start_queue(fields.get("style_bible", ""))
+        submit(page)
+
+    try:
+        data = make_plan(transcript_path, out_path, prompt_path, stream=True, on_page=on_page, client=client,
+                         page_count=page_count)
+        if state["queue"] is None:
+            start_queue(data.get("style_bible", ""))
+        # 直したページ・後から足したページ（頼んだときとプロンプトが違うもの）の画像
+        for page in data.get("pages", []):
+            if submitted.get(page["page"], object()) != page["image_prompt_api"]:
+                submit(page)
+    finally:
+        if state["queue"] is not None:
+            state["queue"].close()
+    return data
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stream", action="store_true", help="応答をストリーミングで受け取る")
+    parser.add_argument("--with-images", action="store_true",
+                        help="ストリーミングで届いたページから順に画像生成も始める（--stream を含む）")
+    parser.add_argument("--concurrency", type=int, default=2, help="同時に生成する画像の数（--with-images）")
+    args = parser.parse_args()
+
+    if args.with_images:
+        make_plan_with_images(concurrency=args.concurrency)
+    else:
+        make_plan(stream=args.stream)
 
 if __name__ == "__main__":
     main()
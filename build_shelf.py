@@ -1,131 +1,389 @@
+import argparse
+import hashlib
 import json
+import os
 from pathlib import Path
 from datetime import datetime
 
+from fileutil import atomic_write_bytes
+from search_index import SEARCH_NAME, build_search_index
+
 DOCS_DIR = Path("docs")
 BOOKS_DIR = DOCS_DIR / "books"
 OUT_INDEX = DOCS_DIR / "index.html"
 
-def parse_dt(book_id: str):
-    try:
-        return datetime.strptime(book_id, "%Y%m%d_%H%M%S")
-    except Exception:
-        return None
+# 本ごとの棚情報のキャッシュ（index.html と同じ場所に置く）
+MANIFEST_NAME = "shelf_manifest.json"
+MANIFEST_VERSION = 3
 
-def main():
-    BOOKS_DIR.mkdir(parents=True, exist_ok=True)
-
-    books = []
-    # 各本の book_plan.json を直接探す（確実に拾える）
-    for plan_path in BOOKS_DIR.glob("*/book_plan.json"):
-        book_dir = plan_path.parent
-        viewer_path = book_dir / "viewer.html"
-        details_path = book_dir / "details.html"
-        cover_path = book_dir / "pages" / "01.png"
-        pdf_path = book_dir / "book.pdf"
-
-        # viewer が無い本は棚に出さない（生成途中の可能性）
-        if not viewer_path.exists():
-            continue
+# 本棚の一覧データ（catalog/index.json ＋ catalog/page-NNNN.json）
+CATALOG_NAME = "catalog"
+PAGE_SIZE = 100
 
-        plan = json.loads(plan_path.read_text(encoding="utf-8"))
-        title = plan.get("title", book_dir.name)
-        target_age = plan.get("target_age", "") or "-"
-
-        books.append({
-            "id": book_dir.name,
-            "title": title,
-            "target_age": target_age,
-            "viewer": f"books/{book_dir.name}/viewer.html",
-            "details": f"books/{book_dir.name}/details.html",
-            "pdf": f"books/{book_dir.name}/book.pdf",
-            "cover": f"books/{book_dir.name}/pages/01.png" if cover_path.exists() else "",
-            "has_details": details_path.exists(),
-            "has_pdf": pdf_path.exists(),
-        })
-
-    # 新しい本ほど上
-    books.sort(key=lambda b: parse_dt(b["id"]) or datetime.min, reverse=True)
-
-    cards = []
-    for b in books:
-        cover_html = (
-            f'<img src="{b["cover"]}" alt="cover" />'
-            if b["cover"]
-            else '<div class="noimg">No cover</div>'
-        )
-
-        details_btn = (
-            f'<a class="btn" href="{b["details"]}">詳細</a>'
-            if b["has_details"]
-            else '<span class="btn disabled" title="details.html がまだありません">詳細</span>'
-        )
-
-        pdf_btn = (
-            f'<a class="btn" href="{b["pdf"]}" target="_blank" rel="noreferrer">PDF</a>'
-            if b["has_pdf"]
-            else '<span class="btn disabled" title="book.pdf がまだありません">PDF</span>'
-        )
-
-        cards.append(f"""
-        <article class="card">
-          <a class="cover" href="{b["viewer"]}">
-            {cover_html}
-          </a>
-
-          <div class="meta">
-            <div class="title">{b["title"]}</div>
-            <div class="sub">target_age: {b["target_age"]}</div>
-          </div>
-
-          <div class="actions">
-            <a class="btn" href="{b["viewer"]}">Webで読む</a>
-            {details_btn}
-            {pdf_btn}
-          </div>
-        </article>
-        """.strip())
-
-    html = f"""<!doctype html>
+SHELF_HTML = """<!doctype html>
 <html lang="ja">
 <head>
   <meta charset="utf-8" />
   <meta name="viewport" content="width=device-width,initial-scale=1" />
   <title>StoryBook Shelf</title>
   <style>
-    body{{font-family:system-ui,-apple-system,"Segoe UI",sans-serif;margin:0;background:#f6f6f6}}
-    header{{padding:18px 20px;background:#fff;border-bottom:1px solid #eee}}
-    h1{{font-size:18px;margin:0}}
-    .wrap{{max-width:1200px;margin:18px auto;padding:0 16px}}
-    .grid{{display:grid;grid-template-columns:repeat(auto-fill,minmax(220px,1fr));gap:14px}}
-    .card{{background:#fff;border:1px solid #eee;border-radius:16px;overflow:hidden;box-shadow:0 1px 6px rgba(0,0,0,.04);display:flex;flex-direction:column}}
-    .cover img{{width:100%;height:auto;display:block;background:#fafafa}}
-    .noimg{{height:280px;display:flex;align-items:center;justify-content:center;color:#999;background:#fafafa}}
-    .meta{{padding:12px 12px 0}}
-    .title{{font-weight:700}}
-    .sub{{color:#666;font-size:12px;margin-top:4px}}
-    .actions{{display:flex;gap:8px;padding:12px;flex-wrap:wrap}}
-    .btn{{display:inline-block;padding:10px 12px;border:1px solid #ddd;border-radius:12px;background:#fff;text-decoration:none;color:#0b57d0;text-align:center;flex:1;min-width:90px}}
-    .btn.disabled{{color:#aaa;border-color:#eee;background:#fafafa;cursor:not-allowed}}
-    .hint{{color:#666;font-size:13px;margin:10px 0 0}}
+    body{font-family:system-ui,-apple-system,"Segoe UI",sans-serif;margin:0;background:#f6f6f6}
+    header{padding:18px 20px;background:#fff;border-bottom:1px solid #eee}
+    h1{font-size:18px;margin:0}
+    .wrap{max-width:1200px;margin:18px auto;padding:0 16px}
+    .grid{display:grid;grid-template-columns:repeat(auto-fill,minmax(220px,1fr));gap:14px}
+    .card{background:#fff;border:1px solid #eee;border-radius:16px;overflow:hidden;box-shadow:0 1px 6px rgba(0,0,0,.04);display:flex;flex-direction:column}
+    .cover img{width:100%;height:auto;aspect-ratio:1/1;object-fit:cover;display:block;background:#fafafa}
+    .noimg{height:280px;display:flex;align-items:center;justify-content:center;color:#999;background:#fafafa}
+    .meta{padding:12px 12px 0}
+    .title{font-weight:700}
+    .sub{color:#666;font-size:12px;margin-top:4px}
+    .actions{display:flex;gap:8px;padding:12px;flex-wrap:wrap}
+    .btn{display:inline-block;padding:10px 12px;border:1px solid #ddd;border-radius:12px;background:#fff;text-decoration:none;color:#0b57d0;text-align:center;flex:1;min-width:90px}
+    .btn.disabled{color:#aaa;border-color:#eee;background:#fafafa;cursor:not-allowed}
+    .hint{color:#666;font-size:13px;margin:10px 0 0}
+    #more{height:1px}
+    #status{color:#666;font-size:13px;text-align:center;padding:18px}
+    #q{margin-top:12px;width:100%;max-width:420px;box-sizing:border-box;padding:10px 12px;border:1px solid #ddd;border-radius:12px;font-size:15px}
   </style>
 </head>
 <body>
   <header>
     <h1>📚 StoryBook Shelf</h1>
     <div class="hint">新しい本ほど上に表示されます。</div>
+    <input id="q" type="search" placeholder="タイトル・登場人物・本文で検索" autocomplete="off" />
   </header>
 
   <div class="wrap">
-    <div class="grid">
-      {"".join(cards) if cards else "<p>まだ本がありません。publish_book.py を実行してください。</p>"}
-    </div>
+    <div class="grid" id="grid"></div>
+    <div class="grid" id="results" hidden></div>
+    <div id="more"></div>
+    <div id="status">読み込み中...</div>
   </div>
+
+  <script>
+    // catalog/page-NNNN.json は古い順。最後のページから逆にたどって新しい順に並べる
+    const grid = document.getElementById('grid');
+    const status = document.getElementById('status');
+    const results = document.getElementById('results');
+    let pages = [], pageSize = 0, next = -1, loading = false;
+    const pageCache = new Map();
+
+    function catalogPage(i){
+      if(!pageCache.has(i)){
+        const page = pages[i];
+        pageCache.set(i, fetch(`catalog/${page.file}?v=${page.v}`).then(res => {
+          if(!res.ok) throw new Error(`catalog/${page.file} が読めません`);
+          return res.json();
+        }).catch(err => {
+          // 失敗した読み込みは覚えておかない（次に見えたときに読み直す）
+          pageCache.delete(i);
+          throw err;
+        }));
+      }
+      return pageCache.get(i);
+    }
+
+    function h(tag, attrs, ...children){
+      const e = document.createElement(tag);
+      for(const [k, v] of Object.entries(attrs || {})) e.setAttribute(k, v);
+      for(const c of children) e.append(c);
+      return e;
+    }
+
+    function btn(href, label, ok, missing){
+      if(!ok) return h('span', {class: 'btn disabled', title: missing}, label);
+      const a = h('a', {class: 'btn', href}, label);
+      if(label === 'PDF'){ a.target = '_blank'; a.rel = 'noreferrer'; }
+      return a;
+    }
+
+    function card(b){
+      const base = `books/${b.id}/`;
+      const cover = b.cover
+        ? h('img', {src: b.cover, alt: 'cover', loading: 'lazy', decoding: 'async'})
+        : h('div', {class: 'noimg'}, 'No cover');
+      return h('article', {class: 'card'},
+        h('a', {class: 'cover', href: base + 'viewer.html'}, cover),
+        h('div', {class: 'meta'},
+          h('div', {class: 'title'}, b.title || b.id),
+          h('div', {class: 'sub'}, `target_age: ${b.age || '-'}`)),
+        h('div', {class: 'actions'},
+          btn(base + 'viewer.html', 'Webで読む', true),
+          btn(base + 'details.html', '詳細', b.details, 'details.html がまだありません'),
+          btn(base + 'book.pdf', 'PDF', b.pdf, 'book.pdf がまだありません')));
+    }
+
+    async function loadMore(){
+      if(loading || next < 0 || grid.hidden) return;
+      loading = true;
+      try {
+        const books = await catalogPage(next);
+        // 読めてから次のページへ進む（失敗したページは次に見えたときにもう一度読む）
+        next--;
+        for(const b of [...books].reverse()) grid.append(card(b));
+        status.textContent = next < 0 ? '' : '読み込み中...';
+      } finally {
+        loading = false;
+      }
+    }
+
+    async function init(){
+      const res = await fetch('catalog/index.json', { cache: 'no-cache' });
+      if(!res.ok) throw new Error('catalog/index.json が読めません');
+      const index = await res.json();
+      pages = index.pages;
+      pageSize = index.page_size;
+      next = pages.length - 1;
+      if(index.total === 0){
+        status.textContent = 'まだ本がありません。publish_book.py を実行してください。';
+        return;
+      }
+      const more = document.getElementById('more');
+      const io = new IntersectionObserver(async (items) => {
+        if(!items[0].isIntersecting) return;
+        // 1ページ読んでもまだ画面下が見えていれば続けて読む
+        try {
+          do { await loadMore(); }
+          while(next >= 0 && !grid.hidden && more.getBoundingClientRect().top < innerHeight + 800);
+        } catch(err) {
+          status.textContent = `Error: ${err.message}`;
+        }
+      }, { rootMargin: '800px' });
+      io.observe(more);
+    }
+
+    // 検索: search/s-XX.json（語の先頭1文字で分けた転置インデックス）を必要な分だけ読む。
+    // 分かち方・前方一致の規則は search_index.py と同じ
+    const TOKEN_RE = /[ぁ-ヿ㐀-䶿一-鿿豈-﫿]+|[0-9a-zà-ɏ]+/gu;
+    const isWord = t => t[0] <= 'ɏ';
+    let searchMeta = null, seq = 0;
+    const shardCache = new Map();
+
+    function queryTerms(q){
+      const terms = [];
+      for(const m of q.normalize('NFKC').toLowerCase().matchAll(TOKEN_RE)){
+        const run = Array.from(m[0]);
+        const grams = (isWord(m[0]) || run.length === 1) ? [m[0]] : run.slice(0, -1).map((c, i) => c + run[i + 1]);
+        for(const g of grams) if(!terms.includes(g)) terms.push(g);
+      }
+      return terms;
+    }
+
+    function shard(name){
+      if(!shardCache.has(name)){
+        const v = searchMeta.shards[name];
+        shardCache.set(name, !v ? Promise.resolve({}) : fetch(`search/s-${name}.json?v=${v}`).then(r => r.json()));
+      }
+      return shardCache.get(name);
+    }
+
+    async function findBooks(q){
+      if(!searchMeta) searchMeta = await (await fetch('search/meta.json', { cache: 'no-cache' })).json();
+      let hits = null;
+      for(const term of queryTerms(q)){
+        const postings = await shard((term.codePointAt(0) % 256).toString(16).padStart(2, '0'));
+        const found = new Set();
+        for(const [t, deltas] of Object.entries(postings)){
+          if(t === term || ((Array.from(term).length === 1 || isWord(term)) && t.startsWith(term))){
+            let n = 0;
+            for(const d of deltas){ n += d; found.add(n); }
+          }
+        }
+        hits = hits === null ? found : new Set([...hits].filter(n => found.has(n)));
+        if(!hits.size) break;
+      }
+      return [...(hits || [])].sort((a, b) => b - a).slice(0, 50);
+    }
+
+    async function runSearch(q){
+      const mine = ++seq;
+      if(!q.trim()){
+        results.hidden = true; grid.hidden = false;
+        status.textContent = next < 0 ? '' : '読み込み中...';
+        return;
+      }
+      const nums = await findBooks(q);
+      const books = await Promise.all(nums.filter(n => n < pageSize * pages.length).map(
+        async n => (await catalogPage(Math.floor(n / pageSize)))[n % pageSize]));
+      if(mine !== seq) return;
+      results.replaceChildren(...books.filter(Boolean).map(card));
+      results.hidden = false; grid.hidden = true;
+      status.textContent = books.length ? `${books.length} 冊見つかりました` : '見つかりませんでした';
+    }
+
+    let timer = 0;
+    document.getElementById('q').addEventListener('input', e => {
+      clearTimeout(timer);
+      timer = setTimeout(() => runSearch(e.target.value).catch(err => { status.textContent = `Error: ${err.message}`; }), 200);
+    });
+
+    init().catch(err => {
+      status.textContent = `Error: ${err.message}`;
+    });
+  </script>
 </body>
 </html>
 """
-    OUT_INDEX.write_text(html, encoding="utf-8")
-    print("✅ Shelf generated:", OUT_INDEX, "books:", len(books))
+
+def parse_dt(book_id: str):
+    try:
+        return datetime.strptime(book_id, "%Y%m%d_%H%M%S")
+    except Exception:
+        return None
+
+def scan_book(book_dir: Path, docs_dir: Path) -> dict | None:
+    """1冊分の棚情報を集める。viewer が無い本（生成途中の可能性）は None。"""
+    plan_path = book_dir / "book_plan.json"
+    viewer_path = book_dir / "viewer.html"
+    details_path = book_dir / "details.html"
+    # 表紙は小さいサムネイルがあればそれを使う（無ければ web 画像 → 元の PNG）
+    cover_path = next(
+        (p for p in (book_dir / "thumbs" / "01.webp", book_dir / "web" / "01.webp", book_dir / "pages" / "01.png")
+         if p.exists()),
+        None,
+    )
+    pdf_path = book_dir / "book.pdf"
+
+    # viewer が無い本は棚に出さない（生成途中の可能性）
+    if not plan_path.exists() or not viewer_path.exists():
+        return None
+
+    plan = json.loads(plan_path.read_text(encoding="utf-8"))
+    title = plan.get("title", book_dir.name)
+    target_age = plan.get("target_age", "") or "-"
+
+    return {
+        "id": book_dir.name,
+        "title": title,
+        "target_age": target_age,
+        "viewer": f"books/{book_dir.name}/viewer.html",
+        "details": f"books/{book_dir.name}/details.html",
+        "pdf": f"books/{book_dir.name}/book.pdf",
+        "cover": cover_path.relative_to(docs_dir).as_posix() if cover_path else "",
+        "has_details": details_path.exists(),
+        "has_pdf": pdf_path.exists(),
+    }
+
+def _stamp(entry: os.DirEntry) -> list | None:
+    """
+    本が変わったかどうかの目印: (本ディレクトリの mtime, plan の mtime, plan のサイズ)。
+    ファイルの追加・削除はディレクトリの mtime、plan の書き換えは plan の mtime/サイズに出る。
+    """
+    try:
+        d = entry.stat()
+        p = os.stat(os.path.join(entry.path, "book_plan.json"))
+    except FileNotFoundError:
+        return None
+    return [d.st_mtime_ns, p.st_mtime_ns, p.st_size]
+
+def _sort_key(book_id: str) -> str:
+    dt = parse_dt(book_id)
+    return dt.isoformat() if dt else ""
+
+def load_manifest(path: Path) -> dict:
+    if path.exists():
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if data.get("version") == MANIFEST_VERSION:
+            return data
+    return {"version": MANIFEST_VERSION, "books": {}, "shards": {}}
+
+def write_catalog(shelf: list[dict], catalog_dir: Path, page_size: int, old_shards: dict) -> dict:
+    """
+    本（古い順）を page_size 冊ずつ catalog/page-NNNN.json に書く。
+    古い順に詰めるので、新しい本が増えても書き換わるのは最後のページだけ。
+    中身が前回と同じページは書かない。{ファイル名: 中身のハッシュ} を返す。
+    """
+    catalog_dir.mkdir(parents=True, exist_ok=True)
+    shards = {}
+    for i in range(0, len(shelf), page_size):
+        name = f"page-{i // page_size + 1:04d}.json"
+        data = json.dumps([_catalog_record(b) for b in shelf[i:i + page_size]],
+                          ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        if old_shards.get(name) != digest or not (catalog_dir / name).exists():
+            atomic_write_bytes(catalog_dir / name, data)
+        shards[name] = digest
+    # 冊数が減ったときの余りページを消す
+    for p in catalog_dir.glob("page-*.json"):
+        if p.name not in shards:
+            p.unlink()
+    return shards
+
+def _catalog_record(b: dict) -> dict:
+    """catalog に載せる最小限の情報（リンクは id からブラウザ側で組み立てる）。"""
+    rec = {"id": b["id"], "title": b["title"], "age": b["target_age"], "cover": b["cover"]}
+    if b["has_details"]:
+        rec["details"] = 1
+    if b["has_pdf"]:
+        rec["pdf"] = 1
+    return rec
+
+def build_shelf(books_dir: Path = BOOKS_DIR, out_index: Path = OUT_INDEX, full: bool = False,
+                manifest_path: Path | None = None, page_size: int = PAGE_SIZE) -> int:
+    """
+    books_dir 配下の本を集めて本棚（index.html ＋ catalog/*.json）を作る。本の冊数を返す。
+    前回の結果（shelf_manifest.json）を使い、新しい本・変わった本だけ読み直す。
+    full=True なら全部読み直す。
+    index.html は本の数に関係なく同じ小さなページで、catalog をスクロールに合わせて読み込む。
+    """
+    books_dir.mkdir(parents=True, exist_ok=True)
+    docs_dir = books_dir.parent
+    catalog_dir = out_index.parent / CATALOG_NAME
+    manifest_path = manifest_path or out_index.parent / MANIFEST_NAME
+
+    manifest = {"books": {}, "shards": {}} if full else load_manifest(manifest_path)
+    old = manifest["books"]
+    entries = {}
+    parsed = set()
+    for d in os.scandir(books_dir):
+        if not d.is_dir():
+            continue
+        stamp = _stamp(d)
+        if stamp is None:
+            continue
+        prev = old.get(d.name)
+        if prev is not None and prev["stamp"] == stamp:
+            entries[d.name] = prev
+            continue
+        parsed.add(d.name)
+        entries[d.name] = {
+            "stamp": stamp,
+            "book": scan_book(Path(d.path), docs_dir),
+            "sort": _sort_key(d.name),
+        }
+
+    # 古い順（日付の読めない id は一番古い扱い）。表示はブラウザ側で新しい順にする
+    shelf = [e["book"] for e in sorted((e for e in entries.values() if e["book"]),
+                                       key=lambda e: (e["sort"], e["book"]["id"]))]
+    shards = write_catalog(shelf, catalog_dir, page_size, manifest.get("shards", {}))
+    # 検索用インデックスも catalog と同じ並び（本の番号 = catalog の通し番号）で作る
+    search = build_search_index([(b["id"], books_dir / b["id"] / "book_plan.json") for b in shelf],
+                                out_index.parent / SEARCH_NAME, manifest.get("search"), parsed)
+
+    index = {
+        "total": len(shelf),
+        "page_size": page_size,
+        "pages": [{"file": name, "v": digest} for name, digest in shards.items()],
+    }
+    atomic_write_bytes(catalog_dir / "index.json", json.dumps(index, separators=(",", ":")).encode("utf-8"))
+
+    atomic_write_bytes(manifest_path, json.dumps(
+        {"version": MANIFEST_VERSION, "books": entries, "shards": shards, "search": search}, ensure_ascii=False).encode("utf-8"))
+
+    if not out_index.exists() or out_index.read_text(encoding="utf-8") != SHELF_HTML:
+        out_index.write_text(SHELF_HTML, encoding="utf-8")
+    print(f"✅ Shelf generated: {out_index} books: {len(shelf)} (parsed {len(parsed)}, cached {len(entries) - len(parsed)},"
+          f" catalog pages {len(shards)})")
+    return len(shelf)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="キャッシュを使わず全部の本を読み直す")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="catalog の1ページの冊数")
+    args = parser.parse_args()
+
+    build_shelf(full=args.full, page_size=args.page_size)
 
 if __name__ == "__main__":
     main()
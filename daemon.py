@@ -0,0 +1,362 @@
+"""
+常駐モード。input/ を見張り、新しい音声ファイルが置かれたら1冊ずつ絵本にする。
+
+    python daemon.py                       # Ctrl+C（SIGTERM）で、実行中の本を終えてから止まる
+    python daemon.py --books 3 --shelf-batch 10
+
+- 起動時に OpenAI クライアント・フォントなどを1回だけ用意し、以後の本で使い回す
+- 見張りは inotify（Linux）。使えない環境では一定間隔でディレクトリを見直す
+- 待ち行列は work/daemon/jobs.json に保存するので、止めても次の起動で続きから処理する
+  （途中で止まった本は run journal を使って --resume と同じく続きから）
+- 本の工程は batch.py と同じ（work/batch/<名前>/ 以下）。同時に処理する冊数と API の同時呼び出し数に上限がある
+- 本棚の再生成と git commit は、本が --shelf-batch 冊たまるか、最初の1冊から --shelf-window 秒たったら1回
+"""
+import argparse
+import ctypes
+import ctypes.util
+import importlib
+import json
+import os
+import select
+import signal
+import struct
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from api_client import set_api_budget
+from batch import AUDIO_EXTS, DOCS_DIR, INPUT_DIR, book_paths, book_pipeline, find_audio
+from fileutil import atomic_write_bytes, sha256_file
+from pipeline import git_commit_and_push
+import tracing
+
+QUEUE_PATH = Path("work/daemon/jobs.json")
+POLL_SECONDS = 2.0
+SHELF_WINDOW = 60.0   # 本棚の再生成をまとめて待つ秒数
+SHELF_BATCH = 5       # この冊数たまったら待たずに再生成する
+
+
+# --- 見張り ---------------------------------------------------------------------
+
+class InotifyWatcher:
+    """inotify で directory に書き終わった（または移動してきた）ファイルの名前を受け取る。"""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    _EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+    def __init__(self, directory: Path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), self.IN_CLOSE_WRITE | self.IN_MOVED_TO)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {directory}")
+
+    def wait(self, timeout: float) -> list[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names, i = [], 0
+        while i + self._EVENT.size <= len(data):
+            _, _, _, length = self._EVENT.unpack_from(data, i)
+            i += self._EVENT.size
+            name = data[i:i + length].rstrip(b"\0")
+            i += length
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    inotify が使えないときの代わり。interval 秒ごとに directory を見て、
+    前回から大きさと更新時刻が変わっていない（コピーが終わった）ファイルの名前を返す。
+    """
+
+    def __init__(self, directory: Path, interval: float = POLL_SECONDS):
+        self.directory = directory
+        self.interval = interval
+        self._last: dict[str, tuple] = {}
+        self._reported: dict[str, tuple] = {}
+
+    def wait(self, timeout: float) -> list[str]:
+        time.sleep(min(timeout, self.interval))
+        current = {}
+        for p in self.directory.iterdir():
+            if p.is_file():
+                st = p.stat()
+                current[p.name] = (st.st_size, st.st_mtime_ns)
+        ready = [name for name, stat in current.items()
+                 if self._last.get(name) == stat and self._reported.get(name) != stat]
+        for name in ready:
+            self._reported[name] = current[name]
+        self._last = current
+        return ready
+
+    def close(self) -> None:
+        pass
+
+
+def make_watcher(directory: Path, poll: bool = False):
+    if not poll:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError, TypeError) as e:
+            print(f"ℹ️ inotify が使えないのでポーリングで見張ります（{e}）")
+    return PollingWatcher(directory)
+
+
+# --- 待ち行列 -------------------------------------------------------------------
+
+class JobQueue:
+    """
+    音声ファイル1つ = 1ジョブ。状態は queued → running → done / failed。
+    変更のたびに jobs.json を書き直す（小さいので丸ごと）。
+    起動時に running のまま残っていたものは前回の途中で止まったので queued に戻す。
+    実行中のファイルが置き直されたら、その場では積まずに requeue（新しい中身のハッシュ）を付け、
+    終わったところで queued に戻す（同じ作業ディレクトリで2つのパイプラインを同時に走らせない）。
+    """
+
+    def __init__(self, path: Path = QUEUE_PATH, retry_failed: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self.jobs: dict[str, dict] = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+        for job in self.jobs.values():
+            if job.get("requeue"):
+                self._requeue(job)
+            elif job["status"] == "running" or (retry_failed and job["status"] == "failed"):
+                job["status"] = "queued"
+        self._save()
+
+    @staticmethod
+    def _requeue(job: dict) -> None:
+        # 中身が変わったので前回の journal からは続けない（attempts を 0 に戻す）
+        job.update(status="queued", sha256=job.pop("requeue"), attempts=0,
+                   added=datetime.now().isoformat(timespec="seconds"))
+
+    def _save(self) -> None:
+        atomic_write_bytes(self.path, json.dumps(self.jobs, ensure_ascii=False, indent=2).encode("utf-8"))
+
+    def add(self, audio: Path) -> dict | None:
+        """新しいファイル（同じ名前でも中身が変わったもの）なら積んで返す。"""
+        digest = sha256_file(audio)
+        with self._lock:
+            job = self.jobs.get(audio.name)
+            if job and job["status"] == "running":
+                if job.get("requeue", job["sha256"]) == digest:
+                    return None
+                job["requeue"] = digest
+                self._save()
+                return job
+            if job and job["sha256"] == digest:
+                return None
+            job = self.jobs[audio.name] = {
+                "audio": audio.as_posix(), "sha256": digest, "status": "queued", "attempts": 0,
+                "added": datetime.now().isoformat(timespec="seconds"),
+            }
+            self._save()
+        return job
+
+    def next(self) -> dict | None:
+        with self._lock:
+            running = {Path(job["audio"]).name for job in self.jobs.values() if job["status"] == "running"}
+            for job in self.jobs.values():
+                if job["status"] == "queued" and Path(job["audio"]).name not in running:
+                    job.update(status="running", attempts=job["attempts"] + 1,
+                               started=datetime.now().isoformat(timespec="seconds"))
+                    self._save()
+                    return job
+        return None
+
+    def finish(self, job: dict, status: str, **fields) -> None:
+        with self._lock:
+            job.update(status=status, finished=datetime.now().isoformat(timespec="seconds"), **fields)
+            if job.get("requeue"):
+                self._requeue(job)
+            self._save()
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            out: dict[str, int] = {}
+            for job in self.jobs.values():
+                out[job["status"]] = out.get(job["status"], 0) + 1
+            return out
+
+
+# --- 常駐 -----------------------------------------------------------------------
+
+WARM_MODULES = ("build_shelf", "derive_assets", "make_pdf", "book_plan", "generate_images")
+
+
+def _warm_imports() -> None:
+    """工程の中で遅れて import される重いモジュール（PIL / reportlab など）を先に読み込んでおく。"""
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+
+
+def warm_up() -> None:
+    """重い import とクライアント・フォントの準備を最初に1回だけ済ませる。"""
+    t0 = time.perf_counter()
+    _warm_imports()
+    import make_pdf
+    from api_client import get_client
+
+    make_pdf.register_fonts()
+    try:
+        get_client()
+    except RuntimeError as e:
+        print(f"⚠️ {e}")
+    print(f"🟦 warmed up in {time.perf_counter() - t0:.1f}s")
+
+
+class Daemon:
+    def __init__(self, input_dir: Path, queue: JobQueue, *, books: int = 2, image_concurrency: int = 2,
+                 shelf_window: float = SHELF_WINDOW, shelf_batch: int = SHELF_BATCH, git: bool = True,
+                 push: bool = True, poll: bool = False):
+        self.input_dir = input_dir
+        self.queue = queue
+        self.books = max(1, books)
+        self.image_concurrency = image_concurrency
+        self.shelf_window = shelf_window
+        self.shelf_batch = shelf_batch
+        self.git = git
+        self.push = push
+        self.poll = poll
+        self.stop = threading.Event()
+        self._lock = threading.Lock()
+        self._running = 0
+        self._finished: list[tuple[float, str]] = []   # 本棚にまだ載せていない本（終わった時刻, 名前）
+
+    def enqueue(self, names) -> None:
+        for name in names:
+            audio = self.input_dir / name
+            if audio.suffix.lower() in AUDIO_EXTS and audio.is_file():
+                job = self.queue.add(audio)
+                if job and job.get("requeue"):
+                    print(f"📥 queued again after the running job: {name}")
+                elif job:
+                    print(f"📥 queued: {name}")
+
+    def _run_job(self, job: dict) -> None:
+        audio = Path(job["audio"])
+        # 2回目以降は前回の途中から（同じ中身のファイルなので journal の記録をそのまま使える）
+        resume = job["attempts"] > 1
+        try:
+            paths = book_paths(audio)
+            print(f"\n📗 BOOK: {audio.name}{' (resume)' if resume else ''} → {paths.work.parent.as_posix()}")
+            ran = book_pipeline(paths, concurrency=self.image_concurrency, resume=resume).execute(set())
+        # Pipeline は失敗を SystemExit で返すので、他の本を止めないよう SystemExit も受ける（Ctrl+C は通す）
+        except (Exception, SystemExit) as e:
+            traceback.print_exception(e)
+            self.queue.finish(job, "failed", error=str(e))
+            print(f"❌ {audio.name}: {e}")
+        else:
+            self.queue.finish(job, "done", stages=ran)
+            print(f"✅ {audio.name}: {', '.join(ran) if ran else 'up to date'}")
+            if "publish" in ran or "publish_pdf" in ran:
+                with self._lock:
+                    self._finished.append((time.monotonic(), audio.name))
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def dispatch(self, pool: ThreadPoolExecutor) -> None:
+        while True:
+            with self._lock:
+                if self._running >= self.books:
+                    return
+            job = self.queue.next()
+            if job is None:
+                return
+            with self._lock:
+                self._running += 1
+            pool.submit(self._run_job, job)
+
+    def maybe_publish(self, force: bool = False) -> None:
+        """終わった本がたまったら（または待ち時間が過ぎたら）本棚を作り直して commit する。"""
+        with self._lock:
+            if not self._finished:
+                return
+            waited = time.monotonic() - self._finished[0][0]
+            if not (force or len(self._finished) >= self.shelf_batch or waited >= self.shelf_window):
+                return
+            names = [name for _, name in self._finished]
+            self._finished.clear()
+
+        from build_shelf import build_shelf
+        print(f"\n📚 shelf: {len(names)} new books ({', '.join(names)})")
+        build_shelf(DOCS_DIR / "books", DOCS_DIR / "index.html")
+        if self.git:
+            git_commit_and_push(f"Add {len(names)} new books", push=self.push)
+        print(tracing.summary_table())
+        # 常駐中に記録が増え続けないよう、表に出したら捨てる
+        tracing.drain()
+
+    def run(self) -> None:
+        self.input_dir.mkdir(parents=True, exist_ok=True)
+        watcher = make_watcher(self.input_dir, self.poll)
+        print(f"👀 watching {self.input_dir.as_posix()} ({type(watcher).__name__}) | books: {self.books}"
+              f" | queue: {self.queue.counts()}")
+        self.enqueue(p.name for p in find_audio(self.input_dir))
+
+        with ThreadPoolExecutor(max_workers=self.books) as pool:
+            try:
+                while not self.stop.is_set():
+                    self.dispatch(pool)
+                    self.enqueue(watcher.wait(1.0))
+                    self.maybe_publish()
+            finally:
+                watcher.close()
+                print("\n🟦 stopping: waiting for running books ...")
+        self.maybe_publish(force=True)
+        print(f"✅ daemon stopped | queue: {self.queue.counts()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch input/ and build a book for each new recording")
+    parser.add_argument("--input-dir", type=Path, default=INPUT_DIR)
+    parser.add_argument("--queue", type=Path, default=QUEUE_PATH, help="Persistent job queue file")
+    parser.add_argument("--books", type=int, default=2, help="Number of books processed at the same time")
+    parser.add_argument("--api-concurrency", type=int, default=4,
+                        help="Max API calls in flight across all books (0 = unlimited)")
+    parser.add_argument("--image-concurrency", type=int, default=2, help="Parallel image calls per book")
+    parser.add_argument("--shelf-window", type=float, default=SHELF_WINDOW,
+                        help="Seconds to collect finished books before rebuilding the shelf")
+    parser.add_argument("--shelf-batch", type=int, default=SHELF_BATCH,
+                        help="Rebuild the shelf right away once this many books have finished")
+    parser.add_argument("--poll", action="store_true", help="Poll the input directory instead of using inotify")
+    parser.add_argument("--retry-failed", action="store_true", help="Queue the failed jobs again on start")
+    parser.add_argument("--no-git", action="store_true", help="Do not git add/commit/push")
+    parser.add_argument("--no-push", action="store_true", help="Do not git push (commit only)")
+    args = parser.parse_args()
+
+    warm_up()
+    set_api_budget(args.api_concurrency)
+    daemon = Daemon(args.input_dir, JobQueue(args.queue, retry_failed=args.retry_failed), books=args.books,
+                    image_concurrency=args.image_concurrency, shelf_window=args.shelf_window,
+                    shelf_batch=args.shelf_batch, git=not args.no_git, push=not args.no_push, poll=args.poll)
+
+    def on_signal(signum, frame):
+        print(f"\n🟦 signal {signum}: finishing running books, then stopping")
+        daemon.stop.set()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+ページ画像（output/pages/NN.png, 1枚約2MB）から用途別の軽い画像を作る。
+
+- print : PDF 用。PDF の左カラム（COL_W × 高さ）にぴったり収まるサイズの JPEG
+- web   : viewer 用の WebP
+- thumb : 本棚の表紙用の小さい WebP
+
+出力先は output/derived/{print,web,thumb}/NN.*。どの元画像から作ったかを output/derived/sources.json に
+記録し、元画像の中身が同じなら作り直さない（元画像は画像キャッシュとハードリンクで共有していて、
+キャッシュから置いた画像は更新時刻が古いままなので、更新時刻では比べない）。
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+
+from PIL import Image
+
+from fileutil import atomic_write_bytes, sha256_file
+from make_pdf import BOX_H, COL_W
+
+PAGES_DIR = Path("output/pages")
+
+# make_pdf の左カラム（1pt = 1px）。印刷で粗ければ PRINT_SCALE を 2 にする
+PRINT_BOX = (int(COL_W), int(BOX_H))
+PRINT_SCALE = 1.0
+PRINT_QUALITY = 88
+
+WEB_MAX = 1024
+WEB_QUALITY = 80
+
+THUMB_W = 360
+THUMB_QUALITY = 70
+
+VARIANTS = {
+    "print": ".jpg",
+    "web": ".webp",
+    "thumb": ".webp",
+}
+SOURCES_NAME = "sources.json"
+
+
+def derived_dir(pages_dir: Path = PAGES_DIR) -> Path:
+    return pages_dir.parent / "derived"
+
+
+def variant_path(pages_dir: Path, kind: str, page_num: int) -> Path:
+    return derived_dir(pages_dir) / kind / f"{page_num:02d}{VARIANTS[kind]}"
+
+
+def load_sources(pages_dir: Path = PAGES_DIR) -> dict:
+    """{"01": [元画像のサイズ, 更新時刻(ns), sha256], ...}（派生画像を作ったときの元画像）。"""
+    path = derived_dir(pages_dir) / SOURCES_NAME
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _source_record(src: Path, digest: str | None = None) -> list:
+    st = src.stat()
+    return [st.st_size, st.st_mtime_ns, digest or sha256_file(src)]
+
+
+def _same_source(src: Path, rec: list | None) -> bool:
+    """rec を記録したときと同じ中身の元画像か（サイズと更新時刻が同じなら読まずに同じとみなす）。"""
+    if not rec:
+        return False
+    st = src.stat()
+    return rec[:2] == [st.st_size, st.st_mtime_ns] or rec[2] == sha256_file(src)
+
+
+def fresh_variant(pages_dir: Path, kind: str, page_num: int, sources: dict | None = None) -> Path | None:
+    """今の元画像から作った派生画像があればそのパス、なければ None。"""
+    src = pages_dir / f"{page_num:02d}.png"
+    dst = variant_path(pages_dir, kind, page_num)
+    if not (dst.exists() and src.exists()):
+        return None
+    sources = load_sources(pages_dir) if sources is None else sources
+    return dst if _same_source(src, sources.get(f"{page_num:02d}")) else None
+
+
+def _fit(img: Image.Image, box: tuple[int, int]) -> Image.Image:
+    """縦横比を保って box に収める（拡大はしない）。"""
+    scale = min(box[0] / img.width, box[1] / img.height, 1.0)
+    if scale >= 1.0:
+        return img
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.LANCZOS)
+
+
+def derive_page(src: Path, pages_dir: Path) -> dict:
+    """1ページ分の派生画像を作り、種類ごとのバイト数を返す。"""
+    page_num = int(src.stem)
+    with Image.open(src) as im:
+        img = im.convert("RGB")
+
+    box = (round(PRINT_BOX[0] * PRINT_SCALE), round(PRINT_BOX[1] * PRINT_SCALE))
+    outputs = {
+        "print": (_fit(img, box), {"format": "JPEG", "quality": PRINT_QUALITY, "optimize": True}),
+        "web": (_fit(img, (WEB_MAX, WEB_MAX)), {"format": "WEBP", "quality": WEB_QUALITY, "method": 6}),
+        "thumb": (_fit(img, (THUMB_W, THUMB_W * 2)), {"format": "WEBP", "quality": THUMB_QUALITY, "method": 6}),
+    }
+    sizes = {}
+    for kind, (out_img, opts) in outputs.items():
+        dst = variant_path(pages_dir, kind, page_num)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        # 一時ファイルに書いてから置き換える（途中で失敗しても書きかけの画像を残さない）
+        tmp = dst.with_name(dst.name + ".tmp")
+        out_img.save(tmp, **opts)
+        os.replace(tmp, dst)
+        sizes[kind] = dst.stat().st_size
+    return sizes
+
+
+def derive_assets(pages_dir: Path = PAGES_DIR, force: bool = False) -> dict:
+    """pages_dir の全 PNG の派生画像を作り、元画像と派生画像の合計バイト数を表示・返す。"""
+    if not pages_dir.exists():
+        raise FileNotFoundError(f"{pages_dir} が見つかりません。")
+
+    totals = {"original": 0, "print": 0, "web": 0, "thumb": 0}
+    made = 0
+    sources = load_sources(pages_dir)
+    recorded = dict(sources)
+    for src in sorted(pages_dir.glob("*.png")):
+        page_num = int(src.stem)
+        if not force and all(fresh_variant(pages_dir, k, page_num, sources) for k in VARIANTS):
+            sizes = {k: variant_path(pages_dir, k, page_num).stat().st_size for k in VARIANTS}
+            # 中身は同じで更新時刻だけ変わった元画像は、次から読まずに済むよう記録し直す
+            sources[src.stem] = _source_record(src, sources[src.stem][2])
+        else:
+            sizes = derive_page(src, pages_dir)
+            sources[src.stem] = _source_record(src)
+            made += 1
+        totals["original"] += src.stat().st_size
+        for k, v in sizes.items():
+            totals[k] += v
+
+    if sources != recorded:
+        atomic_write_bytes(derived_dir(pages_dir) / SOURCES_NAME, json.dumps(sources, indent=2).encode("utf-8"))
+
+    orig = totals["original"] or 1
+    print(f"🖼  derived assets: {made} pages updated → {derived_dir(pages_dir).as_posix()}")
+    print(f"   original PNG : {totals['original'] / 1e6:8.2f} MB")
+    for k in VARIANTS:
+        print(f"   {k:<13}: {totals[k] / 1e6:8.2f} MB ({100 * (1 - totals[k] / orig):.0f}% smaller)")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages-dir", type=Path, default=PAGES_DIR)
+    parser.add_argument("--force", action="store_true", help="派生画像を全部作り直す")
+    args = parser.parse_args()
+
+    derive_assets(args.pages_dir, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+API を呼ばずにパイプラインを動かすための偽の OpenAI クライアント（ベンチマーク・動作確認用）。
+
+    client = FakeOpenAI(plan=json.loads(Path("docs/books/.../book_plan.json").read_text()))
+    make_plan(..., client=client)            # 応答はこの plan（stream=True なら少しずつ届く）
+    ImageQueue(..., client=client)           # 画像は小さな単色の PNG
+    batch_api.run(..., client=client)        # Batch API（files / batches）も JSONL を読んで結果を返す
+
+遅延（秒）は latency で変えられる。本物と同じく呼び出しはスレッドから同時に来てよい。
+本物の SDK と HTTP を通して試したいときは FakeAPIServer（ローカルの HTTP スタブ）を使う。
+"""
+import base64
+import json
+import struct
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+DEFAULT_LATENCY = {
+    "transcribe": 0.5,
+    "plan_first_token": 0.5,   # ストリーミングで最初の文字が届くまで
+    "plan_per_char": 0.002,    # 1文字ごと（gpt-4.1-mini の出力速度くらい）
+    "image": 1.0,
+    "image_low": 0.25,         # quality="low"（draft の画像）
+    "batch": 2.0,              # Batch API のジョブが終わるまで（作ってからの秒数）
+}
+
+
+def tiny_png(rgb: tuple[int, int, int] = (240, 230, 210), size: int = 8) -> bytes:
+    """size×size の単色 PNG。"""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    row = b"\x00" + bytes(rgb) * size
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * size))
+            + chunk(b"IEND", b""))
+
+
+class _Responses:
+    def __init__(self, owner: "FakeOpenAI"):
+        self.owner = owner
+
+    def create(self, *, model, input, text=None, stream=False, **kwargs):
+        owner = self.owner
+        owner.count("responses")
+        body = json.dumps(owner.plan, ensure_ascii=False, indent=2)
+        if not stream:
+            time.sleep(owner.latency["plan_first_token"] + owner.latency["plan_per_char"] * len(body))
+            return SimpleNamespace(output_text=body, id="resp_fake")
+        return self._events(body)
+
+    def _events(self, body: str, step: int = 16):
+        latency = self.owner.latency
+        time.sleep(latency["plan_first_token"])
+        for i in range(0, len(body), step):
+            time.sleep(latency["plan_per_char"] * step)
+            yield SimpleNamespace(type="response.output_text.delta", delta=body[i:i + step])
+        yield SimpleNamespace(type="response.completed")
+
+
+class _Images:
+    def __init__(self, owner: "FakeOpenAI"):
+        self.owner = owner
+
+    def generate(self, *, model, prompt, size=None, quality=None, **kwargs):
+        self.owner.count("images")
+        low = quality == "low"
+        time.sleep(self.owner.latency["image_low" if low else "image"])
+        b64 = base64.b64encode(self.owner.png_low if low else self.owner.png).decode("ascii")
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=b64)])
+
+
+class _Transcriptions:
+    def __init__(self, owner: "FakeOpenAI"):
+        self.owner = owner
+
+    def create(self, *, model, file, **kwargs):
+        self.owner.count("transcribe")
+        file.read()
+        time.sleep(self.owner.latency["transcribe"])
+        return SimpleNamespace(text=self.owner.transcript)
+
+
+class _Files:
+    def __init__(self, owner: "FakeOpenAI"):
+        self.owner = owner
+        self.data: dict[str, bytes] = {}
+
+    def create(self, *, file, purpose, **kwargs):
+        data = file.read() if hasattr(file, "read") else file[1]
+        return self._put(data, purpose)
+
+    def _put(self, data: bytes, purpose: str):
+        with self.owner._lock:
+            file_id = f"file-fake{len(self.data):04d}"
+            self.data[file_id] = data
+        return SimpleNamespace(id=file_id, bytes=len(data), purpose=purpose)
+
+    def content(self, file_id: str):
+        data = self.data[file_id]
+        return SimpleNamespace(content=data, text=data.decode("utf-8"), read=lambda: data)
+
+
+class _Batches:
+    """JSONL の各行を（同期 API と同じ偽の応答で）処理し、latency["batch"] 秒たったら completed にする。"""
+
+    def __init__(self, owner: "FakeOpenAI"):
+        self.owner = owner
+        self.batches: dict[str, dict] = {}
+
+    def create(self, *, input_file_id, endpoint, completion_window, **kwargs):
+        owner = self.owner
+        owner.count("batches")
+        out, errors = [], []
+        for i, line in enumerate(owner.files.data[input_file_id].decode("utf-8").splitlines()):
+            req = json.loads(line)
+            if req.get("url") != endpoint:
+                errors.append({"id": f"batch_req_{i}", "custom_id": req.get("custom_id"), "response": None,
+                               "error": {"code": "invalid_url", "message": f"{req.get('url')} != {endpoint}"}})
+                continue
+            if endpoint.endswith("/responses"):
+                owner.count("responses")
+                body = _response_object(json.dumps(owner.plan, ensure_ascii=False, indent=2))
+            else:
+                owner.count("images")
+                body = {"created": int(time.time()),
+                        "data": [{"b64_json": base64.b64encode(owner.png).decode("ascii")}]}
+            out.append({"id": f"batch_req_{i}", "custom_id": req["custom_id"],
+                        "response": {"status_code": 200, "request_id": f"req_{i}", "body": body}, "error": None})
+        batch = {
+            "id": f"batch_fake{len(self.batches):04d}", "endpoint": endpoint, "input_file_id": input_file_id,
+            "created": time.monotonic(), "total": len(out) + len(errors), "failed": len(errors),
+            "output_file_id": owner.files._put(_jsonl(out), "batch_output").id if out else None,
+            "error_file_id": owner.files._put(_jsonl(errors), "batch_output").id if errors else None,
+        }
+        self.batches[batch["id"]] = batch
+        return self.retrieve(batch["id"])
+
+    def retrieve(self, batch_id: str):
+        b = self.batches[batch_id]
+        done = time.monotonic() - b["created"] >= self.owner.latency["batch"]
+        return SimpleNamespace(
+            id=b["id"], endpoint=b["endpoint"], input_file_id=b["input_file_id"],
+            status="completed" if done else "in_progress",
+            output_file_id=b["output_file_id"] if done else None,
+            error_file_id=b["error_file_id"] if done else None,
+            request_counts=SimpleNamespace(total=b["total"], completed=(b["total"] - b["failed"]) if done else 0,
+                                           failed=b["failed"] if done else 0),
+        )
+
+
+class FakeOpenAI:
+    def __init__(self, plan: dict | None = None, transcript: str = "", latency: dict | None = None,
+                 png: bytes | None = None, png_low: bytes | None = None):
+        self.plan = plan or {"title": "fake", "style_bible": "", "pages": []}
+        self.transcript = transcript or "".join(p.get("text", "") for p in self.plan.get("pages", []))
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.png = png or tiny_png()
+        self.png_low = png_low or self.png
+        self.calls: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.responses = _Responses(self)
+        self.images = _Images(self)
+        self.audio = SimpleNamespace(transcriptions=_Transcriptions(self))
+        self.files = _Files(self)
+        self.batches = _Batches(self)
+
+    def count(self, endpoint: str) -> None:
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+
+# --- ローカルの HTTP スタブ（本物の SDK・HTTP 経由で試す用） ------------------------
+
+class FakeAPIServer:
+    """
+    127.0.0.1 で OpenAI API のふりをする HTTP サーバー。
+
+        with FakeAPIServer(plan, fail_first=2) as server:
+            client = api_client.get_client(base_url=server.base_url)
+
+    /v1/responses（stream 対応）, /v1/images/generations, /v1/audio/transcriptions に答える。
+    fail_first 回目までのリクエストは 429（Retry-After: 0）を返す（リトライの確認用）。
+    """
+
+    def __init__(self, plan: dict | None = None, latency: dict | None = None, fail_first: int = 0):
+        self.fake = FakeOpenAI(plan, latency=latency)
+        self.fail_first = fail_first
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self) -> "FakeAPIServer":
+        from http.server import ThreadingHTTPServer
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        from http.server import BaseHTTPRequestHandler
+
+        server = self
+        fake = self.fake
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status: int, body: dict, headers: dict | None = None):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("content-length") or 0))
+                with server._lock:
+                    server.requests += 1
+                    fail = server.requests <= server.fail_first
+                if fail:
+                    return self._json(429, {"error": {"message": "rate limited (fake)", "type": "rate_limit"}},
+                                      {"retry-after": "0"})
+
+                if self.path.endswith("/responses"):
+                    req = json.loads(raw)
+                    fake.count("responses")
+                    body = json.dumps(fake.plan, ensure_ascii=False, indent=2)
+                    if req.get("stream"):
+                        return self._stream(body)
+                    time.sleep(fake.latency["plan_first_token"] + fake.latency["plan_per_char"] * len(body))
+                    return self._json(200, _response_object(body))
+                if self.path.endswith("/images/generations"):
+                    fake.count("images")
+                    time.sleep(fake.latency["image"])
+                    return self._json(200, {"created": int(time.time()),
+                                            "data": [{"b64_json": base64.b64encode(fake.png).decode("ascii")}],
+                                            "usage": {"input_tokens": 50, "output_tokens": 272, "total_tokens": 322}})
+                if self.path.endswith("/audio/transcriptions"):
+                    fake.count("transcribe")
+                    time.sleep(fake.latency["transcribe"])
+                    return self._json(200, {"text": fake.transcript})
+                self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+            def _stream(self, body: str, step: int = 16):
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("transfer-encoding", "chunked")
+                self.end_headers()
+
+                def send(event: dict):
+                    data = f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+
+                time.sleep(fake.latency["plan_first_token"])
+                seq = 0
+                for i in range(0, len(body), step):
+                    time.sleep(fake.latency["plan_per_char"] * step)
+                    send({"type": "response.output_text.delta", "delta": body[i:i + step], "item_id": "msg_fake",
+                          "output_index": 0, "content_index": 0, "sequence_number": seq, "logprobs": []})
+                    seq += 1
+                send({"type": "response.completed", "sequence_number": seq, "response": _response_object(body)})
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def _jsonl(rows: list[dict]) -> bytes:
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows).encode("utf-8")
+
+
+def _response_object(text: str) -> dict:
+    return {
+        "id": "resp_fake", "object": "response", "created_at": int(time.time()), "status": "completed",
+        "model": "fake", "output": [{
+            "type": "message", "id": "msg_fake", "role": "assistant", "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "usage": {"input_tokens": 1000, "output_tokens": len(text) // 2, "total_tokens": 1000 + len(text) // 2},
+    }
@@ -0,0 +1,91 @@
+"""ファイル操作の小さな共通処理。"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+
+def link_or_copy(src: Path, dst: Path) -> str:
+    """
+    src を dst に置く。同じファイルシステムならハードリンク（I/Oほぼゼロ）、
+    できなければコピーする。戻り値は "link" か "copy"。
+    dst が既にあれば置き換える（リンク先を書き換えないよう先に unlink する）。
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        shutil.copy2(src, dst)
+        return "copy"
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """一時ファイルに書いてから置き換える（途中で落ちても壊れたファイルを残さない）。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 一時ファイル名はスレッド・プロセスごとに別にする（同じファイルを同時に書いても壊れない）
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def parse_pages(text: str) -> list[int]:
+    """"3,7" や "3-5,9" をページ番号のリスト（昇順・重複なし）にする（--pages 用）。"""
+    pages = set()
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        if not first.isdigit() or (last and not last.isdigit()):
+            raise ValueError(f"ページの指定が読めません: {part!r}（例: 3,7 / 3-5）")
+        pages.update(range(int(first), int(last or first) + 1))
+    if not pages:
+        raise ValueError("ページが指定されていません")
+    return sorted(pages)
+
+
+def sha256_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class HashCache:
+    """
+    ファイルの sha256 を (パス, サイズ, 更新時刻) をキーに覚えておく。
+    変わっていないファイルは読み直さないので、大きな PNG / PDF を何度も扱っても I/O がほぼ出ない。
+    複数のスレッドから使ってよい。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.data = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+        self._lock = threading.Lock()
+
+    def sha256(self, file: Path) -> str:
+        st = file.stat()
+        key = str(file.resolve())
+        rec = self.data.get(key)
+        if rec and rec[0] == st.st_size and rec[1] == st.st_mtime_ns:
+            return rec[2]
+        digest = sha256_file(file)
+        with self._lock:
+            self.data[key] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def save(self) -> None:
+        with self._lock:
+            data = json.dumps(self.data).encode("utf-8")
+        atomic_write_bytes(self.path, data)
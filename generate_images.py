@@ -1,86 +1,317 @@
 import base64
 import json
-import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import argparse
 
-
-from dotenv import load_dotenv
-from openai import OpenAI
-
-load_dotenv()
+from api_client import ENDPOINT_RPM, call_api, get_client, shared_limiter
+from fileutil import atomic_write_bytes, parse_pages, sha256_file
+from image_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_MB, ImageCache, cache_key
+from tracing import bind, span
 
 PLAN_PATH = Path("work/book_plan.json")
 OUT_DIR = Path("output/pages")
-OUT_DIR.mkdir(parents=True, exist_ok=True)
-parser = argparse.ArgumentParser()
-parser.add_argument("--force", action="store_true", help="既存pngがあっても上書きする")
-args = parser.parse_args()
 
 # 画像サイズは縦長が絵本向き（必要なら変えてOK）
 IMAGE_SIZE = "1024x1024"  # 他: "1024x1024", "1536x1024" など
 MODEL = "gpt-image-1"
 
-def _to_filename(page_num: int) -> Path:
-    return OUT_DIR / f"{page_num:02d}.png"
+# 画像APIの1分あたりリクエスト上限（アカウントのTierに合わせて調整）
+DEFAULT_RPM = ENDPOINT_RPM["images"]
 
-def main():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY が見つかりません。.env を確認してください。")
+# 各ページがどのプロンプトで生成されたか（キャッシュキー）を記録するファイル
+KEYS_NAME = ".image_keys.json"
 
-    if not PLAN_PATH.exists():
-        raise FileNotFoundError(f"{PLAN_PATH} が見つかりません。")
+# 画像の仕上がりの段階。draft はプレビュー用（quality=low で速く安い）、final は従来通り（quality は auto）
+TIERS = {
+    "draft": {"quality": "low"},
+    "final": {},
+}
+# 各ページが今どの段階の画像か（"draft" / "final"）を記録するファイル。記録の無いページは final
+TIERS_NAME = ".image_tiers.json"
 
-    plan = json.loads(PLAN_PATH.read_text(encoding="utf-8"))
-    pages = plan.get("pages", [])
-    if not pages:
-        raise RuntimeError("book_plan.json に pages がありません。")
+def _to_filename(page_num: int, out_dir: Path = OUT_DIR) -> Path:
+    return out_dir / f"{page_num:02d}.png"
 
-    client = OpenAI(api_key=api_key)
+def _load_keys(out_dir: Path) -> dict:
+    path = out_dir / KEYS_NAME
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
 
-    # タイトルやスタイルを少し補強（任意）
-    style_bible = plan.get("style_bible", "")
-    title = plan.get("title", "storybook")
+def _save_keys(out_dir: Path, keys: dict) -> None:
+    atomic_write_bytes(out_dir / KEYS_NAME, json.dumps(keys, indent=2, sort_keys=True).encode("utf-8"))
 
-    print(f"📘 Generating images for: {title}")
-    print(f"pages: {len(pages)} | model: {MODEL} | size: {IMAGE_SIZE}\n")
+def load_tiers(out_dir: Path = OUT_DIR) -> dict:
+    """{"01": "draft", ...}。"""
+    path = out_dir / TIERS_NAME
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
 
-    for p in pages:
-        page_num = int(p["page"])
-        out_path = _to_filename(page_num)
+def _save_tiers(out_dir: Path, tiers: dict) -> None:
+    atomic_write_bytes(out_dir / TIERS_NAME, json.dumps(tiers, indent=2, sort_keys=True).encode("utf-8"))
 
-        if out_path.exists() and not args.force:
-            print(f"skip page {page_num:02d} (already exists)")
-            continue
-        if out_path.exists() and args.force:
-            print(f"overwrite page {page_num:02d}")
+def tier_size(tier: str) -> str:
+    """キャッシュキーに入れるサイズ（final は従来と同じキーになるよう段階名を付けない）。"""
+    return IMAGE_SIZE if tier == "final" else f"{IMAGE_SIZE}:{tier}"
+
+def _generate_page(client, limiter, cache, page_num: int, full_prompt: str, key: str, out_path: Path,
+                   tier: str = "final", reroll: bool = False) -> float:
+    """1ページ分を生成して保存し、かかった秒数を返す。reroll=True ならキャッシュにあっても作り直す。"""
+    with span(f"image {page_num:02d}", cat="image", page=page_num, tier=tier):
+        return _generate_page_inner(client, limiter, cache, page_num, full_prompt, key, out_path, tier, reroll)
+
+def _generate_page_inner(client, limiter, cache, page_num: int, full_prompt: str, key: str,
+                         out_path: Path, tier: str = "final", reroll: bool = False) -> float:
+    t0 = time.perf_counter()
+    if cache is not None and not reroll and cache.fetch(key, out_path):
+        print(f"   cache hit: page {page_num:02d}")
+        return time.perf_counter() - t0
 
+    print(f"→ generating page {page_num:02d} ({tier}) ...")
+
+    result = call_api(
+        "images",
+        lambda: client.images.generate(
+            model=MODEL,
+            size=IMAGE_SIZE,
+            prompt=full_prompt,
+            **TIERS[tier],
+        ),
+        limiter=limiter,
+        label=f"page {page_num:02d}",
+    )
+
+    # gpt-image-1 は base64 で返る
+    b64 = result.data[0].b64_json
+    img_bytes = base64.b64decode(b64)
+
+    # キャッシュとハードリンクされている可能性があるので、上書きではなく置き換える
+    atomic_write_bytes(out_path, img_bytes)
+    if cache is not None:
+        cache.store(key, out_path)
+    elapsed = time.perf_counter() - t0
+    print(f"   saved: {out_path} ({elapsed:.1f}s)")
+    return elapsed
+
+class ImageQueue:
+    """
+    ページを1つずつ受け取り、その場で画像生成を始めるキュー。
+    plan が全部できる前（ストリーミング中）からページを入れられる。
+    close() で全ページの完了を待ち、生成したページの秒数を返す。
+    journal（journal.RunJournal）を渡すと、できたページを記録し、
+    記録と同じプロンプト・同じ画像が残っているページは作り直さない。
+    tier="draft" なら速いプレビュー用の画像を作る（final の画像が既にあるページはそのまま）。
+    tier="final" なら draft のページも作り直す（＝仕上げ）。ページごとの段階は TIERS_NAME に記録する。
+    reroll=True なら同じプロンプトでもキャッシュの画像は使わず新しく作る（気に入らない絵の描き直し）。
+    """
+
+    def __init__(self, out_dir: Path = OUT_DIR, *, style_bible: str = "", force: bool = False,
+                 concurrency: int = 1, rpm: float = DEFAULT_RPM, cache_dir: Path = DEFAULT_CACHE_DIR,
+                 cache_max_mb: float = DEFAULT_MAX_MB, no_cache: bool = False, client=None, journal=None,
+                 tier: str = "final", reroll: bool = False):
+        if tier not in TIERS:
+            raise ValueError(f"tier は {', '.join(TIERS)} のどれかです: {tier}")
+        client = client or get_client()
+        out_dir.mkdir(parents=True, exist_ok=True)
+        self.client = client
+        self.out_dir = out_dir
+        self.style_bible = style_bible
+        self.force = force
+        self.journal = journal
+        self.cache = None if no_cache else ImageCache(cache_dir, cache_max_mb)
+        self.keys = _load_keys(out_dir)
+        self.tier = tier
+        self.reroll = reroll
+        self.tiers = load_tiers(out_dir)
+        # 同じプロセスで複数の本を作る場合も、画像APIの上限は全体で共有する
+        self.limiter = shared_limiter("images", rpm)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        self.futures = {}
+        self.timings = {}
+        self.t_start = time.perf_counter()
+
+    def job(self, p: dict) -> tuple | None:
+        """ページ p の (page_num, full_prompt, key, out_path)。作らなくてよければ None。"""
+        page_num = int(p["page"])
+        out_path = _to_filename(page_num, self.out_dir)
 
         prompt = p.get("image_prompt_api", "").strip()
         if not prompt:
             raise RuntimeError(f"page {page_num} に image_prompt_api がありません。")
 
         # スタイルを全ページで統一したい場合、ここで足す
-        full_prompt = f"{style_bible}\n\n{prompt}".strip()
+        full_prompt = f"{self.style_bible}\n\n{prompt}".strip()
+        key = cache_key(MODEL, tier_size(self.tier), full_prompt)
+        name = f"{page_num:02d}"
 
-        print(f"→ generating page {page_num:02d} ...")
+        if self._journaled(page_num, key, out_path):
+            print(f"skip page {name} (done in run journal)")
+            return None
 
-        result = client.images.generate(
-            model=MODEL,
-            size=IMAGE_SIZE,
-            prompt=full_prompt,
-        )
+        # draft を頼まれても、同じプロンプトの final が既にあればそれを使う
+        if (self.tier != "final" and out_path.exists() and not self.force
+                and self.keys.get(name) == cache_key(MODEL, IMAGE_SIZE, full_prompt)):
+            print(f"skip page {name} (final image already exists)")
+            return None
 
-        # gpt-image-1 は base64 で返る
-        b64 = result.data[0].b64_json
-        img_bytes = base64.b64decode(b64)
+        # 記録されたキーと違う＝再プランでプロンプトが変わった古い画像（か、違う段階の画像）
+        stale = self.keys.get(name, key) != key
+        if out_path.exists() and not self.force and not stale:
+            print(f"skip page {name} (already exists)")
+            return None
+        current = self.tiers.get(name, "final")
+        if out_path.exists() and stale and current != self.tier:
+            print(f"upgrade page {name} ({current} → {self.tier})")
+        elif out_path.exists() and stale:
+            print(f"regenerate page {name} (prompt changed)")
+        elif out_path.exists() and self.force:
+            print(f"overwrite page {page_num:02d}")
+        return page_num, full_prompt, key, out_path
+
+    def _journaled(self, page_num: int, key: str, out_path: Path) -> bool:
+        if self.journal is None or self.force or not out_path.exists():
+            return False
+        entry = self.journal.last("page_done", page=page_num, key=key)
+        return entry is not None and entry["sha256"] == sha256_file(out_path)
+
+    def submit(self, p: dict) -> None:
+        job = self.job(p)
+        if job is not None:
+            self.submit_job(job)
+
+    def submit_job(self, job: tuple) -> None:
+        page_num, full_prompt, key, out_path = job
+        # ワーカースレッドでの API 呼び出しも、頼んだ側の工程（images / plan）のスパンに入れる
+        fut = self.pool.submit(bind(_generate_page), self.client, self.limiter, self.cache,
+                               page_num, full_prompt, key, out_path, self.tier, self.reroll)
+        self.futures[fut] = (page_num, key)
+
+    def wait_page(self, page_num: int) -> None:
+        """
+        page_num の生成中のジョブが終わるのを待って記録する（同じページを別のプロンプトで頼み直す前に。
+        記録しておかないと job() が「同じ画像がもうある」とみなしてしまう）。
+        """
+        for fut, (n, key) in list(self.futures.items()):
+            if n == page_num:
+                self.timings[n] = fut.result()
+                self._done(n, key, self.timings[n])
+                del self.futures[fut]
+
+    def from_cache(self, job: tuple) -> bool:
+        """キャッシュにあればそれを置いて True（API を呼ばない経路用。batch_api など）。"""
+        page_num, _, key, out_path = job
+        if self.cache is None or not self.cache.fetch(key, out_path):
+            return False
+        print(f"   cache hit: page {page_num:02d}")
+        self._done(page_num, key, 0.0)
+        return True
+
+    def store(self, job: tuple, img_bytes: bytes) -> None:
+        """API の外（batch_api など）で受け取った画像を保存し、キャッシュ・キー・journal に記録する。"""
+        page_num, _, key, out_path = job
+        # キャッシュとハードリンクされている可能性があるので、上書きではなく置き換える
+        atomic_write_bytes(out_path, img_bytes)
+        if self.cache is not None:
+            self.cache.store(key, out_path)
+        self._done(page_num, key, 0.0)
 
-        out_path.write_bytes(img_bytes)
-        print(f"   saved: {out_path}")
+    def _done(self, page_num: int, key: str, seconds: float) -> None:
+        self.keys[f"{page_num:02d}"] = key
+        _save_keys(self.out_dir, self.keys)
+        self.tiers[f"{page_num:02d}"] = self.tier
+        _save_tiers(self.out_dir, self.tiers)
+        if self.journal is not None:
+            out_path = _to_filename(page_num, self.out_dir)
+            self.journal.record("page_done", page=page_num, key=key, sha256=sha256_file(out_path),
+                                seconds=round(seconds, 3), tier=self.tier)
 
-    print("\n✅ Done! Images saved to output/pages/")
+    def close(self) -> dict:
+        try:
+            for fut in as_completed(self.futures):
+                page_num, key = self.futures[fut]
+                self.timings[page_num] = fut.result()
+                self._done(page_num, key, self.timings[page_num])
+        finally:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+        wall = time.perf_counter() - self.t_start
+        if self.timings:
+            serial = sum(self.timings.values())
+            print("\n⏱ per-page timings:")
+            for page_num in sorted(self.timings):
+                print(f"   page {page_num:02d}: {self.timings[page_num]:.1f}s")
+            print(f"   wall: {wall:.1f}s | sum of pages: {serial:.1f}s | speedup: x{serial / max(wall, 1e-9):.2f}")
+
+        print(f"\n✅ Done! Images saved to {self.out_dir.as_posix()}/")
+        return self.timings
+
+def generate_images(plan_path: Path = PLAN_PATH, out_dir: Path = OUT_DIR, *, force: bool = False,
+                    concurrency: int = 1, rpm: float = DEFAULT_RPM, cache_dir: Path = DEFAULT_CACHE_DIR,
+                    cache_max_mb: float = DEFAULT_MAX_MB, no_cache: bool = False, journal=None,
+                    tier: str = "final", page_nums=None) -> dict:
+    """
+    plan の全ページの画像を out_dir に tier の段階で用意する。生成したページの秒数を返す。
+    page_nums を渡すとそのページだけを（あっても・キャッシュにあっても）新しく作り直す。
+    """
+    if not plan_path.exists():
+        raise FileNotFoundError(f"{plan_path} が見つかりません。")
+
+    plan = json.loads(plan_path.read_text(encoding="utf-8"))
+    pages = plan.get("pages", [])
+    if not pages:
+        raise RuntimeError("book_plan.json に pages がありません。")
+
+    if page_nums:
+        missing = sorted(set(page_nums) - {int(p["page"]) for p in pages})
+        if missing:
+            raise RuntimeError(f"book_plan.json に無いページです: {', '.join(map(str, missing))}")
+        pages = [p for p in pages if int(p["page"]) in set(page_nums)]
+
+    # タイトルやスタイルを少し補強（任意）
+    style_bible = plan.get("style_bible", "")
+    title = plan.get("title", "storybook")
+
+    queue = ImageQueue(out_dir, style_bible=style_bible, force=force or bool(page_nums), concurrency=concurrency,
+                       rpm=rpm, cache_dir=cache_dir, cache_max_mb=cache_max_mb, no_cache=no_cache, journal=journal,
+                       tier=tier, reroll=bool(page_nums))
+
+    print(f"📘 Generating images for: {title}")
+    print(f"pages: {len(pages)} | model: {MODEL} | size: {IMAGE_SIZE} | tier: {tier}"
+          f" | concurrency: {concurrency} | rpm: {rpm}\n")
+
+    # 先に全ページを検査して、生成対象を決める（途中で落ちて課金が無駄にならないように）
+    jobs = [job for job in (queue.job(p) for p in pages) if job is not None]
+    for job in jobs:
+        queue.submit_job(job)
+    return queue.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--force", action="store_true", help="既存pngがあっても上書きする")
+    parser.add_argument("--concurrency", type=int, default=1, help="同時に生成するページ数（1なら従来通り順番に生成）")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_RPM, help="画像APIの1分あたりリクエスト上限（0で無制限）")
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR, help="生成画像キャッシュの場所")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_MB, help="キャッシュの容量上限（MB）")
+    parser.add_argument("--no-cache", action="store_true", help="キャッシュを使わず必ずAPIで生成する")
+    parser.add_argument("--tier", choices=sorted(TIERS), default="final",
+                        help="draft: 速いプレビュー用（quality=low）/ final: 仕上げ（draft のページも作り直す）")
+    parser.add_argument("--pages", type=parse_pages, default=None,
+                        help="このページだけ新しく描き直す（例: 3,7 / 3-5）。キャッシュの画像は使わない")
+    args = parser.parse_args()
+
+    generate_images(
+        force=args.force,
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        cache_dir=args.cache_dir,
+        cache_max_mb=args.cache_max_mb,
+        no_cache=args.no_cache,
+        tier=args.tier,
+        page_nums=args.pages,
+    )
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,182 @@
+"""
+公開（docs/ の git add / commit / push）をまとめて行う。
+
+    python pipeline.py --publish-queue      # 本を公開待ちに積む（まとめる条件を満たしたら commit / push）
+    python git_publish.py                   # 公開待ちを今すぐ commit / push
+    python git_publish.py --watch           # 常駐して、--window 秒ごと / --max-books 冊ごとに commit / push
+
+- 公開待ちは work/publish_queue.jsonl（1行1冊）。別々のプロセスから積んでよい
+- commit / push は1回に1プロセスだけ（work/publish.lock）。積まれた本を全部まとめて1つの commit にする
+- 他のプロセスの git が index.lock を持っていたら少し待ってやり直す
+- push が non-fast-forward で断られたら pull --rebase してやり直す
+"""
+import argparse
+import fcntl
+import json
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+SPOOL_PATH = Path("work/publish_queue.jsonl")
+LOCK_PATH = Path("work/publish.lock")
+# add only docs outputs (safer than git add -A)
+# docs/shelf_manifest.json は build_shelf のローカルなキャッシュ（更新時刻を含む）なので commit しない
+OUTPUTS = ("docs/index.html", "docs/catalog", "docs/search", "docs/books", "docs/assets")
+WINDOW = 60.0    # 最初の1冊を積んでから commit するまで待つ秒数
+MAX_BOOKS = 5    # この冊数たまったら待たずに commit する
+
+_lock = threading.Lock()   # 同じプロセスの中で git を同時に動かさない
+
+
+def _git(args: list[str], repo: Path) -> subprocess.CompletedProcess:
+    return subprocess.run(["git", *args], cwd=repo, text=True, capture_output=True)
+
+
+def git_retry(args: list[str], repo: Path = Path("."), attempts: int = 8, delay: float = 0.25
+              ) -> subprocess.CompletedProcess:
+    """git を実行する。他の git が index.lock を持っているときは待ってやり直す。"""
+    print("\n🟦 RUN:", " ".join(["git", *args]))
+    for i in range(attempts):
+        p = _git(args, repo)
+        if p.returncode == 0 or "index.lock" not in p.stderr:
+            return p
+        wait = delay * (2 ** i)
+        print(f"   ⚠️ index.lock is held by another git; retry {i + 1}/{attempts} after {wait:.2f}s")
+        time.sleep(wait)
+    return p
+
+
+def _rejected(p: subprocess.CompletedProcess) -> bool:
+    err = p.stderr
+    return p.returncode != 0 and ("non-fast-forward" in err or "fetch first" in err or "[rejected]" in err)
+
+
+def push_with_retry(repo: Path = Path("."), attempts: int = 5) -> None:
+    """push する。リモートが先に進んでいたら pull --rebase してやり直す。"""
+    for i in range(attempts):
+        p = git_retry(["push"], repo)
+        if p.returncode == 0:
+            return
+        if not _rejected(p):
+            raise SystemExit(f"❌ git push failed:\n{p.stderr}")
+        print(f"   ⚠️ push rejected (remote has new commits); rebase and retry {i + 1}/{attempts}")
+        r = git_retry(["pull", "--rebase", "--no-edit"], repo)
+        if r.returncode != 0:
+            git_retry(["rebase", "--abort"], repo)
+            raise SystemExit(f"❌ git pull --rebase failed (resolve by hand):\n{r.stderr}")
+    raise SystemExit(f"❌ git push still rejected after {attempts} attempts")
+
+
+def commit_and_push(message: str = "", push: bool = True, repo: Path = Path("."),
+                    outputs: tuple[str, ...] = OUTPUTS) -> bool:
+    """docs の出力を add して commit し、push する。commit するものが無ければ False。"""
+    with _lock:
+        paths = [p for p in outputs if (repo / p).exists()]
+        p = git_retry(["add", *paths], repo)
+        if p.returncode != 0:
+            raise SystemExit(f"❌ git add failed:\n{p.stderr}")
+
+        msg = message.strip() or "Add new book " + datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        p = git_retry(["commit", "-m", msg], repo)
+        # If nothing changed, git commit returns non-zero. Handle gently.
+        if p.returncode != 0:
+            print("ℹ️ No changes to commit (or commit failed). Continuing...")
+            committed = False
+        else:
+            committed = True
+        if push:
+            push_with_retry(repo)
+        return committed
+
+
+# --- 公開待ち -------------------------------------------------------------------
+
+@contextmanager
+def _flock(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_spool(spool: Path) -> list[dict]:
+    if not spool.exists():
+        return []
+    entries = []
+    for line in spool.read_text(encoding="utf-8").splitlines():
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return entries
+
+
+def enqueue(book_id: str, spool: Path = SPOOL_PATH) -> None:
+    """本を公開待ちに積む。"""
+    line = json.dumps({"book_id": book_id, "t": time.time(),
+                       "ts": datetime.now().isoformat(timespec="seconds")}, ensure_ascii=False)
+    with _flock(spool.with_suffix(".lock")):
+        with spool.open("a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    print(f"📮 queued for publish: {book_id}")
+
+
+def pending(spool: Path = SPOOL_PATH) -> list[dict]:
+    with _flock(spool.with_suffix(".lock")):
+        return _read_spool(spool)
+
+
+def flush(*, window: float = WINDOW, max_books: int = MAX_BOOKS, force: bool = False, push: bool = True,
+          repo: Path = Path("."), spool: Path = SPOOL_PATH, lock: Path = LOCK_PATH) -> list[str]:
+    """
+    公開待ちが max_books 冊以上か、一番古いものが window 秒以上待っていたら（force なら必ず）
+    1つの commit にまとめて push し、公開した book_id を返す。条件を満たさなければ何もしない。
+    """
+    with _flock(lock):
+        entries = pending(spool)
+        if not entries:
+            return []
+        waited = time.time() - entries[0]["t"]
+        if not (force or len(entries) >= max_books or waited >= window):
+            print(f"📮 {len(entries)} books waiting for publish ({waited:.0f}s / {window:.0f}s)")
+            return []
+
+        ids = list(dict.fromkeys(e["book_id"] for e in entries))
+        head = ", ".join(ids[:5]) + (" ..." if len(ids) > 5 else "")
+        commit_and_push(f"Add {len(ids)} new books ({head})" if len(ids) > 1 else f"Add new book {ids[0]}",
+                        push=push, repo=repo)
+
+        # commit している間に積まれた分は残す
+        with _flock(spool.with_suffix(".lock")):
+            rest = _read_spool(spool)[len(entries):]
+            spool.write_text("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in rest), encoding="utf-8")
+    print(f"✅ published {len(ids)} books in one commit")
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Commit and push queued books in batches")
+    parser.add_argument("--watch", action="store_true", help="Keep running and flush whenever the queue is due")
+    parser.add_argument("--window", type=float, default=WINDOW, help="Seconds the oldest queued book may wait")
+    parser.add_argument("--max-books", type=int, default=MAX_BOOKS, help="Flush as soon as this many are queued")
+    parser.add_argument("--no-push", action="store_true", help="Do not git push (commit only)")
+    args = parser.parse_args()
+
+    if not args.watch:
+        if not flush(force=True, push=not args.no_push):
+            print("ℹ️ Nothing queued for publish")
+        return
+    print(f"👀 publish queue: every {args.window:.0f}s or {args.max_books} books")
+    while True:
+        flush(window=args.window, max_books=args.max_books, push=not args.no_push)
+        time.sleep(min(5.0, args.window / 4 or 1.0))
+
+
+if __name__ == "__main__":
+    main()
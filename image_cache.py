@@ -0,0 +1,100 @@
+"""
+生成画像のキャッシュ（内容アドレス方式）。
+キーは (MODEL, IMAGE_SIZE, full_prompt) のハッシュ。プロンプトが変わらない限り
+API を呼ばずにキャッシュからハードリンク（またはコピー）で output/pages に置く。
+容量上限を超えたら、最後に使われたのが古いものから消す（LRU）。
+最後に使った時刻は画像の横の空の印（<key>.used）の更新時刻に残す。画像そのものは output/pages などと
+ハードリンクで共有しているので、その更新時刻を変えると派生画像などが「元画像が新しくなった」と誤解する。
+合計サイズは起動時に1回だけ数えて登録・削除のたびに足し引きし、上限を超えたときだけ中身を見直す
+（見直したら上限の EVICT_TO まで消すので、いっぱいのキャッシュでも登録のたびには見直さない）。
+"""
+import hashlib
+import threading
+from pathlib import Path
+
+from fileutil import link_or_copy
+
+DEFAULT_CACHE_DIR = Path(".cache/images")
+DEFAULT_MAX_MB = 2048
+EVICT_TO = 0.9   # 上限を超えたら、上限のこの割合まで消す
+
+
+def cache_key(model: str, size: str, prompt: str) -> str:
+    h = hashlib.sha256()
+    for part in (model, size, prompt):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ImageCache:
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_mb: float = DEFAULT_MAX_MB):
+        self.dir = Path(cache_dir)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._total = sum(size for _, size, _ in self._scan())
+
+    def _scan(self) -> list[tuple[float, int, Path]]:
+        """キャッシュの全ファイルの (最終利用時刻, サイズ, パス)。"""
+        used = {}
+        for mark in self.dir.glob("*/*.used"):
+            try:
+                used[mark.stem] = mark.stat().st_mtime
+            except FileNotFoundError:
+                continue
+        entries = []
+        for path in self.dir.glob("*/*.png"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:   # 同じキャッシュを使う他のプロセスが消した
+                continue
+            entries.append((max(st.st_mtime, used.get(path.stem, 0.0)), st.st_size, path))
+        return entries
+
+    def _path(self, key: str) -> Path:
+        return self.dir / key[:2] / f"{key}.png"
+
+    def _used_mark(self, key: str) -> Path:
+        return self.dir / key[:2] / f"{key}.used"
+
+    def fetch(self, key: str, dst: Path) -> bool:
+        """ヒットしたら dst に置いて True。"""
+        src = self._path(key)
+        if not src.exists():
+            return False
+        # LRU 用の最終利用時刻は印のほうに残す（src はページ画像と同じ実体なので触らない）
+        self._used_mark(key).touch()
+        link_or_copy(src, dst)
+        return True
+
+    def store(self, key: str, src: Path) -> None:
+        """生成済みの src をキャッシュに登録する（ハードリンクできればコピー不要）。"""
+        dst = self._path(key)
+        old = dst.stat().st_size if dst.exists() else 0
+        link_or_copy(src, dst)
+        with self._lock:
+            self._total += dst.stat().st_size - old
+            over = self._total > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        容量上限を超えていれば、上限の EVICT_TO まで古いものから削除する。
+        ディレクトリを見直して合計を数え直す（同じキャッシュを使う他のプロセスの分もここで合う）。
+        """
+        with self._lock:
+            entries = self._scan()
+            total = self._total = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                path.unlink(missing_ok=True)
+                path.with_suffix(".used").unlink(missing_ok=True)
+                total -= size
+                self._total = total
+                print(f"   🧹 cache evicted: {path.name}")
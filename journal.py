@@ -0,0 +1,55 @@
+"""
+実行の記録（work/run_journal.jsonl）。1行1件の JSON を追記するだけで、書き換えない。
+
+- stage_start / stage_done / stage_failed : パイプラインの工程（入力・出力の内容ハッシュ付き）
+- page_done  : 画像1ページ分（プロンプトのキーと画像の sha256）
+- chunk_done : 長い音声の1区間分の文字起こし（音声の sha256 と区間、テキスト）
+
+途中で止まった実行を --resume で続けるときに、記録に残っていて結果のファイルも
+そのまま残っているものはやり直さない（有料の API を呼び直さない）。
+"""
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+
+JOURNAL_NAME = "run_journal.jsonl"
+
+
+class RunJournal:
+    def __init__(self, path: Path):
+        self.path = path
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        self._lock = threading.Lock()
+        self.entries = self._read()
+
+    def _read(self) -> list[dict]:
+        if not self.path.exists():
+            return []
+        entries = []
+        for line in self.path.read_text(encoding="utf-8").splitlines():
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 書き込み途中で止まった最後の行は捨てる
+                continue
+        return entries
+
+    def record(self, event: str, **fields) -> dict:
+        entry = {"ts": datetime.now().isoformat(timespec="milliseconds"), "run": self.run_id, "event": event,
+                 **fields}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line)
+            self.entries.append(entry)
+        return entry
+
+    def last(self, event: str, **match) -> dict | None:
+        """event で、match の値がすべて一致する一番新しい記録。"""
+        with self._lock:
+            for entry in reversed(self.entries):
+                if entry["event"] == event and all(entry.get(k) == v for k, v in match.items()):
+                    return entry
+        return None
@@ -1,4 +1,7 @@
+import argparse
 import json
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from reportlab.pdfgen import canvas
@@ -6,6 +9,9 @@ from reportlab.lib.utils import ImageReader
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.cidfonts import UnicodeCIDFont
 
+from fileutil import parse_pages
+import tracing
+
 PLAN_PATH = Path("work/book_plan.json")
 PAGES_DIR = Path("output/pages")
 OUT_PDF = Path("output/book.pdf")
@@ -27,124 +33,292 @@ LEADING = 46
 INNER_MARGIN = 44  # 右テキスト枠の内側余白
 TEXT_BOX_RADIUS = 24
 
-def wrap_text_by_width(text: str, font_name: str, font_size: int, max_width: float):
+# 禁則処理（行頭に来てはいけない文字 / 行末に来てはいけない文字）
+KINSOKU = False  # True にすると禁則処理あり（既存の本と改行位置が変わる）
+NO_LINE_START = set("、。，．,.・：；:;？！?!」』）)】〕］]｝}〉》ー～ぁぃぅぇぉっゃゅょゎァィゥェォッャュョヮヵヶ々ゝゞヽヾ")
+NO_LINE_END = set("「『（(【〔［[｛{〈《")
+HANGING = set("、。，．,.")  # はみ出してでも行末にぶら下げる句読点
+
+# フォントごとの1文字の幅（サイズ1000のときの値）。ページや本をまたいで使い回す
+_GLYPH_WIDTHS: dict[str, dict[str, float]] = {}
+
+def _char_width_1000(ch: str, font_name: str, cache: dict) -> float:
+    w = cache.get(ch)
+    if w is None:
+        w = cache[ch] = pdfmetrics.stringWidth(ch, font_name, 1000)
+    return w
+
+def wrap_text_by_width(text: str, font_name: str, font_size: int, max_width: float, kinsoku: bool = False):
     """
     実際の描画幅（stringWidth）で折り返し。
     日本語はスペースが少ないので1文字ずつ詰めていく方式。
+    文字幅はキャッシュして足し算していくので、行の長さに比例する時間で済む
+    （reportlab も「文字幅の合計 × size / 1000」で幅を出すので結果は同じになる）。
+    kinsoku=True なら句読点のぶら下げ・追い出しと、開き括弧の行末禁止を行う。
     """
     text = (text or "").strip()
     if not text:
         return []
 
+    cache = _GLYPH_WIDTHS.setdefault(font_name, {})
+    scale = font_size * 0.001
+
+    def units(s: str) -> float:
+        return sum(_char_width_1000(c, font_name, cache) for c in s)
+
     lines = []
     current = ""
+    current_units = 0
     for ch in text:
         # 改行が入ってたら強制改行
         if ch == "\n":
             if current:
                 lines.append(current)
                 current = ""
+                current_units = 0
             continue
 
-        trial = current + ch
-        w = pdfmetrics.stringWidth(trial, font_name, font_size)
-        if w <= max_width:
-            current = trial
-        else:
-            if current:
-                lines.append(current)
-                current = ch
-            else:
-                # 1文字すら入らない場合は無理やり入れる
-                lines.append(ch)
-                current = ""
+        ch_units = _char_width_1000(ch, font_name, cache)
+        if scale * (current_units + ch_units) <= max_width:
+            current += ch
+            current_units += ch_units
+            continue
+
+        if not current:
+            # 1文字すら入らない場合は無理やり入れる
+            lines.append(ch)
+            continue
+
+        if kinsoku and ch in HANGING:
+            # 句読点は行末にぶら下げる
+            lines.append(current + ch)
+            current = ""
+            current_units = 0
+            continue
+
+        # 行頭禁則（追い出し）/ 行末禁則：current の末尾の文字を次の行に送る
+        carry = ""
+        if kinsoku and len(current) > 1 and (ch in NO_LINE_START or current[-1] in NO_LINE_END):
+            carry = current[-1]
+            current = current[:-1]
+        lines.append(current)
+        current = carry + ch
+        current_units = units(current)
     if current:
         lines.append(current)
     return lines
 
-def main():
-    pdfmetrics.registerFont(UnicodeCIDFont(FONT_NAME))
+def register_fonts():
+    """フォント登録（何度呼んでも1回だけ登録する）。"""
+    if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(UnicodeCIDFont(FONT_NAME))
 
-    if not PLAN_PATH.exists():
-        raise FileNotFoundError(f"{PLAN_PATH} が見つかりません。")
-    plan = json.loads(PLAN_PATH.read_text(encoding="utf-8"))
-    pages = plan.get("pages", [])
-    if not pages:
-        raise RuntimeError("book_plan.json に pages がありません。")
+# カラム座標
+LEFT_X0 = MARGIN
+RIGHT_X0 = MARGIN + COL_W + GAP
+Y0 = MARGIN
+BOX_H = PAGE_H - 2 * MARGIN
 
-    OUT_PDF.parent.mkdir(parents=True, exist_ok=True)
+# 右のテキスト枠に入る幅と行数（draw_page と同じ）
+TEXT_AREA_W = COL_W - 2 * INNER_MARGIN
+MAX_TEXT_LINES = int((BOX_H - 2 * INNER_MARGIN) / LEADING)
 
-    c = canvas.Canvas(str(OUT_PDF), pagesize=(PAGE_W, PAGE_H))
-    c.setTitle(plan.get("title", "storybook"))
+def text_lines(text: str) -> list[str]:
+    """text を draw_page と同じように折り返した行（MAX_TEXT_LINES を超えた分は PDF では切れる）。"""
+    register_fonts()
+    return wrap_text_by_width(text, FONT_NAME, FONT_SIZE, TEXT_AREA_W, kinsoku=KINSOKU)
 
-    # カラム座標
-    left_x0 = MARGIN
-    right_x0 = MARGIN + COL_W + GAP
-    y0 = MARGIN
-    h = PAGE_H - 2 * MARGIN
+def draw_page(c, p: dict, total: int, img_path: Path):
+    """1ページ分（左：画像／右：テキスト）を描いて showPage する。"""
+    left_x0, right_x0, y0, h = LEFT_X0, RIGHT_X0, Y0, BOX_H
+    page_num = int(p["page"])
 
-    for p in pages:
-        page_num = int(p["page"])
-        img_path = PAGES_DIR / f"{page_num:02d}.png"
-        if not img_path.exists():
-            raise FileNotFoundError(f"画像がありません: {img_path}")
+    # --- 右：テキスト枠（白背景） ---
+    c.setFillGray(1.0)
+    c.roundRect(right_x0, y0, COL_W, h, radius=TEXT_BOX_RADIUS, stroke=0, fill=1)
+
+    # --- 左：画像（枠内フィット） ---
+    img = ImageReader(str(img_path))
+    c.drawImage(
+        img,
+        left_x0,
+        y0,
+        width=COL_W,
+        height=h,
+        preserveAspectRatio=True,
+        anchor="c",
+    )
+
+    # --- 右：テキスト ---
+    c.setFillGray(0.0)
+    c.setFont(FONT_NAME, FONT_SIZE)
 
-        # --- 右：テキスト枠（白背景） ---
-        c.setFillGray(1.0)
-        c.roundRect(right_x0, y0, COL_W, h, radius=TEXT_BOX_RADIUS, stroke=0, fill=1)
+    text = (p.get("text") or "").strip()
 
-        # --- 左：画像（枠内フィット） ---
-        img = ImageReader(str(img_path))
-        c.drawImage(
-            img,
-            left_x0,
-            y0,
-            width=COL_W,
-            height=h,
-            preserveAspectRatio=True,
-            anchor="c",
-        )
+    text_area_x = right_x0 + INNER_MARGIN
+    text_area_y_top = y0 + h - INNER_MARGIN - FONT_SIZE
+    text_area_w = COL_W - 2 * INNER_MARGIN
+    text_area_h = h - 2 * INNER_MARGIN
 
-        # --- 右：テキスト ---
-        c.setFillGray(0.0)
-        c.setFont(FONT_NAME, FONT_SIZE)
+    lines = wrap_text_by_width(text, FONT_NAME, FONT_SIZE, text_area_w, kinsoku=KINSOKU)
 
-        text = (p.get("text") or "").strip()
+    max_lines = int(text_area_h / LEADING)
+    lines = lines[:max_lines]
 
-        text_area_x = right_x0 + INNER_MARGIN
-        text_area_y_top = y0 + h - INNER_MARGIN - FONT_SIZE
-        text_area_w = COL_W - 2 * INNER_MARGIN
-        text_area_h = h - 2 * INNER_MARGIN
+    center_x = right_x0 + (COL_W / 2)
 
-        lines = wrap_text_by_width(text, FONT_NAME, FONT_SIZE, text_area_w)
+    num_lines = len(lines)
+    max_lines = int(text_area_h / LEADING)
+    lines = lines[:max_lines]
+    num_lines = len(lines)
 
-        max_lines = int(text_area_h / LEADING)
-        lines = lines[:max_lines]
+    block_h = (num_lines - 1) * LEADING
+    start_y = y0 + (h / 2) + (block_h / 2)  # 右枠の中央を基準に上端を決める
 
-        center_x = right_x0 + (COL_W / 2)
+    for i, line in enumerate(lines):
+        y = start_y - i * LEADING
+        c.drawCentredString(center_x, y, line)
 
-        num_lines = len(lines)
-        max_lines = int(text_area_h / LEADING)
-        lines = lines[:max_lines]
-        num_lines = len(lines)
 
-        block_h = (num_lines - 1) * LEADING
-        start_y = y0 + (h / 2) + (block_h / 2)  # 右枠の中央を基準に上端を決める
+    # --- ページ番号 ---
+    c.setFont(FONT_NAME, 18)
+    c.setFillGray(0.35)
+    c.drawRightString(right_x0 + COL_W - INNER_MARGIN, y0 + 20, f"{page_num}/{total}")
 
-        for i, line in enumerate(lines):
-            y = start_y - i * LEADING
-            c.drawCentredString(center_x, y, line)
+    c.showPage()
 
+def page_image(pages_dir: Path, page_num: int) -> Path:
+    """PDF に使う画像。カラムサイズに縮小済みの print 用画像があればそちらを使う。"""
+    from derive_assets import fresh_variant
+    return fresh_variant(pages_dir, "print", page_num) or pages_dir / f"{page_num:02d}.png"
 
-        # --- ページ番号 ---
-        c.setFont(FONT_NAME, 18)
-        c.setFillGray(0.35)
-        c.drawRightString(right_x0 + COL_W - INNER_MARGIN, y0 + 20, f"{page_num}/{len(pages)}")
+def render_pages(pages: list[dict], total: int, pages_dir: Path, out_pdf: Path, title: str) -> Path:
+    """pages を1つの PDF に描く（プロセスプールのワーカーからも呼ばれる）。"""
+    register_fonts()
+    c = canvas.Canvas(str(out_pdf), pagesize=(PAGE_W, PAGE_H))
+    c.setTitle(title)
+    for p in pages:
+        with tracing.span(f"pdf page {int(p['page']):02d}", cat="pdf_page", page=int(p["page"])):
+            draw_page(c, p, total, page_image(pages_dir, int(p["page"])))
+    with tracing.span("pdf save", cat="pdf_page"):
+        c.save()
+    return out_pdf
+
+def _render_fragment(job) -> tuple[str, list]:
+    """ワーカーで断片を描き、(断片のパス, ワーカーでの計測記録) を返す。"""
+    pages, total, pages_dir, out_pdf, title = job
+    path = str(render_pages(pages, total, Path(pages_dir), Path(out_pdf), title))
+    return path, tracing.drain()
+
+def concat_pdfs(fragments: list[Path], out_pdf: Path, title: str) -> Path:
+    """断片 PDF をページ順につなげる（pypdf が必要）。"""
+    try:
+        from pypdf import PdfWriter
+    except ImportError as e:
+        raise RuntimeError("並列レンダリング（workers > 1）には pypdf が必要です: pip install pypdf") from e
+
+    writer = PdfWriter()
+    for frag in fragments:
+        writer.append(str(frag))
+    writer.add_metadata({"/Title": title})
+    with out_pdf.open("wb") as f:
+        writer.write(f)
+    return out_pdf
 
-        c.showPage()
+def build_pdf(plan_path: Path = PLAN_PATH, pages_dir: Path = PAGES_DIR, out_pdf: Path = OUT_PDF,
+              workers: int = 1) -> Path:
+    """
+    workers > 1 のときはページを workers 個のまとまりに分けてプロセスプールで描き
+    （PNG のデコードもワーカー側で行う）、最後にページ順に1つの PDF につなげる。
+    """
+    if not plan_path.exists():
+        raise FileNotFoundError(f"{plan_path} が見つかりません。")
+    plan = json.loads(plan_path.read_text(encoding="utf-8"))
+    pages = plan.get("pages", [])
+    if not pages:
+        raise RuntimeError("book_plan.json に pages がありません。")
+
+    for p in pages:
+        img_path = pages_dir / f"{int(p['page']):02d}.png"
+        if not img_path.exists():
+            raise FileNotFoundError(f"画像がありません: {img_path}")
+
+    out_pdf.parent.mkdir(parents=True, exist_ok=True)
+    title = plan.get("title", "storybook")
+    total = len(pages)
+
+    workers = max(1, min(workers, total))
+    if workers == 1:
+        render_pages(pages, total, pages_dir, out_pdf, title)
+        print("✅ PDF saved:", out_pdf)
+        return out_pdf
+
+    size = -(-total // workers)  # 切り上げ
+    batches = [pages[i:i + size] for i in range(0, total, size)]
+    with tempfile.TemporaryDirectory(prefix="pdf_", dir=out_pdf.parent) as tmp:
+        jobs = [
+            (batch, total, str(pages_dir), str(Path(tmp) / f"{i:03d}.pdf"), title)
+            for i, batch in enumerate(batches)
+        ]
+        fragments = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, events in pool.map(_render_fragment, jobs):
+                fragments.append(Path(path))
+                tracing.merge(events)
+        with tracing.span("pdf concat", cat="pdf_page"):
+            concat_pdfs(fragments, out_pdf, title)
+
+    print(f"✅ PDF saved: {out_pdf} ({len(batches)} fragments, {workers} workers)")
+    return out_pdf
+
+def splice_pages(plan_path: Path = PLAN_PATH, pages_dir: Path = PAGES_DIR, out_pdf: Path = OUT_PDF,
+                 page_nums=()) -> Path:
+    """
+    既存の out_pdf のうち page_nums のページだけ描き直して差し替える（他のページは描かない）。
+    PDF が無い・ページ数が plan と合わない・pypdf が無いときは全体を描き直す。
+    """
+    plan = json.loads(plan_path.read_text(encoding="utf-8"))
+    pages = plan.get("pages", [])
+    targets = [p for p in pages if int(p["page"]) in set(page_nums)]
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        print("ℹ️ pypdf が無いので PDF を全部描き直します")
+        return build_pdf(plan_path, pages_dir, out_pdf)
+    if not out_pdf.exists() or len(PdfReader(str(out_pdf)).pages) != len(pages):
+        return build_pdf(plan_path, pages_dir, out_pdf)
+    if not targets:
+        return out_pdf
+
+    title = plan.get("title", "storybook")
+    index = {int(p["page"]): i for i, p in enumerate(pages)}
+    with tempfile.TemporaryDirectory(prefix="pdf_", dir=out_pdf.parent) as tmp:
+        fresh = PdfReader(str(render_pages(targets, len(pages), pages_dir, Path(tmp) / "pages.pdf", title)))
+        replaced = {index[int(p["page"])]: page for p, page in zip(targets, fresh.pages)}
+        writer = PdfWriter()
+        for i, page in enumerate(PdfReader(str(out_pdf)).pages):
+            writer.add_page(replaced.get(i, page))
+        writer.add_metadata({"/Title": title})
+        # 一時ファイルに書いてから置き換える（out_pdf はまだ読んでいる途中で、書きかけの PDF も残さない）
+        tmp_pdf = Path(tmp) / "book.pdf"
+        with tmp_pdf.open("wb") as f:
+            writer.write(f)
+        tmp_pdf.replace(out_pdf)
+
+    print(f"✅ PDF updated: {out_pdf} (pages {', '.join(str(int(p['page'])) for p in targets)})")
+    return out_pdf
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="ページを並列に描くプロセス数（2以上は pypdf が必要）")
+    parser.add_argument("--pages", type=parse_pages, default=None,
+                        help="このページだけ描き直して既存の PDF に差し込む（例: 3,7 / 3-5）")
+    args = parser.parse_args()
 
-    c.save()
-    print("✅ PDF saved:", OUT_PDF)
+    if args.pages:
+        splice_pages(page_nums=args.pages)
+        return
+    build_pdf(workers=args.workers)
 
 if __name__ == "__main__":
     main()
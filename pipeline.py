@@ -1,9 +1,25 @@
 import argparse
+import cProfile
+import hashlib
+import io
+import json
+import pstats
 import subprocess
-import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 from datetime import datetime
 
+from fileutil import HashCache, atomic_write_bytes, parse_pages
+import git_publish
+from journal import JOURNAL_NAME, RunJournal
+import tracing
+
+HASH_CACHE_NAME = ".fingerprint_cache.json"   # state と同じディレクトリに置く
+
+# images の工程の「やり直しが要る理由」: 仕上げを頼んだのにプレビュー用の画像が残っている
+DRAFT_PAGES = "draft pages"
+
 
 def run(cmd: list[str]) -> None:
     """Run a command and fail fast with nice logs."""
@@ -18,59 +34,563 @@ def ensure_git_clean_enough() -> None:
     pass
 
 
+class BookPaths:
+    """1冊分の入出力パス（各スクリプトの既定値と同じ配置）。"""
+
+    def __init__(self, audio: Path = Path("input/test01.mp3"), work: Path = Path("work"),
+                 output: Path = Path("output"), docs: Path = Path("docs")):
+        self.audio = audio
+        self.work = work
+        self.transcript = work / "transcript.txt"
+        self.prompt = work / "prompt.txt"
+        self.plan = work / "book_plan.json"
+        self.state = work / "pipeline_state.json"
+        self.journal = work / JOURNAL_NAME
+        self.trace = work / "trace.json"
+        self.profile = work / "profile"
+        self.pages = output / "pages"
+        self.derived = output / "derived"
+        self.pdf = output / "book.pdf"
+        self.books = docs / "books"
+        self.index = docs / "index.html"
+        self.catalog = docs / "catalog" / "index.json"
+        self.search = docs / "search" / "meta.json"
+
+
+def _files(paths) -> list[Path]:
+    """ファイルとディレクトリ（配下の全ファイル）を並べる。"""
+    out = []
+    for p in paths:
+        if p.is_dir():
+            out.extend(sorted(f for f in p.rglob("*") if f.is_file()))
+        else:
+            out.append(p)
+    return out
+
+
+_hash_caches: dict[Path, HashCache] = {}
+_hash_caches_lock = threading.Lock()
+
+
+def hash_cache(path: Path) -> HashCache:
+    """path に保存する HashCache（同じプロセスの Pipeline どうしで共有する）。"""
+    key = path.resolve()
+    with _hash_caches_lock:
+        if key not in _hash_caches:
+            _hash_caches[key] = HashCache(path)
+        return _hash_caches[key]
+
+
+def fingerprint(paths, hashes: HashCache) -> str:
+    """
+    パス名＋中身のハッシュ。存在しないファイルも「無い」として区別する。
+    中身のハッシュは hashes から引く（サイズと更新時刻が変わっていないファイルは読み直さない）。
+    """
+    h = hashlib.sha256()
+    for f in _files(paths):
+        h.update(f.as_posix().encode("utf-8"))
+        h.update(hashes.sha256(f).encode() if f.exists() else b"<missing>")
+    return h.hexdigest()
+
+
+class Stage:
+    """
+    パイプラインの1工程。
+    inputs / outputs はパスのリストを返す関数（実行時に評価する）。
+    enabled が False を返す工程は実行せずに通過する。
+    stale は入力・出力のハッシュでは分からない「やり直しが要る理由」を返す関数（不要なら None）。
+    """
+
+    def __init__(self, name, deps, inputs, outputs, run, enabled=None, note="", stale=None):
+        self.name = name
+        self.deps = list(deps)
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.enabled = enabled or (lambda: True)
+        self.note = note
+        self.stale = stale or (lambda: None)
+
+
+class Pipeline:
+    """
+    make 風の実行器。各工程の入力・出力の内容ハッシュを state ファイルに記録し、
+    入力が変わっていない＆出力がそのまま残っている工程はスキップする。
+    依存関係が満たされた工程は並列に実行する。
+    journal を渡すと各工程の開始・終了・失敗を追記し、resume=True なら
+    journal に終了が記録されていて出力がそのまま残っている工程は、入力が変わっていてもやり直さない。
+    各工程は tracing のスパンとして計測する。profile_dir を渡すと各工程を cProfile にかけて
+    <工程名>.prof を書く（工程を実行したスレッドの分だけ。画像生成などのワーカースレッドは含まない）。
+    """
+
+    def __init__(self, stages: list[Stage], state_path: Path, ctx: dict, jobs: int = 2,
+                 journal: RunJournal | None = None, resume: bool = False, profile_dir: Path | None = None):
+        self.stages = {s.name: s for s in stages}
+        self.order = [s.name for s in stages]
+        self.state_path = state_path
+        self.jobs = jobs
+        self.journal = journal
+        self.resume = resume and journal is not None
+        self.profile_dir = profile_dir
+        self.state = self._load_state()
+        self.hashes = hash_cache(state_path.parent / HASH_CACHE_NAME)
+        # ctx は工程間で共有する値（公開先の book_id など）。state と一緒に保存する
+        self.ctx = ctx
+        self.ctx.update(self.state.get("ctx", {}))
+        self._lock = threading.Lock()
+
+    def _load_state(self) -> dict:
+        if self.state_path.exists():
+            return json.loads(self.state_path.read_text(encoding="utf-8"))
+        return {"stages": {}}
+
+    def _save_state(self) -> None:
+        self.state["ctx"] = self.ctx
+        data = json.dumps(self.state, ensure_ascii=False, indent=2).encode("utf-8")
+        atomic_write_bytes(self.state_path, data)
+        self.hashes.save()
+
+    def checkpoint(self, stage: Stage, force: set[str]) -> dict | None:
+        """--resume で使える journal の記録（出力が記録時のまま残っている stage_done）。"""
+        if not self.resume or stage.name in force or "all" in force or not stage.enabled() or stage.stale():
+            return None
+        entry = self.journal.last("stage_done", stage=stage.name)
+        if entry is None:
+            return None
+        outputs = stage.outputs()
+        if any(not p.exists() for p in outputs) or entry["outputs"] != fingerprint(outputs, self.hashes):
+            return None
+        return entry
+
+    def reason(self, stage: Stage, force: set[str]) -> str | None:
+        """実行が必要ならその理由、不要なら None。"""
+        if not stage.enabled():
+            return None
+        if stage.name in force or "all" in force:
+            return "forced"
+        rec = self.state["stages"].get(stage.name)
+        if rec is None:
+            return "never run"
+        if rec["inputs"] != fingerprint(stage.inputs(), self.hashes):
+            return "inputs changed"
+        # 出力の確認より先に見る（--draft の仕上げが途中で止まると出力も書き換わっている）
+        stale = stage.stale()
+        if stale:
+            return stale
+        outputs = stage.outputs()
+        if any(not p.exists() for p in outputs):
+            return "outputs missing"
+        if rec["outputs"] != fingerprint(outputs, self.hashes):
+            return "outputs modified"
+        return None
+
+    def dry_run(self, force: set[str]) -> dict:
+        """実際には実行せず、各工程が走るかどうかと理由を表示する。"""
+        plan = {}
+        for name in self.order:
+            stage = self.stages[name]
+            upstream = [d for d in stage.deps if plan.get(d)]
+            entry = self.checkpoint(stage, force)
+            if not stage.enabled():
+                why = None
+                label = f"skip ({stage.note or 'disabled'})"
+            elif entry is not None:
+                why = None
+                label = f"skip (resume: done in run {entry['run']})"
+            else:
+                why = self.reason(stage, force)
+                if why is None and upstream:
+                    why = f"upstream {', '.join(upstream)} will run"
+                label = f"RUN  ({why})" if why else "skip (up to date)"
+            plan[name] = why
+            print(f"   {name:<12} {label}")
+        return plan
+
+    def _run_stage(self, stage: Stage, why: str) -> None:
+        print(f"\n🟦 STAGE: {stage.name} ({why})")
+        if self.journal:
+            self.journal.record("stage_start", stage=stage.name, reason=why,
+                                inputs=fingerprint(stage.inputs(), self.hashes))
+        try:
+            with tracing.span(stage.name, cat="stage", reason=why):
+                self._call(stage)
+        except BaseException as e:
+            if self.journal:
+                self.journal.record("stage_failed", stage=stage.name, error=f"{type(e).__name__}: {e}")
+            raise
+        self.mark_done(stage.name)
+
+    def mark_done(self, name: str, **fields) -> None:
+        """
+        工程が終わったことを記録する（入力・出力の今のハッシュ）。
+        工程の外（batch_api のまとめ投げなど）で出力を作ったときにも呼ぶと、次の実行ではスキップされる。
+        """
+        stage = self.stages[name]
+        rec = {
+            "inputs": fingerprint(stage.inputs(), self.hashes),
+            "outputs": fingerprint(stage.outputs(), self.hashes),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        if self.journal:
+            self.journal.record("stage_done", stage=stage.name, inputs=rec["inputs"], outputs=rec["outputs"],
+                                ctx=self.ctx, **fields)
+        self._record(stage.name, rec)
+
+    def _call(self, stage: Stage) -> None:
+        if self.profile_dir is None:
+            stage.run()
+            return
+        prof = cProfile.Profile()
+        try:
+            prof.runcall(stage.run)
+        finally:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            path = self.profile_dir / f"{stage.name}.prof"
+            prof.dump_stats(str(path))
+            out = io.StringIO()
+            pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(12)
+            print(f"\n🔬 profile: {path.as_posix()}\n{out.getvalue()}")
+
+    def _record(self, name: str, rec: dict) -> None:
+        with self._lock:
+            self.state["stages"][name] = rec
+            self._save_state()
+
+    def _resume_stage(self, stage: Stage, entry: dict) -> None:
+        """journal の記録を信じてスキップし、次回の通常実行でもスキップされるよう state を合わせる。"""
+        print(f"\n⏭  STAGE: {stage.name} (resume: done in run {entry['run']})")
+        self.ctx.update({k: v for k, v in entry.get("ctx", {}).items() if k not in self.ctx})
+        self._record(stage.name, {
+            "inputs": fingerprint(stage.inputs(), self.hashes),
+            "outputs": entry["outputs"],
+            "finished_at": entry["ts"],
+        })
+
+    def execute(self, force: set[str], only: set[str] | None = None) -> list[str]:
+        """
+        依存順に（可能なものは並列に）実行し、実際に走った工程名を返す。
+        only を渡すと、それ以外の工程は実行せずに通過する。
+        """
+        done, started, ran = set(), set(), []
+        futures = {}
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as pool:
+            while len(done) < len(self.order):
+                for name in self.order:
+                    stage = self.stages[name]
+                    if name in started or not all(d in done for d in stage.deps):
+                        continue
+                    started.add(name)
+                    if only is not None and name not in only:
+                        done.add(name)
+                        continue
+                    entry = self.checkpoint(stage, force)
+                    if entry is not None:
+                        self._resume_stage(stage, entry)
+                        done.add(name)
+                        continue
+                    # 依存工程が終わった時点の入力で判断する
+                    why = self.reason(stage, force)
+                    if why is None:
+                        print(f"\n⏭  STAGE: {name} (skip: {'up to date' if stage.enabled() else stage.note})")
+                        done.add(name)
+                        continue
+                    futures[pool.submit(self._run_stage, stage, why)] = name
+                if not futures:
+                    continue
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    name = futures.pop(fut)
+                    try:
+                        fut.result()
+                    except Exception as e:
+                        raise SystemExit(f"❌ Stage failed: {name}: {e}") from e
+                    done.add(name)
+                    ran.append(name)
+        # 何も走らなかった実行でも、数えたハッシュは次の実行のために残す
+        self.hashes.save()
+        return ran
+
+
+def git_commit_and_push(message: str = "", push: bool = True) -> None:
+    # index.lock の取り合い・non-fast-forward の push は git_publish がやり直す
+    git_publish.commit_and_push(message, push=push)
+
+
+def build_stages(paths: BookPaths, ctx: dict, *, force_images: bool = False, concurrency: int = 1,
+                 pdf_workers: int = 1, stream_plan: bool = False,
+                 journal: RunJournal | None = None, tier: str = "final",
+                 page_count: int | None = None, force: set[str] = frozenset()) -> list[Stage]:
+    """
+    transcript → plan → images → assets → (pdf ∥ publish) → publish_pdf → shelf
+    stream_plan=True なら plan の段階でストリーミングで届いたページから画像生成を始める
+    （images の段階は残りの確認だけになる）。
+    journal を渡すと、文字起こしの区間・画像のページごとの完了も記録し、記録済みのものは作り直さない。
+    tier="draft" なら画像はプレビュー用の速い段階で作る（仕上げは refresh_pages で差し替える）。
+    page_count は plan で頼むページ数（既定は book_plan.PAGE_COUNT）。
+    force は --force で指定した工程名。その工程では journal の記録を使わずにやり直す。
+    """
+    streamed = []
+
+    def book_dir() -> Path:
+        return paths.books / ctx["book_id"]
+
+    def run_transcribe():
+        from transcribe import transcribe
+        transcribe(paths.audio, paths.transcript, journal=journal, force=bool({"transcribe", "all"} & force))
+
+    def run_plan():
+        if stream_plan:
+            from book_plan import make_plan_with_images
+            make_plan_with_images(paths.transcript, paths.plan, paths.prompt,
+                                  out_dir=paths.pages, force=force_images, concurrency=concurrency, journal=journal,
+                                  tier=tier, page_count=page_count)
+            streamed.append(True)
+            return
+        from book_plan import make_plan
+        make_plan(paths.transcript, paths.plan, paths.prompt, page_count=page_count)
+
+    def run_images():
+        from generate_images import generate_images
+        # plan と一緒に作った直後なら --force-images でもう一度作り直さない
+        generate_images(paths.plan, paths.pages, force=force_images and not streamed, concurrency=concurrency,
+                        journal=journal, tier=tier)
+
+    def draft_pages():
+        from generate_images import load_tiers
+        # --draft の仕上げが途中で止まった本を、通常の実行で仕上げる
+        if tier == "final" and any(t != tier for t in load_tiers(paths.pages).values()):
+            return DRAFT_PAGES
+        return None
+
+    def run_assets():
+        from derive_assets import derive_assets
+        derive_assets(paths.pages)
+
+    def run_pdf():
+        from make_pdf import build_pdf
+        build_pdf(paths.plan, paths.pages, paths.pdf, workers=pdf_workers)
+
+    def run_publish():
+        from publish_book import new_book_id, publish_assets
+        # 中身が変わったら新しい本として公開する（従来通り docs/books/<timestamp>/）
+        ctx["book_id"] = new_book_id(paths.books)
+        publish_assets(book_dir(), plan_path=paths.plan, pages_dir=paths.pages,
+                       prompt_path=paths.prompt, transcript_path=paths.transcript)
+        print("✅ Published book:", book_dir().as_posix())
+
+    def run_publish_pdf():
+        from publish_book import publish_pdf
+        publish_pdf(book_dir(), paths.pdf)
+
+    def run_shelf():
+        from build_shelf import build_shelf
+        build_shelf(paths.books, paths.index)
+
+    def published() -> list[Path]:
+        if not ctx.get("book_id"):
+            return [paths.books / "<unpublished>"]
+        d = book_dir()
+        return [d / "book_plan.json", d / "viewer.html", d / "details.html"] + [
+            d / sub for sub in ("pages", "web", "thumbs") if (d / sub).exists()
+        ]
+
+    return [
+        Stage("transcribe", [], lambda: [paths.audio], lambda: [paths.transcript], run_transcribe,
+              # 音声が無くて transcript が既にある場合はそれを使う（従来の pipeline と同じ）
+              enabled=lambda: paths.audio.exists() or not paths.transcript.exists(),
+              note="no audio input; using existing transcript"),
+        Stage("plan", ["transcribe"], lambda: [paths.transcript, paths.prompt], lambda: [paths.plan], run_plan),
+        Stage("images", ["plan"], lambda: [paths.plan], lambda: [paths.pages], run_images, stale=draft_pages),
+        Stage("assets", ["images"], lambda: [paths.pages], lambda: [paths.derived], run_assets),
+        Stage("pdf", ["assets"], lambda: [paths.plan, paths.pages, paths.derived], lambda: [paths.pdf], run_pdf),
+        Stage("publish", ["assets"],
+              lambda: [paths.plan, paths.pages, paths.derived, paths.prompt, paths.transcript], published, run_publish),
+        Stage("publish_pdf", ["pdf", "publish"], lambda: [paths.pdf],
+              lambda: [book_dir() / "book.pdf"] if ctx.get("book_id") else [paths.books / "<unpublished>"],
+              run_publish_pdf),
+        Stage("shelf", ["publish_pdf"],
+              lambda: sorted(paths.books.glob("*/book_plan.json")) + sorted(paths.books.glob("*/viewer.html")),
+              lambda: [paths.index, paths.catalog, paths.search], run_shelf),
+    ]
+
+
+def upgrade_drafts(pipeline: Pipeline, paths: BookPaths, ctx: dict, force: set[str], *, concurrency: int = 1,
+                   journal: RunJournal | None = None) -> list[int]:
+    """
+    公開済みの本にプレビュー用の画像が残っていたら（--draft の仕上げが途中で止まった）、
+    仕上げの画像を作ってそのページだけ refresh_pages でその場で差し替える。差し替えたページ番号を返す。
+    plan が変わった・まだ公開していないなどで images 以降を作り直すときは何もしない（通常の実行に任せる）。
+    """
+    from generate_images import generate_images
+
+    if not ctx.get("book_id") or not paths.pdf.exists():
+        return []
+    if pipeline.reason(pipeline.stages["images"], force) != DRAFT_PAGES:
+        return []
+    print("\n🎨 final images: upgrading the preview pages of the published book")
+    upgraded = sorted(generate_images(paths.plan, paths.pages, concurrency=concurrency, journal=journal,
+                                      tier="final"))
+    if upgraded:
+        refresh_pages(pipeline, paths, ctx, upgraded)
+    else:
+        pipeline.mark_done("images")
+    return upgraded
+
+
+def refresh_pages(pipeline: Pipeline, paths: BookPaths, ctx: dict, page_nums) -> None:
+    """
+    画像を差し替えたページ（page_nums）だけ、派生画像・PDF・公開済みの本をその場で更新する。
+    派生画像は元画像より新しくなったページだけ作り直され、PDF は該当ページだけ描き直してつなぎ替える。
+    公開済みの本は同じ book_id のまま（変わったファイルだけ置き換わる）。
+    更新した工程は「済み」と記録するので、次の実行で新しい本として公開し直されることはない。
+    """
+    from build_shelf import build_shelf
+    from derive_assets import derive_assets
+    from make_pdf import splice_pages
+    from publish_book import publish_assets, publish_pdf
+
+    pages = sorted(page_nums)
+    with tracing.span("refresh", cat="stage", pages=pages):
+        derive_assets(paths.pages)
+        splice_pages(paths.plan, paths.pages, paths.pdf, pages)
+        done = ["images", "assets", "pdf"]
+        if ctx.get("book_id"):
+            book_dir = paths.books / ctx["book_id"]
+            publish_assets(book_dir, plan_path=paths.plan, pages_dir=paths.pages,
+                           prompt_path=paths.prompt, transcript_path=paths.transcript)
+            publish_pdf(book_dir, paths.pdf)
+            build_shelf(paths.books, paths.index)
+            done += ["publish", "publish_pdf", "shelf"]
+            print(f"✅ Updated book in place: {book_dir.as_posix()} (pages {', '.join(map(str, pages))})")
+        for name in done:
+            pipeline.mark_done(name, pages=pages)
+
+
+def rebuild_pages(pipeline: Pipeline, paths: BookPaths, ctx: dict, page_nums, *, images: bool = True,
+                  concurrency: int = 1, journal: RunJournal | None = None) -> None:
+    """
+    --pages: 指定したページだけ画像を描き直し（images=False なら画像はそのまま＝文の直しだけ）、
+    PDF のそのページを描き直して差し込み、公開済みの本をその場で更新する。
+    book_plan.json を手で直した場合も、その直しを「済み」として記録する（plan は作り直さない）。
+    """
+    from generate_images import generate_images
+
+    if images:
+        generate_images(paths.plan, paths.pages, concurrency=concurrency, journal=journal, page_nums=page_nums)
+    pipeline.mark_done("plan", pages=sorted(page_nums))
+    refresh_pages(pipeline, paths, ctx, page_nums)
+
+
 def main():
     parser = argparse.ArgumentParser(description="End-to-end StoryBook pipeline")
+    parser.add_argument("--audio", type=Path, default=Path("input/test01.mp3"), help="Input recording")
     parser.add_argument("--force-images", action="store_true", help="Overwrite existing page PNGs")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of page images generated in parallel")
+    parser.add_argument("--pdf-workers", type=int, default=1, help="Processes used to render PDF pages")
+    parser.add_argument("--stream-plan", action="store_true",
+                        help="Stream the plan and start page images as soon as each page arrives")
+    parser.add_argument("--force", action="append", default=[], metavar="STAGE",
+                        help="Re-run a stage even if it is up to date (repeatable, or 'all')")
+    parser.add_argument("--jobs", type=int, default=2, help="Number of independent stages run in parallel")
+    parser.add_argument("--dry-run", action="store_true", help="Only show which stages would run and why")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run: keep every stage/page/chunk the run journal "
+                             "records as done (no paid API call is repeated)")
     parser.add_argument("--no-push", action="store_true", help="Do not git push (commit only)")
     parser.add_argument("--message", type=str, default="", help="Commit message override")
+    parser.add_argument("--publish-queue", action="store_true",
+                        help="Queue the book for a batched commit/push (see git_publish.py) instead of "
+                             "committing right away")
+    parser.add_argument("--window", type=float, default=git_publish.WINDOW,
+                        help="With --publish-queue: seconds the oldest queued book may wait")
+    parser.add_argument("--max-books", type=int, default=git_publish.MAX_BOOKS,
+                        help="With --publish-queue: commit as soon as this many books are queued")
+    parser.add_argument("--draft", action="store_true",
+                        help="Publish a preview with quick low-quality images first, then generate the final "
+                             "images in the background and update only those pages in place")
+    parser.add_argument("--pages", type=parse_pages, default=None,
+                        help="Only redo these pages of the current book (e.g. 3,7 or 3-5): new images, "
+                             "re-rendered PDF pages spliced into book.pdf, published book updated in place")
+    parser.add_argument("--keep-images", action="store_true",
+                        help="With --pages: keep the images and only re-render text (after editing book_plan.json)")
+    parser.add_argument("--trace", action="store_true",
+                        help="Write a Chrome/Perfetto trace of stages and pages to work/trace.json")
+    parser.add_argument("--profile", action="store_true",
+                        help="Run each stage under cProfile (work/profile/<stage>.prof); stages run one at a time")
     args = parser.parse_args()
 
-    # Safety: ensure scripts exist
-    required = [
-        "book_plan.py",
-        "generate_images.py",
-        "make_pdf.py",
-        "publish_book.py",
-        "build_shelf.py",
-    ]
-    missing = [f for f in required if not Path(f).exists()]
-    if missing:
-        raise SystemExit(f"❌ Missing files: {missing}")
-
-    # 1) plan
-    run([sys.executable, "book_plan.py"])
-
-    # 2) images
-    img_cmd = [sys.executable, "generate_images.py"]
+    tracing.record_startup()
+    paths = BookPaths(audio=args.audio)
+    force = set(args.force)
     if args.force_images:
-        img_cmd.append("--force")
-    run(img_cmd)
+        force.add("images")
+
+    ctx = {}
+    journal = RunJournal(paths.journal)
+    stages = build_stages(paths, ctx, force_images=args.force_images, concurrency=args.concurrency,
+                          pdf_workers=args.pdf_workers, stream_plan=args.stream_plan, journal=journal,
+                          tier="draft" if args.draft else "final", force=force)
+    # cProfile は同時に1つの工程だけにかける
+    pipeline = Pipeline(stages, paths.state, ctx, jobs=1 if args.profile else args.jobs, journal=journal,
+                        resume=args.resume, profile_dir=paths.profile if args.profile else None)
 
-    # 3) pdf
-    run([sys.executable, "make_pdf.py"])
+    if args.dry_run:
+        print("🟦 DRY RUN: stages")
+        pipeline.dry_run(force)
+        return
 
-    # 4) publish (create docs/books/<id>/...)
-    run([sys.executable, "publish_book.py"])
+    if args.pages:
+        if not paths.plan.exists() or not paths.pdf.exists():
+            raise SystemExit("❌ --pages は一度最後まで作った本に使います（book_plan.json / book.pdf がありません）")
+        rebuild_pages(pipeline, paths, ctx, args.pages, images=not args.keep_images,
+                      concurrency=args.concurrency, journal=journal)
+        ran = []
+    else:
+        upgraded = [] if args.draft else upgrade_drafts(pipeline, paths, ctx, force, concurrency=args.concurrency,
+                                                        journal=journal)
+        ran = pipeline.execute(force)
+        if upgraded and not args.message:
+            args.message = f"Update {len(upgraded)} pages of {ctx['book_id']} to final images"
+    print("\n🟦 stages run:", ", ".join(ran) if ran else "(none)")
 
-    # 5) rebuild shelf (docs/index.html)
-    run([sys.executable, "build_shelf.py"])
+    final = None
+    if args.draft:
+        # プレビューを公開している間に、仕上げの画像を裏で作る（output/pages だけを書き換える）
+        from generate_images import generate_images
+        print("\n🎨 final images: generating in the background")
+        final_pool = ThreadPoolExecutor(max_workers=1)
+        final = final_pool.submit(generate_images, paths.plan, paths.pages, concurrency=args.concurrency,
+                                  journal=journal, tier="final")
+        final_pool.shutdown(wait=False)
 
     # 6) git add/commit/push
-    # add only docs outputs (safer than git add -A)
-    run(["git", "add", "docs/index.html", "docs/books"])
+    def publish(message: str) -> None:
+        with tracing.span("git", cat="stage"):
+            if args.publish_queue:
+                if ctx.get("book_id"):
+                    git_publish.enqueue(ctx["book_id"])
+                git_publish.flush(window=args.window, max_books=args.max_books, push=not args.no_push)
+            else:
+                git_commit_and_push(message, push=not args.no_push)
 
-    # If nothing changed, git commit returns non-zero. Handle gently.
-    msg = args.message.strip()
-    if not msg:
-        msg = "Add new book " + datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if args.pages and not args.message:
+        publish(f"Update pages {', '.join(map(str, args.pages))} of {ctx.get('book_id', 'book')}")
+    else:
+        publish(args.message)
 
-    print("\n🟦 RUN: git commit -m ...")
-    p = subprocess.run(["git", "commit", "-m", msg], text=True)
-    if p.returncode != 0:
-        print("ℹ️ No changes to commit (or commit failed). Continuing...")
+    if final is not None:
+        with tracing.span("final images", cat="stage"):
+            upgraded = final.result()
+        if upgraded:
+            refresh_pages(pipeline, paths, ctx, upgraded)
+            publish(f"Update {len(upgraded)} pages of {ctx.get('book_id', 'book')} to final images")
+        else:
+            print("\nℹ️ All pages already have final images")
 
-    if not args.no_push:
-        run(["git", "push"])
+    print("\n⏱ time by stage:")
+    print(tracing.summary_table())
+    if args.trace:
+        print("🔎 trace:", tracing.write_chrome_trace(paths.trace).as_posix())
 
     print("\n✅ Pipeline complete!")
 
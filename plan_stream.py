@@ -0,0 +1,96 @@
+"""
+ストリーミングで届く book_plan の JSON を少しずつ読み、pages の各ページが
+閉じた時点で取り出す（plan 全体が届くのを待たずに画像生成を始めるため）。
+
+    parser = PlanStreamParser()
+    for delta in deltas:
+        for page in parser.feed(delta):
+            ...                       # pages[] の要素（dict）が1つ完成するたびに届く
+    plan = parser.result()            # 全体を json.loads した結果（途中と同じ内容）
+
+トップレベルの値（title, style_bible など）は、値が閉じた時点で parser.fields に入る。
+"""
+import json
+
+
+class PlanStreamParser:
+    def __init__(self, array_key: str = "pages"):
+        self.array_key = array_key
+        self.fields: dict = {}
+        self.pages: list[dict] = []
+        self._text = ""
+        self._i = 0
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._str_start = 0
+        self._expect_key = False
+        self._key = None
+        self._value_start = None
+        self._container = False
+        self._item_start = None
+        self.done = False
+
+    def feed(self, chunk: str) -> list[dict]:
+        """chunk を足して、新しく完成した pages の要素を返す。"""
+        self._text += chunk
+        text = self._text
+        new = []
+        for i in range(self._i, len(text)):
+            ch = text[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                    if self._depth == 1 and self._expect_key:
+                        self._key = json.loads(text[self._str_start:i + 1])
+                continue
+
+            if ch == '"':
+                self._in_str = True
+                self._str_start = i
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect_key = True
+                elif self._depth == 2:
+                    self._container = True
+                elif self._depth == 3 and ch == "{" and self._key == self.array_key:
+                    self._item_start = i
+            elif ch in "}]":
+                if self._depth == 3 and self._item_start is not None:
+                    page = json.loads(text[self._item_start:i + 1])
+                    self.pages.append(page)
+                    new.append(page)
+                    self._item_start = None
+                elif self._depth == 2 and self._key != self.array_key:
+                    self.fields[self._key] = json.loads(text[self._value_start:i + 1])
+                elif self._depth == 1:
+                    self._end_scalar(text, i)
+                    self.done = True
+                self._depth -= 1
+            elif self._depth == 1:
+                if ch == ":":
+                    self._expect_key = False
+                    self._container = False
+                    self._value_start = i + 1
+                elif ch == ",":
+                    self._end_scalar(text, i)
+                    self._expect_key = True
+        self._i = len(text)
+        return new
+
+    def _end_scalar(self, text: str, end: int) -> None:
+        """トップレベルの文字列・数値などの値が ',' か '}' で閉じたら fields に入れる。"""
+        if self._key is None or self._container or self._value_start is None:
+            return
+        raw = text[self._value_start:end].strip()
+        if raw:
+            self.fields[self._key] = json.loads(raw)
+        self._value_start = None
+
+    def result(self) -> dict:
+        return json.loads(self._text)
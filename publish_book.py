@@ -1,9 +1,14 @@
+import argparse
+import hashlib
 import json
+import os
 import shutil
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 from pathlib import Path
 
-print("publish_book.py started")
+from derive_assets import fresh_variant, load_sources
+from fileutil import HashCache, atomic_write_bytes, link_or_copy
 
 # Sources
 SRC_PLAN = Path("work/book_plan.json")
@@ -15,10 +20,30 @@ SRC_TRANSCRIPT = Path("work/transcript.txt")
 # Destinations
 DOCS_DIR = Path("docs")
 BOOKS_DIR = DOCS_DIR / "books"
+ASSETS_DIR = DOCS_DIR / "assets"          # 中身のハッシュ名で1つずつ保存するストア
+BOOK_INDEX = ASSETS_DIR / "books.json"    # 本の中身のハッシュ → book_id
+HASH_CACHE = Path("work/.hash_cache.json")
 
-def timestamp_id():
+_index_lock = threading.Lock()
+
+def timestamp_id(now: datetime | None = None):
     # 例: 20260216_142233
-    return datetime.now().strftime("%Y%m%d_%H%M%S")
+    return (now or datetime.now()).strftime("%Y%m%d_%H%M%S")
+
+def new_book_id(books_dir: Path = BOOKS_DIR) -> str:
+    """
+    まだ使われていない book_id を確保して返す（ディレクトリを作って予約する）。
+    同じ秒に複数の本が公開されたら1秒ずつずらす（本棚の日付ソートが崩れないように）。
+    """
+    books_dir.mkdir(parents=True, exist_ok=True)
+    now = datetime.now()
+    while True:
+        book_id = timestamp_id(now)
+        try:
+            (books_dir / book_id).mkdir()
+            return book_id
+        except FileExistsError:
+            now += timedelta(seconds=1)
 
 VIEWER_HTML_TEMPLATE = """<!doctype html>
 <html lang="ja">
@@ -26,6 +51,7 @@ VIEWER_HTML_TEMPLATE = """<!doctype html>
   <meta charset="utf-8" />
   <meta name="viewport" content="width=device-width,initial-scale=1" />
   <title>{title}</title>
+  <link rel="preload" as="image" href="{first_img}" />
   <style>
     body{{font-family:system-ui,-apple-system,"Segoe UI",sans-serif;margin:0;background:#f6f6f6}}
     header{{padding:16px 20px;background:#fff;border-bottom:1px solid #eee;display:flex;gap:12px;align-items:center;flex-wrap:wrap}}
@@ -52,6 +78,7 @@ VIEWER_HTML_TEMPLATE = """<!doctype html>
       <a id="pdfLink" href="book.pdf" target="_blank" rel="noreferrer">PDFを開く</a>
       <a href="details.html">詳細</a>
       <a href="../../index.html">本棚へ戻る</a>
+      <span class="meta" id="tierInfo"></span>
     </div>
   </header>
 
@@ -65,8 +92,20 @@ VIEWER_HTML_TEMPLATE = """<!doctype html>
     </section>
   </main>
 
+  <script type="application/json" id="planData">{plan_json}</script>
   <script>
     const state = {{ plan: null, idx: 0 }};
+    const IMG_DIR = '{img_dir}', IMG_EXT = '{img_ext}';
+    // URL に plan の中身のハッシュが入っているので、ブラウザのキャッシュをそのまま使ってよい
+    const PLAN_URL = '{plan_url}';
+    // 前後のページ画像を先に読んでおく（次へ / 前へ を押したときに待たない）
+    const PREFETCH = [1, -1, 2];
+    const imgCache = new Map();
+    // ページ画像の中身のハッシュ（URL に付けるので、差し替わったページだけ読み直される）
+    const versions = {versions_json};
+    // まだプレビュー（draft）の画像のページ。仕上がったら manifest.json から差し替える
+    let drafts = new Set({drafts_json});
+    const REFRESH_MS = 20000;
 
     const el = {{
       title: document.getElementById('title'),
@@ -80,6 +119,43 @@ VIEWER_HTML_TEMPLATE = """<!doctype html>
 
     function pad2(n){{ return String(n).padStart(2,'0'); }}
 
+    function imgUrl(i){{
+      const n = pad2(state.plan.pages[i].page);
+      return `${{IMG_DIR}}/${{n}}${{IMG_EXT}}` + (versions[n] ? `?v=${{versions[n]}}` : '');
+    }}
+
+    function showTier(){{
+      document.getElementById('tierInfo').textContent =
+        drafts.size ? `プレビュー画像（仕上げ中: 残り ${{drafts.size}} ページ）` : '';
+    }}
+
+    async function refresh(){{
+      const res = await fetch('manifest.json', {{ cache: 'no-store' }});
+      if(!res.ok) return;
+      const manifest = await res.json();
+      state.plan.pages.forEach((p, i) => {{
+        const n = pad2(p.page);
+        const url = (manifest.files || {{}})[`${{IMG_DIR}}/${{n}}${{IMG_EXT}}`];
+        const v = url ? url.split('/').pop().split('.')[0].slice(0, 12) : versions[n];
+        if(v === versions[n]) return;
+        versions[n] = v;
+        imgCache.delete(i);
+        if(i === state.idx) el.pageImg.src = imgUrl(i);
+      }});
+      const tiers = manifest.tiers || {{}};
+      drafts = new Set([...drafts].filter(n => tiers[n] === 'draft'));
+      showTier();
+      if(drafts.size) setTimeout(() => refresh().catch(() => {{}}), REFRESH_MS);
+    }}
+
+    function prefetch(i){{
+      if(i < 0 || i >= state.plan.pages.length || imgCache.has(i)) return;
+      const img = new Image();
+      img.src = imgUrl(i);
+      img.decode().catch(() => {{}});
+      imgCache.set(i, img);
+    }}
+
     function render(){{
       const pages = state.plan.pages;
       const p = pages[state.idx];
@@ -88,18 +164,27 @@ VIEWER_HTML_TEMPLATE = """<!doctype html>
       el.title.textContent = state.plan.title || '{title}';
       el.pageInfo.textContent = `${{p.page}}/${{total}}`;
 
-      el.pageImg.src = `pages/${{pad2(p.page)}}.png`;
+      el.pageImg.src = imgUrl(state.idx);
       el.pageText.textContent = p.text || '';
       el.scene.textContent = p.scene_summary ? `Scene: ${{p.scene_summary}}` : '';
 
       el.prev.disabled = state.idx === 0;
       el.next.disabled = state.idx === total - 1;
+
+      for(const d of PREFETCH) prefetch(state.idx + d);
     }}
 
-    async function init(){{
-      const res = await fetch('book_plan.json', {{ cache: 'no-store' }});
+    async function loadPlan(){{
+      // publish 時に埋め込んだ plan があれば追加の通信なし
+      const inline = document.getElementById('planData').textContent.trim();
+      if(inline) return JSON.parse(inline);
+      const res = await fetch(PLAN_URL);
       if(!res.ok) throw new Error('book_plan.json が読めません');
-      state.plan = await res.json();
+      return await res.json();
+    }}
+
+    async function init(){{
+      state.plan = await loadPlan();
       state.idx = 0;
 
       window.addEventListener('keydown', (e) => {{
@@ -111,6 +196,8 @@ VIEWER_HTML_TEMPLATE = """<!doctype html>
       el.next.addEventListener('click', () => {{ state.idx++; render(); }});
 
       render();
+      showTier();
+      if(drafts.size) setTimeout(() => refresh().catch(() => {{}}), REFRESH_MS);
     }}
 
     init().catch(err => {{
@@ -197,51 +284,246 @@ DETAILS_HTML_TEMPLATE = """<!doctype html>
 
 
 
-def main():
-    BOOKS_DIR.mkdir(parents=True, exist_ok=True)
-
-    # 入力チェック
-    if not SRC_PLAN.exists():
-        raise FileNotFoundError("work/book_plan.json が見つかりません")
-    if not SRC_PDF.exists():
-        raise FileNotFoundError("output/book.pdf が見つかりません")
-    if not SRC_PAGES_DIR.exists():
-        raise FileNotFoundError("output/pages が見つかりません")
+class AssetStore:
+    """
+    中身のハッシュで名前を付けて docs/assets/<先頭2文字>/<sha256><拡張子> に1つだけ保存する。
+    本のディレクトリにはそこへのハードリンクを置く（同じ画像が何冊にあってもディスク上は1つ）。
+    ストアへはコピーで入れるので、作業ファイルを後で書き換えてもストアは壊れない。
+    """
+
+    def __init__(self, root: Path = ASSETS_DIR, hashes: HashCache | None = None):
+        self.root = root
+        self.hashes = hashes or HashCache(HASH_CACHE)
+        self.stats = {"stored": 0, "reused": 0, "linked": 0, "copied": 0, "unchanged": 0}
+
+    def blob_path(self, digest: str, suffix: str) -> Path:
+        return self.root / digest[:2] / f"{digest}{suffix}"
+
+    def put(self, src: Path) -> Path:
+        """src をストアに入れ（既にあれば何もしない）、ストア内のパスを返す。"""
+        blob = self.blob_path(self.hashes.sha256(src), src.suffix)
+        if blob.exists():
+            self.stats["reused"] += 1
+            return blob
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp = blob.with_name(f"{blob.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.copy2(src, tmp)
+        os.replace(tmp, blob)
+        self.stats["stored"] += 1
+        return blob
+
+    def place(self, src: Path, dst: Path) -> Path:
+        """src の中身を dst に置く（ストア経由のハードリンク。同じものが既にあれば何もしない）。"""
+        blob = self.put(src)
+        if dst.exists() and os.path.samefile(blob, dst):
+            self.stats["unchanged"] += 1
+        elif link_or_copy(blob, dst) == "link":
+            self.stats["linked"] += 1
+        else:
+            self.stats["copied"] += 1
+        return blob
+
+    def url(self, blob: Path, docs_dir: Path = DOCS_DIR) -> str:
+        return blob.relative_to(docs_dir).as_posix()
+
+
+def collect_files(*, plan_path: Path = SRC_PLAN, pages_dir: Path = SRC_PAGES_DIR, prompt_path: Path = SRC_PROMPT,
+                  transcript_path: Path = SRC_TRANSCRIPT, with_originals: bool = False) -> tuple[dict, bool]:
+    """
+    公開するファイルの {本の中での相対パス: 元ファイル} と、web 画像を使うかどうかを返す。
+    derive_assets.py の web / thumb 画像があればそれを web/, thumbs/ に置き、元の PNG は
+    with_originals=True のときだけ置く（無ければ従来通り pages/ に PNG）。
+    """
+    files = {"book_plan.json": plan_path}
+
+    originals = sorted(pages_dir.glob("*.png"))
+    sources = load_sources(pages_dir)
+    web = [fresh_variant(pages_dir, "web", int(img.stem), sources) for img in originals]
+    use_web = bool(originals) and all(web)
+    if use_web:
+        for src in web:
+            files[f"web/{src.name}"] = src
+        for img in originals:
+            thumb = fresh_variant(pages_dir, "thumb", int(img.stem), sources)
+            if thumb:
+                files[f"thumbs/{thumb.name}"] = thumb
+
+    if with_originals or not use_web:
+        for img in originals:
+            files[f"pages/{img.name}"] = img
 
-    plan = json.loads(SRC_PLAN.read_text(encoding="utf-8"))
+    # prompt / transcript も一緒に保存（存在する場合）
+    if prompt_path.exists():
+        files["prompt.txt"] = prompt_path
+    if transcript_path.exists():
+        files["transcript.txt"] = transcript_path
+    return files, use_web
+
+
+def content_hash(entries: dict) -> str:
+    """{相対パス: sha256} から本全体の中身のハッシュを作る。"""
+    h = hashlib.sha256()
+    for rel in sorted(entries):
+        h.update(f"{rel}\0{entries[rel]}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _load_manifest(book_dir: Path) -> dict:
+    path = book_dir / "manifest.json"
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return {"files": {}}
+
+
+def _save_manifest(book_dir: Path, manifest: dict, store: AssetStore) -> None:
+    digests = {rel: Path(url).stem for rel, url in manifest["files"].items()}
+    manifest["content_hash"] = content_hash(digests)
+    atomic_write_bytes(book_dir / "manifest.json",
+                       json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode("utf-8"))
+    store.hashes.save()
+
+
+def _load_index() -> dict:
+    return json.loads(BOOK_INDEX.read_text(encoding="utf-8")) if BOOK_INDEX.exists() else {}
+
+
+def published_copy(files: dict, hashes: HashCache, books_dir: Path = BOOKS_DIR) -> str | None:
+    """まったく同じ中身の本が既に公開済みならその book_id を返す。"""
+    digest = content_hash({rel: hashes.sha256(src) for rel, src in files.items()})
+    book_id = _load_index().get(digest)
+    if book_id and (books_dir / book_id / "viewer.html").exists():
+        return book_id
+    return None
+
+
+def publish_assets(book_dir: Path, *, plan_path: Path = SRC_PLAN, pages_dir: Path = SRC_PAGES_DIR,
+                   prompt_path: Path = SRC_PROMPT, transcript_path: Path = SRC_TRANSCRIPT,
+                   with_originals: bool = False, inline_plan: bool = True,
+                   store: AssetStore | None = None) -> Path:
+    """
+    PDF 以外（plan / ページ画像 / prompt / transcript / viewer.html / details.html）を book_dir に置く。
+    ファイルの実体は AssetStore に1つだけ持ち、book_dir にはハードリンクと manifest.json を書く。
+    inline_plan=True なら viewer.html に plan を埋め込む（viewer を開くのに通信が1回で済む）。
+    """
+    if not plan_path.exists():
+        raise FileNotFoundError(f"{plan_path.as_posix()} が見つかりません")
+    if not pages_dir.exists():
+        raise FileNotFoundError(f"{pages_dir.as_posix()} が見つかりません")
+
+    plan = json.loads(plan_path.read_text(encoding="utf-8"))
     title = (plan.get("title", "StoryBook") or "StoryBook").strip()
 
-    book_id = timestamp_id()
-    dst_dir = BOOKS_DIR / book_id
-    dst_pages = dst_dir / "pages"
-    dst_dir.mkdir(parents=True, exist_ok=True)
-    dst_pages.mkdir(parents=True, exist_ok=True)
-
-    # コピー
-    shutil.copy2(SRC_PLAN, dst_dir / "book_plan.json")
-    shutil.copy2(SRC_PDF, dst_dir / "book.pdf")
-
-    for img in sorted(SRC_PAGES_DIR.glob("*.png")):
-        shutil.copy2(img, dst_pages / img.name)
-
-    # prompt / transcript も一緒に保存（存在する場合）
-    if SRC_PROMPT.exists():
-        shutil.copy2(SRC_PROMPT, dst_dir / "prompt.txt")
-    if SRC_TRANSCRIPT.exists():
-        shutil.copy2(SRC_TRANSCRIPT, dst_dir / "transcript.txt")
+    book_dir.mkdir(parents=True, exist_ok=True)
+    store = store or AssetStore()
+    files, use_web = collect_files(plan_path=plan_path, pages_dir=pages_dir, prompt_path=prompt_path,
+                                   transcript_path=transcript_path, with_originals=with_originals)
+
+    manifest = _load_manifest(book_dir)
+    # files は今回集めたものから作り直す（book.pdf は publish_pdf が管理する）。前回はあって今回は無い
+    # ファイル（web 画像に切り替えたあとの pages/*.png など）は、manifest からも本のディレクトリからも外す
+    old = manifest["files"]
+    manifest["files"] = {rel: url for rel, url in old.items() if rel == "book.pdf"}
+    for rel, src in files.items():
+        manifest["files"][rel] = store.url(store.place(src, book_dir / rel))
+    for rel in old.keys() - manifest["files"].keys():
+        (book_dir / rel).unlink(missing_ok=True)
+    # 画像の段階（draft / final）。viewer は draft のページが残っている間だけ manifest を見に来る
+    from generate_images import load_tiers
+    manifest["tiers"] = load_tiers(pages_dir)
 
     # viewer.html
-    (dst_dir / "viewer.html").write_text(
-        VIEWER_HTML_TEMPLATE.format(title=title),
+    img_dir, img_ext = ("web", ".webp") if use_web else ("pages", ".png")
+    pages = plan.get("pages") or [{"page": 1}]
+    versions = {rel[len(img_dir) + 1:-len(img_ext)]: Path(url).stem[:12]
+                for rel, url in manifest["files"].items() if rel.startswith(f"{img_dir}/")}
+    drafts = sorted(n for n, tier in manifest["tiers"].items() if tier == "draft")
+    first = f"{int(pages[0].get('page', 1)):02d}"
+    plan_json = json.dumps(plan, ensure_ascii=False, separators=(",", ":")).replace("<", "\\u003c")
+    (book_dir / "viewer.html").write_text(
+        VIEWER_HTML_TEMPLATE.format(
+            title=title,
+            img_dir=img_dir,
+            img_ext=img_ext,
+            first_img=f"{img_dir}/{first}{img_ext}" + (f"?v={versions[first]}" if first in versions else ""),
+            plan_url=f"book_plan.json?v={Path(manifest['files']['book_plan.json']).stem[:12]}",
+            plan_json=plan_json if inline_plan else "",
+            versions_json=json.dumps(versions, sort_keys=True),
+            drafts_json=json.dumps(drafts),
+        ),
         encoding="utf-8",
     )
 
     # details.html
-    (dst_dir / "details.html").write_text(
+    (book_dir / "details.html").write_text(
         DETAILS_HTML_TEMPLATE,
         encoding="utf-8",
     )
 
+    _save_manifest(book_dir, manifest, store)
+    print(f"   assets: {store.stats}")
+    return book_dir
+
+def publish_pdf(book_dir: Path, pdf_path: Path = SRC_PDF, store: AssetStore | None = None) -> Path:
+    if not pdf_path.exists():
+        raise FileNotFoundError(f"{pdf_path.as_posix()} が見つかりません")
+    book_dir.mkdir(parents=True, exist_ok=True)
+    store = store or AssetStore()
+
+    manifest = _load_manifest(book_dir)
+    manifest["files"]["book.pdf"] = store.url(store.place(pdf_path, book_dir / "book.pdf"))
+    _save_manifest(book_dir, manifest, store)
+
+    # 中身 → book_id の索引（同じ本をもう一度公開しようとしたときに検出する）
+    with _index_lock:
+        index = _load_index()
+        index[manifest["content_hash"]] = book_dir.name
+        atomic_write_bytes(BOOK_INDEX, json.dumps(index, indent=2, sort_keys=True).encode("utf-8"))
+    return book_dir / "book.pdf"
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish output/ as a book under docs/books")
+    parser.add_argument("--update", metavar="BOOK_ID", default=None,
+                        help="Update this published book in place (only changed files are replaced)")
+    args = parser.parse_args()
+
+    print("publish_book.py started")
+    BOOKS_DIR.mkdir(parents=True, exist_ok=True)
+
+    # 入力チェック
+    if not SRC_PLAN.exists():
+        raise FileNotFoundError("work/book_plan.json が見つかりません")
+    if not SRC_PDF.exists():
+        raise FileNotFoundError("output/book.pdf が見つかりません")
+    if not SRC_PAGES_DIR.exists():
+        raise FileNotFoundError("output/pages が見つかりません")
+
+    store = AssetStore()
+    if args.update:
+        dst_dir = BOOKS_DIR / args.update
+        if not (dst_dir / "viewer.html").exists():
+            raise FileNotFoundError(f"公開済みの本がありません: {dst_dir.as_posix()}")
+        publish_assets(dst_dir, store=store)
+        publish_pdf(dst_dir, store=store)
+        print("✅ Updated book in place:")
+        print("   id:", args.update)
+        print("   path:", dst_dir.as_posix())
+        return
+
+    files, _ = collect_files()
+    files["book.pdf"] = SRC_PDF
+    existing = published_copy(files, store.hashes)
+    if existing:
+        store.hashes.save()
+        print("✅ Already published (unchanged):")
+        print("   id:", existing)
+        print("   path:", (BOOKS_DIR / existing).as_posix())
+        return
+
+    book_id = new_book_id(BOOKS_DIR)
+    dst_dir = BOOKS_DIR / book_id
+    publish_assets(dst_dir, store=store)
+    publish_pdf(dst_dir, store=store)
+
     print("✅ Published book:")
     print("   id:", book_id)
     print("   path:", dst_dir.as_posix())
@@ -0,0 +1,181 @@
+"""
+book_plan の検査（book_plan.validate_plan）で見つかった問題を、問題のあるページだけモデルに聞き直して直す。
+plan 全体は作り直さないので、直さなくてよいページの文・画像はそのまま使える。
+
+    python repaire_details.py            # work/book_plan.json を検査し、問題があれば直して保存
+    python repaire_details.py --check    # 検査だけ（問題があれば終了コード 1）
+
+- page の型・並び・番号の振り直しなど、聞かなくても直せるものはその場で直す
+- 足りないページ・項目が欠けたページ・文が PDF の枠に入らないページだけを、元のプロンプトと今の plan を
+  添えて聞き直す（応答は直したページだけなので、出力は plan 全体の数分の1）
+- ページが多すぎるときは、PAGE_COUNT ページ目に残りをまとめてもらう
+- MAX_ROUNDS 回聞き直しても直らなければ RuntimeError（画像を作り始める前に止める）
+"""
+import argparse
+import json
+from pathlib import Path
+
+import book_plan
+from api_client import call_api, get_client
+from book_plan import OUT_PATH, plan_request, save_plan, validate_plan
+
+MAX_ROUNDS = 2
+
+REPAIR_PROMPT = """
+
+---
+上の指示で作った絵本の構成（JSON）の一部のページに問題がありました。
+
+今の構成:
+{plan}
+
+問題:
+{problems}
+
+page が {pages} のページだけを、前後のページと話がつながるように書き直してください。
+- 各ページの項目（page / text / scene_summary / image_prompt_api など）は他のページと同じ形にそろえる
+- text は絵本の PDF の枠に入るよう {max_lines} 行（1行 {line_chars} 文字くらい）までにする
+{merge}出力は {{"pages": [...]}} の形の JSON だけにしてください（pages には書き直したページだけを入れる）。
+"""
+
+
+def normalize(data: dict, page_count: int) -> dict:
+    """モデルに聞かなくても直せるもの（page の型・並び・番号の振り直し）を直す。"""
+    pages = [p for p in data.get("pages") or [] if isinstance(p, dict)]
+    for p in pages:
+        try:
+            p["page"] = int(p.get("page"))
+        except (TypeError, ValueError):
+            p["page"] = None
+    nums = [p["page"] for p in pages]
+    if sorted(n for n in nums if n is not None) == list(range(1, len(pages) + 1)):
+        pages.sort(key=lambda p: p["page"])
+    elif len(pages) == page_count:
+        # ページ数は合っていて番号だけがおかしい（0 始まり・重複など）ので、並び順で振り直す
+        print("🔧 plan: page を並び順に 1 から振り直します")
+        for i, p in enumerate(pages, 1):
+            p["page"] = i
+    else:
+        # 番号の無いページ・重複したページは捨てて、足りないページとして聞き直す
+        by_num = {}
+        for p in pages:
+            if p["page"] is not None and p["page"] > 0:
+                by_num.setdefault(p["page"], p)
+        pages = [by_num[n] for n in sorted(by_num)]
+    data["pages"] = pages
+    return data
+
+
+def broken_pages(data: dict, problems: list[tuple[int | None, str]], page_count: int) -> list[int]:
+    """聞き直すページ番号。ページが多すぎるときは page_count ページ目（残りをまとめてもらう）。"""
+    pages = {n for n, _ in problems if n is not None}
+    if len(data.get("pages", [])) > page_count:
+        pages.add(page_count)
+    return sorted(pages)
+
+
+def _ask(client, request: dict, data: dict, problems: list, pages: list[int], page_count: int) -> list[dict]:
+    from make_pdf import FONT_SIZE, MAX_TEXT_LINES, TEXT_AREA_W
+
+    extra = [p["page"] for p in data["pages"] if p["page"] > page_count]
+    merge = ""
+    if extra:
+        merge = (f"- page {page_count} には page {', '.join(map(str, extra))} の内容もまとめ、"
+                 f"全体を {page_count} ページにする\n")
+    prompt = REPAIR_PROMPT.format(
+        plan=json.dumps(data, ensure_ascii=False, indent=2),
+        problems="\n".join(f"- page {n}: {msg}" if n else f"- {msg}" for n, msg in problems),
+        pages=", ".join(map(str, pages)),
+        max_lines=MAX_TEXT_LINES,
+        line_chars=int(TEXT_AREA_W // FONT_SIZE),
+        merge=merge,
+    )
+    resp = call_api("responses", lambda: client.responses.create(**{**request, "input": request["input"] + prompt}),
+                    label=f"book_plan repair (pages {', '.join(map(str, pages))})")
+    try:
+        fixed = json.loads(resp.output_text)
+    except json.JSONDecodeError:
+        return []
+    return [p for p in fixed.get("pages", []) if isinstance(p, dict)] if isinstance(fixed, dict) else []
+
+
+def merge_pages(data: dict, fixed: list[dict], pages: list[int], page_count: int) -> list[int]:
+    """聞き直したページのうち頼んだ番号のものだけを差し替え（足し）、差し替えたページ番号を返す。"""
+    by_num = {p["page"]: p for p in data["pages"]}
+    replaced = []
+    for p in fixed:
+        try:
+            n = int(p.get("page"))
+        except (TypeError, ValueError):
+            continue
+        if n in pages:
+            by_num[n] = {**p, "page": n}
+            replaced.append(n)
+    if page_count in replaced:
+        # まとめてもらった残りのページは捨てる
+        by_num = {n: p for n, p in by_num.items() if n <= page_count}
+    data["pages"] = [by_num[n] for n in sorted(by_num)]
+    if "page_count" in data:
+        data["page_count"] = len(data["pages"])
+    return sorted(replaced)
+
+
+def repair_plan(data, request: dict | None = None, *, client=None, page_count: int | None = None,
+                max_rounds: int = MAX_ROUNDS) -> dict:
+    """
+    plan を検査し、問題があれば直した plan を返す（問題が無ければそのまま。API も呼ばない）。
+    request は plan を作ったときの Responses API のリクエスト（plan_request）。聞き直すときに使う。
+    """
+    # 既定値は呼ばれたときの book_plan.PAGE_COUNT（import 時の値を持ち続けない）
+    page_count = page_count or book_plan.PAGE_COUNT
+    if not isinstance(data, dict) or not isinstance(data.get("pages"), list) or not data["pages"]:
+        raise RuntimeError("book_plan に pages がありません（plan 全体を作り直してください）")
+    problems = validate_plan(data, page_count)
+    if not problems:
+        return data
+
+    data = normalize(data, page_count)
+    for round_ in range(1, max_rounds + 1):
+        problems = validate_plan(data, page_count)
+        pages = broken_pages(data, problems, page_count)
+        if not problems or not pages:
+            break
+        print(f"🔧 plan: {len(problems)} problems; asking again for pages {', '.join(map(str, pages))} "
+              f"(round {round_}/{max_rounds})")
+        for n, msg in problems:
+            print(f"   - {f'page {n}: ' if n else ''}{msg}")
+        client = client or get_client()
+        request = request or plan_request(page_count=page_count)
+        replaced = merge_pages(data, _ask(client, request, data, problems, pages, page_count), pages, page_count)
+        print(f"   replaced pages: {', '.join(map(str, replaced)) or '(none)'}")
+
+    problems = validate_plan(data, page_count)
+    if problems:
+        raise RuntimeError("book_plan の問題が直りませんでした:\n"
+                           + "\n".join(f"- {f'page {n}: ' if n else ''}{msg}" for n, msg in problems))
+    print(f"✅ plan repaired ({len(data['pages'])} pages)")
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate work/book_plan.json and re-ask only for broken pages")
+    parser.add_argument("--plan", type=Path, default=OUT_PATH)
+    parser.add_argument("--page-count", type=int, default=None,
+                        help=f"Expected number of pages (default {book_plan.PAGE_COUNT})")
+    parser.add_argument("--check", action="store_true", help="Only report problems (exit 1 if any)")
+    args = parser.parse_args()
+
+    data = json.loads(args.plan.read_text(encoding="utf-8"))
+    problems = validate_plan(data, args.page_count)
+    for n, msg in problems:
+        print(f"❌ {f'page {n}: ' if n else ''}{msg}")
+    if not problems:
+        print(f"✅ {args.plan.as_posix()}: no problems")
+        return
+    if args.check:
+        raise SystemExit(1)
+    save_plan(repair_plan(data, page_count=args.page_count), args.plan)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+本棚の全文検索用インデックス（サーバー無しでブラウザから引ける静的 JSON）。
+
+- 対象: title, characters[].name / description, pages[].text
+- 分かち書き: 日本語（かな・漢字）は文字 bigram（＋並びの最後の1文字）、英数字は単語
+- 転置インデックス: 語 → 本の番号（catalog と同じ古い順の通し番号）のリスト（差分で保存）
+- 分割: 語の先頭1文字で SHARDS 個のファイル（search/s-XX.json）に分ける。
+  1語の検索で読むのは1ファイルだけで、1文字の検索や英単語の前方一致も同じファイル内で済む
+
+本は古い順に番号を振るので、新しい本が増えたときは、その本の語を含むファイルだけ書き足せばよい。
+"""
+import argparse
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from pathlib import Path
+
+from fileutil import atomic_write_bytes
+
+SEARCH_NAME = "search"
+SHARDS = 256
+
+# かな・カタカナ（ー含む）・漢字の並び / 英数字の並び（NFKC + 小文字化した後で使う）
+_TOKEN_RE = re.compile(r"[ぁ-ヿ㐀-䶿一-鿿豈-﫿]+|[0-9a-zà-ɏ]+")
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def _grams(run: str) -> list[str]:
+    """英数字の単語と1文字の日本語はそのまま、それ以外の日本語は bigram にする。"""
+    if _is_word(run) or len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def _index_grams(run: str) -> list[str]:
+    """
+    インデックスに入れる語。日本語は bigram に加えて最後の1文字も入れる。
+    こうするとどの文字もどれかの語の先頭になり、1文字の検索を前方一致で引ける。
+    """
+    grams = _grams(run)
+    if not _is_word(run) and len(run) > 1:
+        grams.append(run[-1])
+    return grams
+
+
+def _is_word(term: str) -> bool:
+    return term[0] <= "ɏ"
+
+
+def tokenize(text: str) -> set[str]:
+    terms = set()
+    for m in _TOKEN_RE.finditer(normalize(text)):
+        terms.update(_index_grams(m.group()))
+    return terms
+
+
+def book_terms(plan: dict) -> set[str]:
+    texts = [plan.get("title", "")]
+    for c in plan.get("characters", []):
+        texts += [c.get("name", ""), c.get("description", "")]
+    texts += [p.get("text", "") for p in plan.get("pages", [])]
+    terms = set()
+    for t in texts:
+        terms |= tokenize(t)
+    return terms
+
+
+def shard_of(term: str) -> str:
+    return f"{ord(term[0]) % SHARDS:02x}"
+
+
+def _encode(postings: dict[str, list[int]]) -> bytes:
+    """{語: [番号の差分...]} を小さな JSON にする（語順も固定して中身のハッシュを安定させる）。"""
+    enc = {}
+    for term in sorted(postings):
+        nums = postings[term]
+        enc[term] = [b - a for a, b in zip([0] + nums, nums)]
+    return json.dumps(enc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _decode(data: bytes) -> dict[str, list[int]]:
+    postings = {}
+    for term, deltas in json.loads(data).items():
+        n, nums = 0, []
+        for d in deltas:
+            n += d
+            nums.append(n)
+        postings[term] = nums
+    return postings
+
+
+def _write_shard(out_dir: Path, name: str, data: bytes, old_digest: str | None) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    path = out_dir / f"s-{name}.json"
+    if digest != old_digest or not path.exists():
+        atomic_write_bytes(path, data)
+    return digest
+
+
+def _append_shard(out_dir: Path, name: str, postings: dict[str, list[int]]) -> str:
+    """既存のファイルに番号を書き足す（差分のまま扱い、全体は復元しない）。"""
+    enc = json.loads((out_dir / f"s-{name}.json").read_bytes())
+    for term, nums in postings.items():
+        deltas = enc.setdefault(term, [])
+        last = sum(deltas)
+        deltas.extend(b - a for a, b in zip([last] + nums, nums))
+    data = json.dumps(dict(sorted(enc.items())), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return _write_shard(out_dir, name, data, None)
+
+
+def _read_plan(plan_path: Path) -> dict:
+    try:
+        return json.loads(plan_path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def build_search_index(books: list[tuple[str, Path]], out_dir: Path, state: dict | None = None,
+                       changed: set[str] = frozenset()) -> dict:
+    """
+    books（古い順の (book_id, book_plan.json)）から out_dir にインデックスを書く。
+    state は前回の戻り値（{"ids": [...], "shards": {...}}）。前回の本の並びのままで
+    末尾に本が増えただけなら、増えた本の語が入るファイルだけ書き直す。
+    本の削除・変更（changed に入った既存の本）があれば全部作り直す。
+    新しい state を返す（build_shelf が shelf_manifest.json に保存する）。
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    ids = [book_id for book_id, _ in books]
+    state = state or {}
+    old_ids = state.get("ids", [])
+    old_shards = state.get("shards", {})
+
+    appended = (bool(old_ids) and old_ids == ids[:len(old_ids)] and not changed.intersection(old_ids)
+                and all((out_dir / f"s-{name}.json").exists() for name in old_shards))
+    if appended:
+        new_books = books[len(old_ids):]
+        start = len(old_ids)
+        shards = dict(old_shards)
+    else:
+        new_books = books
+        start = 0
+        shards = {}
+
+    grouped: dict[str, dict[str, list[int]]] = defaultdict(lambda: defaultdict(list))
+    for n, (_, plan_path) in enumerate(new_books, start):
+        for term in book_terms(_read_plan(plan_path)):
+            grouped[shard_of(term)][term].append(n)
+
+    for name, postings in grouped.items():
+        if appended and name in old_shards:
+            shards[name] = _append_shard(out_dir, name, postings)
+        else:
+            shards[name] = _write_shard(out_dir, name, _encode(postings), old_shards.get(name))
+
+    if not appended:
+        for p in out_dir.glob("s-*.json"):
+            if p.stem[2:] not in shards:
+                p.unlink()
+
+    meta = {"total": len(ids), "shards": dict(sorted(shards.items()))}
+    atomic_write_bytes(out_dir / "meta.json", json.dumps(meta, separators=(",", ":")).encode("utf-8"))
+    print(f"🔎 Search index: {len(ids)} books, {len(grouped)} shards updated"
+          f" ({'append' if appended else 'full rebuild'}) → {out_dir.as_posix()}")
+    return {"ids": ids, "shards": meta["shards"]}
+
+
+def query_terms(query: str) -> list[str]:
+    """検索語を tokenize と同じ規則で分ける（順序を保ち重複を除く）。"""
+    terms = []
+    for m in _TOKEN_RE.finditer(normalize(query)):
+        terms += [g for g in _grams(m.group()) if g not in terms]
+    return terms
+
+
+def search(out_dir: Path, query: str, limit: int = 50) -> list[int]:
+    """
+    ブラウザ側（docs/index.html）と同じ手順の検索。本の番号を新しい順に返す。
+    1文字の日本語と英単語は前方一致（同じファイル内の語を全部見る）、それ以外は完全一致。
+    全部の語を含む本だけを返す。
+    """
+    loaded: dict[str, dict[str, list[int]]] = {}
+    result: set[int] | None = None
+    for term in query_terms(query):
+        name = shard_of(term)
+        if name not in loaded:
+            path = out_dir / f"s-{name}.json"
+            loaded[name] = _decode(path.read_bytes()) if path.exists() else {}
+        postings = loaded[name]
+        if len(term) == 1 or _is_word(term):
+            hits = set()
+            for t, nums in postings.items():
+                if t.startswith(term):
+                    hits.update(nums)
+        else:
+            hits = set(postings.get(term, ()))
+        result = hits if result is None else result & hits
+        if not result:
+            return []
+    return sorted(result or (), reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the shelf search index (built by build_shelf.py)")
+    parser.add_argument("query")
+    parser.add_argument("--dir", type=Path, default=Path("docs") / SEARCH_NAME)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    from build_shelf import MANIFEST_NAME, load_manifest
+    ids = load_manifest(args.dir.parent / MANIFEST_NAME).get("search", {}).get("ids", [])
+
+    t0 = time.perf_counter()
+    hits = search(args.dir, args.query, args.limit)
+    print(f"🔎 {args.query!r}: {len(hits)} hits in {(time.perf_counter() - t0) * 1000:.1f}ms")
+    for n in hits:
+        print("  ", ids[n] if n < len(ids) else n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+処理時間の計測（スパン）。
+
+    with span("images", cat="stage"):
+        ...
+
+スパンごとに、経過時間・CPU 時間（そのスレッド分）・読み書きしたバイト数（そのスレッド分、
+Linux の /proc/thread-self/io。ソケットも含む）・API 呼び出し回数（count() の回数）を記録する。
+どれもスレッドごとに数えるので、同時に走るスパン同士で混ざらない。ワーカースレッドに仕事を渡すときは
+bind(fn) で包むと、そのスレッドでの API 呼び出しも渡した側のスパン（images の工程など）に入る。
+記録は Chrome の trace 形式（chrome://tracing や https://ui.perfetto.dev で開ける）で書き出すか、
+summary_table() で表にする。プロセスプールのワーカーの記録は drain() / merge() で親に集める。
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+_events: list[dict] = []
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _active() -> list[dict[str, int]]:
+    """このスレッドで count() を数えるスパンの回数表（開いているスパン＋bind で受け継いだスパン）。"""
+    if not hasattr(_local, "active"):
+        _local.active = []
+    return _local.active
+
+
+def count(name: str, n: int = 1) -> None:
+    """回数を数える（api.images など）。このスレッドで開いているスパンと、受け継いだスパンに入る。"""
+    active = _active()
+    if active:
+        with _lock:
+            for counters in active:
+                counters[name] += n
+
+
+def bind(fn):
+    """
+    今開いているスパンを受け継いで fn を呼ぶ関数を返す（ThreadPoolExecutor.submit に渡す用）。
+    ワーカースレッドでの count() が、submit した側のスパンにも入る。
+    """
+    parents = list(_active())
+
+    def run(*args, **kwargs):
+        saved = _active()
+        _local.active = parents + saved
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.active = saved
+    return run
+
+
+def _io_bytes() -> tuple[int, int]:
+    """このスレッドが読み書きしたバイト数（取れない環境では 0, 0）。"""
+    try:
+        with open("/proc/thread-self/io", "rb") as f:
+            data = f.read()
+    except OSError:
+        return 0, 0
+    fields = dict(line.split(b": ") for line in data.splitlines() if b": " in line)
+    return int(fields.get(b"rchar", 0)), int(fields.get(b"wchar", 0))
+
+
+def _now_us() -> int:
+    return time.time_ns() // 1000
+
+
+@contextmanager
+def span(name: str, cat: str = "stage", **args):
+    counters: dict[str, int] = defaultdict(int)
+    _active().append(counters)
+    read0, write0 = _io_bytes()
+    cpu0 = time.thread_time()
+    ts = _now_us()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - t0
+        cpu = time.thread_time() - cpu0
+        read1, write1 = _io_bytes()
+        active = _active()
+        # 中身が同じ別のスパンを消さないよう、同じオブジェクトを探して外す
+        del active[next(i for i, c in enumerate(active) if c is counters)]
+        with _lock:
+            calls = dict(counters)
+            _events.append({
+                "name": name, "cat": cat, "ph": "X", "ts": ts, "dur": int(wall * 1e6),
+                "pid": os.getpid(), "tid": threading.get_ident(),
+                "args": {**args, "wall_s": round(wall, 4), "cpu_s": round(cpu, 4),
+                         "read_bytes": read1 - read0, "write_bytes": write1 - write0, **calls},
+            })
+
+
+def process_start_us() -> int | None:
+    """このプロセスが起動した時刻（Linux のみ。インタプリタの起動時間を出すのに使う）。"""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            start_ticks = int(f.read().rsplit(b")", 1)[1].split()[19])
+        with open("/proc/stat", "rb") as f:
+            btime = next(int(line.split()[1]) for line in f if line.startswith(b"btime"))
+    except (OSError, ValueError, StopIteration, IndexError):
+        return None
+    return int((btime + start_ticks / os.sysconf("SC_CLK_TCK")) * 1e6)
+
+
+def record_startup(name: str = "startup") -> None:
+    """プロセス起動から今まで（インタプリタの起動＋import）を1つのスパンとして記録する。"""
+    start = process_start_us()
+    if start is None:
+        return
+    now = _now_us()
+    with _lock:
+        _events.append({"name": name, "cat": "process", "ph": "X", "ts": start, "dur": max(0, now - start),
+                        "pid": os.getpid(), "tid": threading.get_ident(),
+                        "args": {"wall_s": round((now - start) / 1e6, 4)}})
+
+
+def drain() -> list[dict]:
+    """記録を取り出して空にする（プロセスプールのワーカーから親に返す用）。"""
+    with _lock:
+        events = list(_events)
+        _events.clear()
+    return events
+
+
+def merge(events: list[dict]) -> None:
+    with _lock:
+        _events.extend(events)
+
+
+def events() -> list[dict]:
+    with _lock:
+        return list(_events)
+
+
+def write_chrome_trace(path: Path) -> Path:
+    """Chrome / Perfetto で開ける trace JSON を書く。"""
+    evs = events()
+    base = min((e["ts"] for e in evs), default=0)
+    trace = {"traceEvents": [{**e, "ts": e["ts"] - base} for e in sorted(evs, key=lambda e: e["ts"])],
+             "displayTimeUnit": "ms"}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(trace, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def summary_table(cats: tuple[str, ...] = ("process", "stage")) -> str:
+    """cats のスパンは1行ずつ、それ以外（ページなど）は cat ごとにまとめた表。"""
+    rows: dict[str, dict] = {}
+    for e in events():
+        key = e["name"] if e["cat"] in cats else f"{e['cat']} (x{{n}})"
+        r = rows.setdefault(key, {"n": 0, "wall_s": 0.0, "cpu_s": 0.0, "read_bytes": 0, "write_bytes": 0,
+                                  "api": 0})
+        a = e["args"]
+        r["n"] += 1
+        r["wall_s"] += a.get("wall_s", 0.0)
+        r["cpu_s"] += a.get("cpu_s", 0.0)
+        r["read_bytes"] += a.get("read_bytes", 0)
+        r["write_bytes"] += a.get("write_bytes", 0)
+        r["api"] += sum(v for k, v in a.items() if k.startswith("api."))
+
+    lines = [f"{'span':<22}{'wall s':>9}{'cpu s':>9}{'read MB':>10}{'write MB':>10}{'api':>6}"]
+    for key, r in rows.items():
+        lines.append(f"{key.format(n=r['n']):<22}{r['wall_s']:>9.2f}{r['cpu_s']:>9.2f}"
+                     f"{r['read_bytes'] / 1e6:>10.2f}{r['write_bytes'] / 1e6:>10.2f}{r['api']:>6}")
+    return "\n".join(lines)
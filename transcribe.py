@@ -1,35 +1,74 @@
-import os
+import argparse
 from pathlib import Path
-from dotenv import load_dotenv
-from openai import OpenAI
 
-load_dotenv()
+from api_client import call_api, get_client
+from audio_chunks import DEFAULT_OVERLAP, DEFAULT_WINDOW, transcribe_long
+from audio_prep import prepare_audio
+import tracing
 
 INPUT_PATH = Path("input/test01.mp3")  # もしmp3なら audio.mp3 に変更
 OUT_DIR = Path("work")
-OUT_DIR.mkdir(parents=True, exist_ok=True)
+OUT_PATH = OUT_DIR / "transcript.txt"
+MODEL = "gpt-4o-mini-transcribe"
 
-def main():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY が見つかりません。.env を確認してください。")
+# アップロード上限（25MB）に近いファイルは自動で分割モードにする
+CHUNK_THRESHOLD_BYTES = 24 * 1024 * 1024
+
+def transcribe(input_path: Path = INPUT_PATH, out_path: Path = OUT_PATH, *, chunked: bool | None = None,
+               window: float = DEFAULT_WINDOW, overlap: float = DEFAULT_OVERLAP, split: str = "silence",
+               workers: int = 4, client=None, journal=None, prep: bool = True, force: bool = False) -> str:
+    """
+    音声を文字起こしして out_path に保存し、テキストを返す。
+    prep=True なら送る前に audio_prep で小さくする（モノラル・16kHz・前後の無音を切って Opus に）。
+    chunked=True（または None で大きいファイル）のときは区間に分けて並列に文字起こしする。
+    journal を渡すと区間ごとの結果を記録し、記録済みの区間は文字起こしし直さない（force=True なら直す）。
+    """
+    if not input_path.exists():
+        raise FileNotFoundError(f"音声ファイルがありません: {input_path}")
 
-    if not INPUT_PATH.exists():
-        raise FileNotFoundError(f"音声ファイルがありません: {INPUT_PATH}")
+    client = client or get_client()
+    if prep:
+        with tracing.span("audio_prep", cat="prep"):
+            input_path = prepare_audio(input_path)
 
-    client = OpenAI(api_key=api_key)
+    def transcribe_file(path: Path) -> str:
+        # 文字起こし（最小構成）。リトライのたびにファイルを開き直す
+        def call():
+            with path.open("rb") as f:
+                return client.audio.transcriptions.create(
+                    model=MODEL,
+                    file=f,
+                )
+        return call_api("transcription", call, label=path.name).text
 
-    # 文字起こし（最小構成）
-    with INPUT_PATH.open("rb") as f:
-        result = client.audio.transcriptions.create(
-            model="gpt-4o-mini-transcribe",
-            file=f,
-        )
+    if chunked is None:
+        chunked = input_path.stat().st_size > CHUNK_THRESHOLD_BYTES
 
     # 出力
-    text = result.text
-    (OUT_DIR / "transcript.txt").write_text(text, encoding="utf-8")
-    print("✅ transcript saved:", OUT_DIR / "transcript.txt")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    if chunked:
+        text = transcribe_long(input_path, transcribe_file, out_path,
+                               window=window, overlap=overlap, split=split, workers=workers, journal=journal,
+                               force=force)
+    else:
+        text = transcribe_file(input_path)
+    out_path.write_text(text, encoding="utf-8")
+    print("✅ transcript saved:", out_path)
+    return text
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=Path, default=INPUT_PATH, help="文字起こしする音声ファイル")
+    parser.add_argument("--chunked", action="store_true", help="区間に分けて並列に文字起こしする（大きいファイルは自動）")
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW, help="1区間の長さ（秒）")
+    parser.add_argument("--overlap", type=float, default=DEFAULT_OVERLAP, help="区間の重なり（秒）")
+    parser.add_argument("--split", choices=["silence", "fixed"], default="silence", help="区切り方")
+    parser.add_argument("--workers", type=int, default=4, help="同時に文字起こしする区間数")
+    parser.add_argument("--no-prep", action="store_true", help="音声を変換せずにそのまま送る")
+    args = parser.parse_args()
+
+    text = transcribe(args.input, chunked=args.chunked or None, window=args.window, overlap=args.overlap,
+                      split=args.split, workers=args.workers, prep=not args.no_prep)
     print("\n--- transcript preview ---\n")
     print(text[:800])
 